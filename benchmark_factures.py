@@ -0,0 +1,384 @@
+"""Banc d'essai de moteur_factures sur des données synthétiques.
+
+Génère une base centrale au format Base_Centrale_Cocody (N sites x M mois), des fichiers de
+factures CIE BT / HT et des templates FACTURAT, puis mesure à plusieurs échelles :
+écriture complète / chargement de la base, sauvegarde de l'éditeur (écritures incrémentales
+publiées), import BT / HT, remplissage des templates (Génération),
+exports Excel et agrégation des Statistiques. Pour chaque étape : durée, débit (lignes/s)
+et pic de mémoire résidente ; les résultats sont aussi écrits dans un fichier JSON.
+
+Le démarrage à froid est mesuré dans un interpréteur neuf (import du moteur, premier rerun du
+script de l'application jusqu'à la navigation avec streamlit.testing, préchargement de la base) ;
+le code de sortie est 1 si l'import et la navigation dépassent --seuil-demarrage, si la navigation
+n'a pas pu être mesurée (streamlit absent) ou si le moteur ou l'application importent openpyxl /
+plotly au démarrage (en plus de ce que streamlit charge lui-même).
+
+    python benchmark_factures.py
+    python benchmark_factures.py --echelles 500x12 5000x24 --stockage sqlite parquet --sortie bench.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import subprocess
+import platform
+import tempfile
+import threading
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from moteur_factures import (
+    COLONNES_CENTRALE, CONFIG_FACTURES,
+    separer_base, joindre_base, charger_base, upserter_faits, appliquer_changements_editeur,
+    sauvegarder_base_sqlite, sauvegarder_base_parquet, charger_stockage, enregistrer_stockage,
+    base_partagee, publier_ecritures,
+    construire_cube, interroger_cube, lire_factures, importer_factures, remplir_template,
+    export_base_centrale, export_factures_cie,
+)
+
+ECHELLES_DEFAUT = ['200x12', '2000x24', '10000x36']
+MODULES_DIFFERES = ['openpyxl', 'plotly']
+APPLICATION = 'gestion_factures_amelioree (8).py'
+PAGE_SANS_BASE = '🧵 Travaux'
+LIGNES_EDITEES = 100
+REPETITIONS_DEMARRAGE = 3
+TENSIONS = {'BT': 'BASSE', 'HT': 'HAUTE'}
+UCS = ['UC NORD', 'UC SUD', 'UC EST', 'UC OUEST', 'UC CENTRE']
+
+
+# === DONNÉES SYNTHÉTIQUES ===
+def periodes_synthetiques(nb_mois, debut=202001):
+    """nb_mois périodes AAAAMM consécutives"""
+    annee, mois = divmod(debut, 100)
+    rang = np.arange(nb_mois) + (mois - 1)
+    return ((annee + rang // 12) * 100 + rang % 12 + 1).tolist()
+
+def generer_base_centrale(nb_sites, nb_mois, graine=0):
+    """Base centrale à plat (colonnes de Base_Centrale_Cocody) : une ligne par site et par mois"""
+    rng = np.random.default_rng(graine)
+    identifiants = np.array([f"{100000000 + i}" for i in range(nb_sites)])
+    tension = np.where(rng.random(nb_sites) < 0.8, 'BASSE', 'HAUTE')
+    sites = pd.DataFrame({
+        'UC': rng.choice(UCS, nb_sites),
+        'CODE AGCE': rng.integers(100, 200, nb_sites).astype(str),
+        'SITES': [f"SITE {i // 3:05d}" for i in range(nb_sites)],
+        'CORRESPONDANCE': rng.choice(['AGENCE', 'DIRECTION', 'GUICHET', 'DAB'], nb_sites),
+        'IDENTIFIANT': identifiants,
+        'REFERENCE': [f"REF{i:08d}" for i in range(nb_sites)],
+        'TENSION': tension,
+    })
+    periodes = periodes_synthetiques(nb_mois)
+    df = sites.loc[sites.index.repeat(nb_mois)].reset_index(drop=True)
+    df['DATE'] = np.tile(periodes, nb_sites)
+    df['CONSO'] = rng.gamma(2.0, 400.0, len(df)).round(0)
+    df['MONTANT'] = (df['CONSO'] * rng.uniform(80, 140, len(df))).round(0)
+    return df[COLONNES_CENTRALE]
+
+def generer_factures(df_sites, type_tension, periode, graine=1):
+    """Fichier de factures CIE d'une période pour les sites de la tension, avec ses colonnes annexes
+    et 2 % de références inconnues de la base"""
+    rng = np.random.default_rng(graine)
+    config = CONFIG_FACTURES[type_tension]
+    cles = df_sites.index[df_sites['TENSION'] == TENSIONS[type_tension]].tolist()
+    inconnues = [f"9{i:09d}" for i in range(max(1, len(cles) // 50))]
+    cles = cles + inconnues
+    conso = rng.gamma(2.0, 400.0, len(cles)).round(0)
+    return pd.DataFrame({
+        'numero facture': np.arange(len(cles)) + 1,
+        config['cle']: cles,
+        'nom client': 'CLIENT',
+        'adresse': 'ABIDJAN COCODY',
+        config['montant']: (conso * rng.uniform(80, 140, len(cles))).round(0),
+        config['conso']: conso,
+        config['caract']: periode,
+        'date echeance': '30/01/2025',
+    })
+
+def generer_template(df_sites, type_tension):
+    """Template FACTURAT : une ligne comptable par site de la tension"""
+    cles = df_sites.index[df_sites['TENSION'] == TENSIONS[type_tension]]
+    return pd.DataFrame({
+        'JOURNAL': 'ACH',
+        'COMPTE DE CHARGES': '605110',
+        'IDENTIFIANT': cles,
+        'SENS': 'D',
+        'MONTANT': 0.0,
+        'LIBELLE COMPLEMENTAIRE': '',
+    })
+
+
+# === MESURES ===
+# Le pic mémoire est la mémoire résidente maximale observée pendant l'étape, moins celle du
+# départ, échantillonnée par un thread : tracemalloc ralentirait les exports openpyxl de 5 à 6x.
+PAS_ECHANTILLON = 0.005
+
+def memoire_residente():
+    """Mémoire résidente du processus en octets (psutil si installé, sinon /proc), None si indisponible"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def mesurer(resultats, contexte, etape, lignes, fonction, *args, **kwargs):
+    """Exécute une étape en mesurant durée et pic mémoire ; retourne son résultat"""
+    depart = memoire_residente()
+    pic = [depart]
+    fin = threading.Event()
+
+    def echantillonner():
+        while not fin.wait(PAS_ECHANTILLON):
+            pic[0] = max(pic[0], memoire_residente())
+
+    if depart is not None:
+        threading.Thread(target=echantillonner, daemon=True).start()
+    debut = time.perf_counter()
+    try:
+        resultat = fonction(*args, **kwargs)
+    finally:
+        duree = time.perf_counter() - debut
+        fin.set()
+
+    pic_mo = (max(pic[0], memoire_residente()) - depart) / 2 ** 20 if depart is not None else None
+    mesure = dict(contexte, etape=etape, lignes=int(lignes), duree_s=round(duree, 4),
+                  debit_lignes_s=round(lignes / duree, 1) if duree > 0 else None,
+                  pic_memoire_mo=round(pic_mo, 1) if pic_mo is not None else None)
+    resultats.append(mesure)
+    print(f"  {etape:<28} {lignes:>10} lignes {duree:>9.3f} s "
+          f"{mesure['debit_lignes_s'] or 0:>12.0f} l/s {mesure['pic_memoire_mo'] or 0:>9.1f} Mo", flush=True)
+    return resultat
+
+def _importer(stockage, df_sites, df_faits, chemin, type_tension):
+    """Chaîne d'import d'un fichier : lecture, jointure aux sites, upsert et écriture au stockage"""
+    df_factures = lire_factures(chemin, type_tension)
+    df_faits, ecritures = upserter_faits(df_faits, importer_factures(df_sites, df_factures, type_tension))
+    enregistrer_stockage(stockage, ecritures)
+    return df_faits
+
+def _ecritures_editeur(df_sites, df_faits, nb_lignes=LIGNES_EDITEES):
+    """Écritures d'une sauvegarde de l'éditeur : MONTANT modifié sur nb_lignes de la dernière période"""
+    df_vue = joindre_base(df_sites, df_faits[df_faits['DATE'] == df_faits['DATE'].max()])
+    changements = {'edited_rows': {
+        position: {'MONTANT': float(montant) + 1}
+        for position, montant in enumerate(df_vue['MONTANT'].iloc[:nb_lignes])
+    }}
+    return appliquer_changements_editeur(df_sites, df_faits, df_vue, changements)[2]
+
+# Exécuté dans un interpréteur neuf, dans le dossier du stockage (chemins relatifs de l'application) :
+# import du moteur, puis premier rerun du script de l'application avec streamlit.testing jusqu'à la
+# navigation (page Travaux, qui n'attend pas la base), puis fin du préchargement de la base.
+# Les modules lourds sont relevés après l'import du moteur, puis ceux que le script ajoute à ce
+# qu'un simple `import streamlit` charge déjà (streamlit importe lui-même plotly, par exemple).
+# Sans streamlit, la navigation n'est pas mesurée (None) et seul le préchargement est chronométré.
+_SCRIPT_DEMARRAGE = """
+import sys, json, time, importlib.util
+stockage, modules, application, page, delai = json.loads(sys.argv[1])
+debut = time.perf_counter()
+import moteur_factures
+duree_import = time.perf_counter() - debut
+importes = {m for m in modules if m in sys.modules}
+debut = time.perf_counter()
+duree_navigation = None
+if importlib.util.find_spec('streamlit') is not None:
+    import streamlit
+    from streamlit.testing.v1 import AppTest
+    deja_charges = set(sys.modules)
+    app = AppTest.from_file(application, default_timeout=delai)
+    app.session_state['page'] = page
+    app.run()
+    if app.exception:
+        raise SystemExit(f"échec du script de l'application : {app.exception[0].message}")
+    if not app.sidebar.radio:
+        raise SystemExit("navigation absente de la barre latérale")
+    duree_navigation = time.perf_counter() - debut
+    importes |= {m for m in modules if m in sys.modules and m not in deja_charges}
+moteur_factures.prechauffer_base(stockage).result()
+print(json.dumps({
+    'demarrage_import': duree_import,
+    'demarrage_navigation': duree_navigation,
+    'demarrage_base': time.perf_counter() - debut,
+    'modules': sorted(importes),
+}))
+"""
+
+def mesurer_demarrage(resultats, contexte, stockage, lignes, delai):
+    """Démarrage à froid (médiane de REPETITIONS_DEMARRAGE interpréteurs neufs)"""
+    dossier_moteur = os.path.dirname(os.path.abspath(__file__))
+    dossier_stockage, nom_stockage = os.path.split(os.path.abspath(stockage['chemin']))
+    arguments = [{'format': stockage['format'], 'chemin': nom_stockage}, MODULES_DIFFERES,
+                 os.path.join(dossier_moteur, APPLICATION), PAGE_SANS_BASE, delai]
+    env = dict(os.environ, FACTURES_STOCKAGE=stockage['format'],
+               PYTHONPATH=os.pathsep.join(filter(None, [dossier_moteur, os.environ.get('PYTHONPATH')])))
+    essais = []
+    for _ in range(REPETITIONS_DEMARRAGE):
+        sortie = subprocess.run(
+            [sys.executable, '-c', _SCRIPT_DEMARRAGE, json.dumps(arguments)],
+            cwd=dossier_stockage, env=env, capture_output=True, text=True
+        )
+        if sortie.returncode:
+            raise RuntimeError(f"démarrage de l'application en échec :\n{sortie.stderr.strip()}")
+        essais.append(json.loads(sortie.stdout.strip().splitlines()[-1]))
+
+    modules = sorted({m for essai in essais for m in essai['modules']})
+    for etape in ('demarrage_import', 'demarrage_navigation', 'demarrage_base'):
+        durees = [essai[etape] for essai in essais if essai[etape] is not None]
+        duree = round(float(np.median(durees)), 4) if durees else None
+        resultats.append(dict(contexte, etape=etape, lignes=int(lignes), duree_s=duree,
+                              debit_lignes_s=None, pic_memoire_mo=None, modules_importes=modules))
+        print(f"  {etape:<28} {lignes:>10} lignes "
+              + (f"{duree:>9.3f} s" if duree is not None else "  non mesuré (streamlit absent)")
+              + (f"   modules importés : {', '.join(modules)}" if modules else ''), flush=True)
+
+def controler_demarrage(resultats, seuil):
+    """Erreurs du garde-fou de démarrage : import + navigation au-delà du seuil ou non mesurée,
+    modules lourds importés par le moteur ou le script de l'application"""
+    erreurs = []
+    for mesure in resultats:
+        if mesure['etape'] == 'demarrage_navigation':
+            if mesure['modules_importes']:
+                erreurs.append(f"{', '.join(mesure['modules_importes'])} importé(s) au démarrage")
+            if mesure['duree_s'] is None:
+                erreurs.append(f"{mesure['sites']}x{mesure['mois']} {mesure['stockage']} : "
+                               "navigation non mesurée (streamlit absent), garde-fou non vérifié")
+                continue
+            import_nav = mesure['duree_s'] + next(
+                m['duree_s'] for m in resultats
+                if m['etape'] == 'demarrage_import' and m['sites'] == mesure['sites'] and m['mois'] == mesure['mois']
+                and m['stockage'] == mesure['stockage']
+            )
+            if import_nav > seuil:
+                erreurs.append(f"{mesure['sites']}x{mesure['mois']} {mesure['stockage']} : "
+                               f"navigation après {import_nav:.2f} s (seuil {seuil} s)")
+    return erreurs
+
+def _statistiques(cube, df_sites):
+    """Requêtes de la page Statistiques : global, par tension et pour un site"""
+    site = df_sites['SITES'].iloc[0]
+    return [interroger_cube(cube, filtres) for filtres in
+            ({}, {'TENSION': 'BASSE'}, {'TENSION': 'HAUTE'}, {'SITES': site})]
+
+def executer_echelle(nb_sites, nb_mois, formats, dossier, resultats, max_lignes_excel, delai_demarrage):
+    """Toutes les étapes pour une échelle, pour chaque format de stockage"""
+    df_central = generer_base_centrale(nb_sites, nb_mois)
+    lignes = len(df_central)
+    contexte = {'sites': nb_sites, 'mois': nb_mois}
+    print(f"\n=== {nb_sites} sites x {nb_mois} mois = {lignes} lignes ===")
+
+    if lignes <= max_lignes_excel:
+        fichier_excel = os.path.join(dossier, 'Base_Centrale_Cocody.xlsx')
+        df_central.to_excel(fichier_excel, index=False)
+        mesurer(resultats, contexte, 'migration_excel', lignes,
+                charger_base, os.path.join(dossier, 'absent.pkl'), fichier_excel)
+    df_sites, df_faits = separer_base(df_central)
+
+    # Fichiers de factures d'une nouvelle période
+    periode = periodes_synthetiques(nb_mois + 1)[-1]
+    fichiers = {}
+    for type_tension in CONFIG_FACTURES:
+        fichiers[type_tension] = os.path.join(dossier, f"factures_{type_tension}_{periode}.xlsx")
+        generer_factures(df_sites, type_tension, periode).to_excel(fichiers[type_tension], index=False)
+
+    # Un dossier de stockage par échelle : la base partagée du processus est indexée par chemin
+    dossier_stockage = os.path.join(dossier, f"{nb_sites}x{nb_mois}")
+    os.makedirs(dossier_stockage, exist_ok=True)
+    for format_stockage in formats:
+        stockage = {'format': format_stockage,
+                    'chemin': os.path.join(dossier_stockage, 'data_centrale.db' if format_stockage == 'sqlite'
+                                           else 'data_centrale_parquet')}
+        ctx = dict(contexte, stockage=format_stockage)
+        print(f"-- stockage {format_stockage}")
+        if format_stockage == 'sqlite':
+            mesurer(resultats, ctx, 'ecriture_complete', lignes, sauvegarder_base_sqlite, stockage['chemin'], df_sites, df_faits)
+        else:
+            mesurer(resultats, ctx, 'ecriture_complete', lignes, sauvegarder_base_parquet, stockage['chemin'], df_sites, df_faits)
+        sites_charges, faits_charges = mesurer(resultats, ctx, 'chargement', lignes, charger_stockage, stockage)
+        mesurer_demarrage(resultats, ctx, stockage, lignes, delai_demarrage)
+
+        # Sauvegarde de l'éditeur : écritures incrémentales publiées dans la base partagée
+        ecritures = _ecritures_editeur(sites_charges, faits_charges)
+        base_partagee(stockage)
+        mesurer(resultats, ctx, 'sauvegarde', len(ecritures['faits']), publier_ecritures, stockage, ecritures)
+
+        for type_tension, chemin in fichiers.items():
+            nb_factures = len(lire_factures(chemin, type_tension))
+            mesurer(resultats, ctx, f'lecture_factures_{type_tension}', nb_factures, lire_factures, chemin, type_tension)
+            faits_charges = mesurer(resultats, ctx, f'import_{type_tension}', nb_factures,
+                                    _importer, stockage, sites_charges, faits_charges, chemin, type_tension)
+        if format_stockage == 'sqlite':
+            os.remove(stockage['chemin'])
+        else:
+            shutil.rmtree(stockage['chemin'])
+
+    # Génération, exports et Statistiques ne dépendent pas du stockage. Les templates sont
+    # remplis avec la période qui vient d'être importée.
+    df_importes = pd.concat([importer_factures(df_sites, lire_factures(chemin, type_tension), type_tension)
+                             for type_tension, chemin in fichiers.items()])
+    df_periode = joindre_base(df_sites, upserter_faits(df_faits, df_importes)[0].query('DATE == @periode'),
+                              ['SITES', 'IDENTIFIANT', 'MONTANT', 'DATE'])
+    for type_tension in CONFIG_FACTURES:
+        df_template = generer_template(df_sites, type_tension)
+        df_export, _ = mesurer(resultats, contexte, f'generation_{type_tension}', len(df_template),
+                               remplir_template, df_template, df_periode, type_tension, periode)
+        mesurer(resultats, contexte, f'export_factures_cie_{type_tension}', len(df_export),
+                export_factures_cie, df_export.drop(columns=['IDENTIFIANT']), type_tension)
+
+    mesurer(resultats, contexte, 'export_base_centrale', lignes, export_base_centrale, joindre_base(df_sites, df_faits))
+    cube = mesurer(resultats, contexte, 'statistiques_cube', lignes, construire_cube, df_sites, df_faits)
+    mesurer(resultats, contexte, 'statistiques_requetes', len(cube), _statistiques, cube, df_sites)
+
+
+def _echelle(texte):
+    try:
+        nb_sites, nb_mois = (int(v) for v in texte.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"échelle invalide : {texte} (attendu SITESxMOIS, ex. 2000x24)")
+    return nb_sites, nb_mois
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Banc d'essai de moteur_factures sur données synthétiques")
+    parser.add_argument('--echelles', nargs='+', type=_echelle, default=[_echelle(e) for e in ECHELLES_DEFAUT],
+                        help="échelles SITESxMOIS (défaut : %(default)s)")
+    parser.add_argument('--stockage', nargs='+', choices=['sqlite', 'parquet'], default=['sqlite', 'parquet'])
+    parser.add_argument('--max-lignes-excel', type=int, default=100_000,
+                        help="au-delà, la migration depuis l'Excel initial n'est pas mesurée")
+    parser.add_argument('--seuil-demarrage', type=float, default=2.0,
+                        help="durée maximale (s) de l'import du moteur jusqu'à la navigation")
+    parser.add_argument('--delai-demarrage', type=float, default=120.0,
+                        help="délai (s) accordé au premier rerun de l'application avant échec")
+    parser.add_argument('--sortie', default=f"bench_factures_{datetime.now():%Y%m%d_%H%M%S}.json",
+                        help="fichier JSON des résultats")
+    args = parser.parse_args(argv)
+
+    resultats = []
+    with tempfile.TemporaryDirectory(prefix='bench_factures_') as dossier:
+        for nb_sites, nb_mois in args.echelles:
+            executer_echelle(nb_sites, nb_mois, args.stockage, dossier, resultats, args.max_lignes_excel,
+                             args.delai_demarrage)
+
+    with open(args.sortie, 'w', encoding='utf-8') as f:
+        json.dump({
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'python': sys.version.split()[0],
+            'pandas': pd.__version__,
+            'plateforme': platform.platform(),
+            'resultats': resultats,
+        }, f, ensure_ascii=False, indent=1)
+    print(f"\nRésultats écrits dans {args.sortie}")
+
+    erreurs = controler_demarrage(resultats, args.seuil_demarrage)
+    for erreur in erreurs:
+        print(f"❌ Démarrage : {erreur}")
+    return 1 if erreurs else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,188 @@
+"""Traitements de fin de mois sans interface : import de fichiers de factures CIE et génération
+des FACTURAT, avec la même logique que l'application Streamlit (même stockage, même registre
+des imports, mêmes fonctions d'import et d'export).
+
+    python factures_cli.py importer --tension BT factures_bt_janvier.xlsx factures_bt_fevrier.csv
+    python factures_cli.py generer --du 202401 --au 202412 --sortie FACTURAT_2024.zip
+    python factures_cli.py generer --periodes 202412 --tension HT --sortie facturat/
+"""
+import os
+import sys
+import time
+import zipfile
+import argparse
+
+from moteur_factures import (
+    CONFIG_FACTURES, migrer_vers_sqlite, migrer_vers_parquet, charger_stockage, base_partagee,
+    empreinte_fichier, lire_registre_imports, normaliser_periode, format_periode,
+    demarrer_mesures, terminer_mesures, resumer_mesures, TYPES_TRAVAUX,
+)
+
+# Fichiers par défaut : ceux de l'application
+FICHIER_CENTRAL = "Base_Centrale_Cocody.xlsx"
+SAVE_FILE_CENTRAL = "data_centrale.pkl"
+BASE_SQLITE = "data_centrale.db"
+DOSSIER_PARQUET = "data_centrale_parquet"
+DOSSIER_CACHE = ".cache_factures"
+REGISTRE_IMPORTS = "imports_factures.json"
+TEMPLATES = {"BT": "FACTURAT_ELECTRICITE_BT.xlsx", "HT": "FACTURAT_ELECTRICITE_HT.xlsx"}
+
+
+def stockage_configure(args):
+    """Stockage choisi en ligne de commande (par défaut celui de l'application, FACTURES_STOCKAGE)"""
+    chemin = args.chemin or (DOSSIER_PARQUET if args.stockage == "parquet" else BASE_SQLITE)
+    return {"format": args.stockage, "chemin": chemin}
+
+def charger_base_migree(stockage):
+    """Base partagée du processus, avec la migration initiale de load_central si nécessaire"""
+    def charger():
+        if stockage["format"] == "parquet":
+            ok = migrer_vers_parquet(stockage["chemin"], BASE_SQLITE, SAVE_FILE_CENTRAL, FICHIER_CENTRAL)
+        else:
+            ok = migrer_vers_sqlite(stockage["chemin"], SAVE_FILE_CENTRAL, FICHIER_CENTRAL)
+        if not ok:
+            raise FileNotFoundError(f"Fichier central '{FICHIER_CENTRAL}' introuvable !")
+        return charger_stockage(stockage)
+
+    return base_partagee(stockage, charger=charger)
+
+def afficher_avancement(lignes, lignes_total=None, etape=None, progression=None):
+    """Équivalent console du suivi des travaux"""
+    if etape is not None:
+        print(f"  … {etape}", flush=True)
+
+
+# === COMMANDES ===
+def commande_importer(args, stockage):
+    fichiers = []
+    registre = lire_registre_imports(args.registre)
+    for chemin in args.fichiers:
+        empreinte = empreinte_fichier(chemin)
+        deja_importe = registre.get(empreinte)
+        if deja_importe and not args.forcer:
+            print(f"⏭️ {chemin} : déjà importé le {deja_importe['date']} "
+                  f"(période {deja_importe['periode']}, {deja_importe['lignes']} ligne(s)) - ignoré, voir --forcer")
+            continue
+        fichiers.append({"fichier": chemin, "nom": os.path.basename(chemin), "empreinte": empreinte})
+    if not fichiers:
+        print("Aucun fichier à importer.")
+        return 0
+
+    charger_base_migree(stockage)
+    bilan = TYPES_TRAVAUX["import"]({
+        "tension": args.tension, "fichiers": fichiers, "stockage": stockage,
+        "registre": args.registre, "conserver_fichiers": True,
+    }, afficher_avancement)
+
+    resume = bilan["resume"]
+    print(f"✅ Import {args.tension} : {bilan['message']}")
+    print(f"   {bilan['lignes']} facture(s) lue(s), {bilan['rapprochees']} rapprochée(s), "
+          f"{bilan['lignes'] - bilan['rapprochees']} sans site, {resume['doublons_supprimes']} doublon(s) supprimé(s)")
+    if bilan["montants_illisibles"]:
+        print(f"⚠️ {bilan['montants_illisibles']} montant(s) illisible(s) : importé(s) vide(s), "
+              f"sans remplacer les montants déjà en base")
+    if resume["recouvrements"]:
+        print(f"⚠️ {resume['recouvrements']} clé(s) (IDENTIFIANT, période) présente(s) dans plusieurs fichiers : "
+              f"le montant du dernier fichier est retenu")
+
+    non_rapproches = bilan["non_rapproches"]
+    if len(non_rapproches):
+        print(f"🔎 {len(non_rapproches)} clé(s) sans site (par montant décroissant) :")
+        print(non_rapproches.head(20).to_string(index=False))
+        if args.non_rapproches:
+            non_rapproches.to_csv(args.non_rapproches, index=False, sep=";", encoding="utf-8-sig")
+            print(f"   Rapport complet écrit dans {args.non_rapproches}")
+    return 0
+
+def commande_generer(args, stockage):
+    base = charger_base_migree(stockage)
+    disponibles = base["index"]["valeurs"]["DATE"]
+    if not disponibles:
+        print("❌ Aucune période dans la base centrale")
+        return 1
+    if args.periodes:
+        periodes = [normaliser_periode(p) for p in args.periodes]
+        inconnues = [p for p in args.periodes if normaliser_periode(p) not in disponibles]
+        if inconnues:
+            print(f"⚠️ Période(s) absente(s) de la base : {', '.join(inconnues)}")
+    else:
+        du = normaliser_periode(args.du) if args.du else disponibles[0]
+        au = normaliser_periode(args.au) if args.au else disponibles[-1]
+        periodes = [p for p in disponibles if du <= p <= au]
+    periodes = [p for p in periodes if p in disponibles]
+    if not periodes:
+        print("❌ Aucune période à générer")
+        return 1
+
+    templates = {t: args.templates[t] for t in args.tension}
+    manquants = [chemin for chemin in templates.values() if not os.path.exists(chemin)]
+    if manquants:
+        print(f"❌ Template(s) introuvable(s) : {', '.join(manquants)}")
+        return 1
+
+    print(f"📦 {len(periodes)} période(s) ({format_periode(periodes[0])} → {format_periode(periodes[-1])}) "
+          f"x {len(templates)} tension(s)")
+    vers_dossier = not args.sortie.lower().endswith(".zip")
+    archive = os.path.join(args.sortie, "FACTURAT.zip") if vers_dossier else args.sortie
+    if vers_dossier:
+        os.makedirs(args.sortie, exist_ok=True)
+
+    bilan = TYPES_TRAVAUX["generation"]({
+        "templates": templates, "periodes": periodes, "stockage": stockage,
+        "dossier_cache": DOSSIER_CACHE, "sortie": archive,
+    }, afficher_avancement)
+
+    if vers_dossier:
+        with zipfile.ZipFile(archive) as zf:
+            zf.extractall(args.sortie)
+        os.remove(archive)
+
+    manifeste = bilan["manifeste"]
+    print(manifeste.drop(columns=["FICHIER"]).to_string(index=False))
+    print(f"✅ {bilan['message']} - {manifeste['LIGNES_MISES_A_JOUR'].sum()} ligne(s) mise(s) à jour "
+          f"sur {manifeste['LIGNES_TEMPLATE'].sum()}, écrit(s) dans {args.sortie}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import des factures CIE et génération des FACTURAT sans interface")
+    parser.add_argument("--stockage", choices=["sqlite", "parquet"], default=os.environ.get("FACTURES_STOCKAGE", "sqlite"))
+    parser.add_argument("--chemin", help="base SQLite ou dossier Parquet (défaut : celui de l'application)")
+    commandes = parser.add_subparsers(dest="commande", required=True)
+
+    importer = commandes.add_parser("importer", help="importer un ou plusieurs fichiers de factures")
+    importer.add_argument("--tension", choices=list(CONFIG_FACTURES), required=True)
+    importer.add_argument("fichiers", nargs="+", help="fichiers xlsx, xls ou csv (un ou plusieurs mois)")
+    importer.add_argument("--forcer", action="store_true", help="réimporter les fichiers déjà importés")
+    importer.add_argument("--registre", default=REGISTRE_IMPORTS)
+    importer.add_argument("--non-rapproches", help="fichier CSV du rapport des clés sans site")
+
+    generer = commandes.add_parser("generer", help="générer les FACTURAT d'une ou plusieurs périodes")
+    generer.add_argument("--periodes", nargs="+", help="périodes AAAAMM")
+    generer.add_argument("--du", help="première période AAAAMM (défaut : la plus ancienne)")
+    generer.add_argument("--au", help="dernière période AAAAMM (défaut : la plus récente)")
+    generer.add_argument("--tension", nargs="+", choices=list(CONFIG_FACTURES), default=list(CONFIG_FACTURES))
+    generer.add_argument("--template-bt", default=TEMPLATES["BT"])
+    generer.add_argument("--template-ht", default=TEMPLATES["HT"])
+    generer.add_argument("--sortie", default="FACTURAT.zip", help="archive .zip ou dossier des fichiers")
+
+    args = parser.parse_args(argv)
+    if args.commande == "generer":
+        args.templates = {"BT": args.template_bt, "HT": args.template_ht}
+
+    demarrer_mesures()
+    debut = time.perf_counter()
+    try:
+        code = {"importer": commande_importer, "generer": commande_generer}[args.commande](args, stockage_configure(args))
+    except (FileNotFoundError, ValueError) as erreur:
+        print(f"❌ {erreur}")
+        code = 1
+    mesures = resumer_mesures(terminer_mesures())
+    print(f"\n⏱ {time.perf_counter() - debut:.2f} s")
+    if len(mesures):
+        print(mesures.to_string(index=False))
+    return code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,24 @@
 import streamlit as st
 import pandas as pd
-import io
-import pickle
 import os
+import time
 from datetime import datetime
-import plotly.graph_objects as go
+from moteur_factures import (
+    joindre_base, appliquer_changements_editeur, doublons_faits,
+    charger_stockage, migrer_vers_sqlite,
+    migrer_vers_parquet, compacter_stockage, nb_changements_journal,
+    prechauffer_base, base_disponible, periodes_stockage, charger_periodes, modifier_base, interroger_cube, faits_periodes, format_periode, sans_categories,
+    lire_factures, periodes_factures, empreinte_fichier, lire_registre_imports, remplir_template, generer_lot_zip,
+    rapport_non_rapproches,
+    demarrer_travaux, soumettre_travail, lire_travail, lister_travaux,
+    lire_excel_cache, STATS_CACHE_EXCEL, empreinte_dataframe, soumettre_export, avancement_export, duree_export,
+    demarrer_mesures, terminer_mesures, enregistrer_mesure, mesure, resumer_mesures, taille_memoire,
+    journaliser_mesures
+)
+
+# Durées des étapes de ce rerun (panneau ⏱ Performance et journal des mesures)
+mesures_rerun = demarrer_mesures()
+DEBUT_RERUN = time.perf_counter()
 
 st.set_page_config(
     page_title="Gestion Factures - Historique par Ligne",
@@ -44,398 +58,237 @@ FICHIER_CENTRAL = "Base_Centrale_Cocody.xlsx"
 FICHIER_TEMPLATE_BT = "FACTURAT_ELECTRICITE_BT.xlsx"
 FICHIER_TEMPLATE_HT = "FACTURAT_ELECTRICITE_HT.xlsx"
 SAVE_FILE_CENTRAL = "data_centrale.pkl"
+BASE_SQLITE = "data_centrale.db"
+DOSSIER_PARQUET = "data_centrale_parquet"
+DOSSIER_CACHE = ".cache_factures"
+REGISTRE_IMPORTS = "imports_factures.json"
+BASE_TRAVAUX = "travaux.db"
+DOSSIER_TRAVAUX = ".travaux"
+JOURNAL_MESURES = "mesures_performance.jsonl"
+
+# Un rerun interrompu (st.rerun, st.stop, exception) n'atteint pas la fin du script : il reste en
+# session et est journalisé au début du rerun suivant, avec sa durée jusqu'à ce rerun.
+# Les reruns relancés par un suivi (export, travail en arrière-plan) ne sont pas journalisés.
+def journaliser_rerun(rerun, fin, memoire=None, interrompu=False):
+    """Ajoute un rerun (page, durée, étapes) au journal des mesures"""
+    if rerun["suivi"]:
+        return
+    journaliser_mesures(JOURNAL_MESURES, {
+        "date": rerun["date"],
+        "page": rerun["page"],
+        "duree_ms": round((fin - rerun["debut"]) * 1000, 1),
+        "etapes": resumer_mesures(rerun["mesures"]).set_index("ETAPE")["DUREE_MS"].to_dict(),
+        "memoire_mo": memoire,
+        "interrompu": interrompu,
+    })
+
+rerun_interrompu = st.session_state.pop("rerun_en_cours", None)
+if rerun_interrompu is not None:
+    journaliser_rerun(rerun_interrompu, DEBUT_RERUN, interrompu=True)
+st.session_state.rerun_en_cours = {
+    "date": datetime.now().isoformat(timespec="milliseconds"), "debut": DEBUT_RERUN, "page": None,
+    "mesures": mesures_rerun, "suivi": st.session_state.pop("rerun_suivi", False),
+}
+
+def terminer_rerun(fin):
+    """Ferme les mesures du rerun, affiche le panneau ⏱ Performance (barre latérale) et journalise le rerun"""
+    terminer_mesures()
+    with st.sidebar:
+        st.markdown("---")
+        panneau_perf = st.checkbox("⏱ Performance", key="panneau_performance")
+        memoire = None
+        if panneau_perf:
+            # Les DataFrames de la base sont partagés entre sessions (comptés une fois par session ici)
+            memoire = {cle: round(taille_memoire(valeur) / 2 ** 20, 2) for cle, valeur in st.session_state.items()}
+            st.caption(f"Rerun : **{(fin - DEBUT_RERUN) * 1000:.0f} ms** - page {page}")
+            if mesures_rerun:
+                st.dataframe(resumer_mesures(mesures_rerun), hide_index=True, use_container_width=True)
+            st.caption(f"Mémoire session_state : **{sum(memoire.values()):.1f} Mo**")
+            st.dataframe(
+                pd.Series(memoire, name="Mo").sort_values(ascending=False).head(10).rename_axis("Clé"),
+                use_container_width=True
+            )
+    journaliser_rerun(st.session_state.pop("rerun_en_cours"), fin, memoire)
+
+def relancer_suivi(delai):
+    """Rafraîchit un suivi après `delai` s : le rerun est terminé (panneau, journal) avant l'attente,
+    et le rerun relancé est marqué comme suivi"""
+    terminer_rerun(time.perf_counter())
+    st.session_state.rerun_suivi = True
+    time.sleep(delai)
+    st.rerun()
+
+# Format de stockage de la base centrale : "sqlite" ou "parquet" (snapshot partitionné par période)
+FORMAT_STOCKAGE = os.environ.get("FACTURES_STOCKAGE", "sqlite")
+STOCKAGE = {
+    "format": FORMAT_STOCKAGE,
+    "chemin": DOSSIER_PARQUET if FORMAT_STOCKAGE == "parquet" else BASE_SQLITE,
+}
 
 # Fonctions de chargement
 def load_central():
-    if os.path.exists(SAVE_FILE_CENTRAL):
-        with open(SAVE_FILE_CENTRAL, 'rb') as f:
-            return pickle.load(f)
-    elif os.path.exists(FICHIER_CENTRAL):
-        df = pd.read_excel(FICHIER_CENTRAL)
-        for col in ['MONTANT', 'CONSO', 'DATE']:
-            if col not in df.columns:
-                df[col] = None
-        return df
+    """Charge la base centrale : dimension sites + table de faits mensuels"""
+    # Migration unique depuis data_centrale.pkl ou Base_Centrale_Cocody.xlsx
+    if FORMAT_STOCKAGE == "parquet":
+        ok = migrer_vers_parquet(DOSSIER_PARQUET, BASE_SQLITE, SAVE_FILE_CENTRAL, FICHIER_CENTRAL)
     else:
-        st.error(f"❌ Fichier central '{FICHIER_CENTRAL}' introuvable !")
-        st.stop()
+        ok = migrer_vers_sqlite(BASE_SQLITE, SAVE_FILE_CENTRAL, FICHIER_CENTRAL)
+    
+    if not ok:
+        # Chargement exécuté hors du rerun (préchargement) : l'erreur est affichée par la page
+        raise FileNotFoundError(f"Fichier central '{FICHIER_CENTRAL}' introuvable !")
+    
+    return charger_stockage(STOCKAGE)
 
 def load_template_bt():
-    """Charge le template BT avec sa structure"""
+    """Charge le template BT avec sa structure (re-parsé seulement si le fichier a changé)"""
     if os.path.exists(FICHIER_TEMPLATE_BT):
-        return pd.read_excel(FICHIER_TEMPLATE_BT)
+        return lire_excel_cache(FICHIER_TEMPLATE_BT, DOSSIER_CACHE)
     return None
 
 def load_template_ht():
-    """Charge le template HT avec sa structure"""
+    """Charge le template HT avec sa structure (re-parsé seulement si le fichier a changé)"""
     if os.path.exists(FICHIER_TEMPLATE_HT):
-        return pd.read_excel(FICHIER_TEMPLATE_HT)
+        return lire_excel_cache(FICHIER_TEMPLATE_HT, DOSSIER_CACHE)
     return None
 
-def save_central(df):
-    with open(SAVE_FILE_CENTRAL, 'wb') as f:
-        pickle.dump(df, f)
+def save_central(df_vue, changements):
+    """Applique les changements de l'éditeur (faits désignés par leur id dans df_vue) à la
+    dernière version de la base, sous le verrou d'écriture : un import en arrière-plan a pu
+    publier une version depuis l'affichage. Rien n'est écrit si les changements créent des
+    doublons (IDENTIFIANT, DATE). Retourne (écritures, doublons)."""
+    def calculer(df_sites, df_faits):
+        df_faits_apres, ecritures = appliquer_changements_editeur(df_sites, df_faits, df_vue, changements)[1:]
+        doublons = doublons_faits(df_faits_apres, ecritures['faits'])
+        if doublons:
+            ecritures = dict(ecritures, sites=ecritures['sites'].iloc[:0], faits=ecritures['faits'].iloc[:0],
+                             supprimes=ecritures['supprimes'][:0])
+        return ecritures, doublons
 
-def export_base_centrale(df):
-    """Génère un fichier Excel avec le style pour la Base Centrale (vert)"""
-    output = io.BytesIO()
-    
-    # Couleurs vertes pour la base centrale
-    header_color = '375623'  # Vert foncé
-    col_header_color = '70AD47'  # Vert
-    
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        workbook = writer.book
-        worksheet = workbook.create_sheet('Base_Centrale')
-        
-        # Supprimer la feuille par défaut
-        if 'Sheet' in workbook.sheetnames:
-            del workbook['Sheet']
-        
-        from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
-        from openpyxl.utils import get_column_letter
-        
-        # === STYLES ===
-        header_fill = PatternFill(start_color=header_color, end_color=header_color, fill_type='solid')
-        header_font = Font(bold=True, size=16, color='FFFFFF', name='Calibri')
-        header_align = Alignment(horizontal='center', vertical='center')
-        
-        subtitle_font = Font(bold=True, size=12, color=header_color, name='Calibri')
-        subtitle_align = Alignment(horizontal='center', vertical='center')
-        
-        info_font = Font(bold=True, size=10, name='Calibri')
-        info_align = Alignment(horizontal='left', vertical='center')
-        
-        col_header_fill = PatternFill(start_color=col_header_color, end_color=col_header_color, fill_type='solid')
-        col_header_font = Font(bold=True, size=10, color='FFFFFF', name='Calibri')
-        col_header_align = Alignment(horizontal='center', vertical='center', wrap_text=True)
-        
-        thin_border = Border(
-            left=Side(style='thin', color='000000'),
-            right=Side(style='thin', color='000000'),
-            top=Side(style='thin', color='000000'),
-            bottom=Side(style='thin', color='000000')
-        )
-        
-        data_align = Alignment(horizontal='left', vertical='center')
-        data_font = Font(size=10, name='Calibri')
-        
-        # === CONSTRUCTION ===
-        nb_cols = len(df.columns)
-        
-        # Ligne 1-2: EN-TÊTE PRINCIPAL
-        worksheet.merge_cells(f'A1:{get_column_letter(nb_cols)}2')
-        cell = worksheet['A1']
-        cell.value = "📊 BASE CENTRALE - COCODY"
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = header_align
-        worksheet.row_dimensions[1].height = 25
-        worksheet.row_dimensions[2].height = 25
-        
-        # Ligne 3: SOUS-TITRE
-        worksheet.merge_cells(f'A3:{get_column_letter(nb_cols)}3')
-        cell = worksheet['A3']
-        cell.value = "HISTORIQUE COMPLET DES FACTURES ÉLECTRIQUES"
-        cell.font = subtitle_font
-        cell.alignment = subtitle_align
-        worksheet.row_dimensions[3].height = 20
-        
-        # Ligne 4: Date et statistiques
-        current_date = datetime.now().strftime('%d/%m/%Y %H:%M')
-        montant_total = df['MONTANT'].sum() if 'MONTANT' in df.columns else 0
-        
-        worksheet['A4'] = "Date d'export:"
-        worksheet['B4'] = current_date
-        worksheet['D4'] = "Montant Total"
-        worksheet['E4'] = f"{montant_total:,.0f} FCFA"
-        
-        for cell_ref in ['A4', 'D4']:
-            worksheet[cell_ref].font = info_font
-            worksheet[cell_ref].alignment = info_align
-        
-        for cell_ref in ['B4', 'E4']:
-            worksheet[cell_ref].font = data_font
-            worksheet[cell_ref].alignment = info_align
-        
-        # Ligne 5: Nombre de lignes et sites
-        sites_uniques = df['IDENTIFIANT'].nunique() if 'IDENTIFIANT' in df.columns else 0
-        
-        worksheet['A5'] = "Nombre de lignes:"
-        worksheet['B5'] = len(df)
-        worksheet['D5'] = "Sites uniques:"
-        worksheet['E5'] = sites_uniques
-        
-        for cell_ref in ['A5', 'D5']:
-            worksheet[cell_ref].font = info_font
-            worksheet[cell_ref].alignment = info_align
-        
-        for cell_ref in ['B5', 'E5']:
-            worksheet[cell_ref].font = data_font
-            worksheet[cell_ref].alignment = info_align
-        
-        worksheet.row_dimensions[5].height = 18
-        
-        # Ligne 6: Vide
-        worksheet.row_dimensions[6].height = 5
-        
-        # Ligne 7: EN-TÊTES DE COLONNES
-        row_header = 7
-        for col_idx, col_name in enumerate(df.columns, start=1):
-            cell = worksheet.cell(row=row_header, column=col_idx)
-            cell.value = col_name
-            cell.fill = col_header_fill
-            cell.font = col_header_font
-            cell.alignment = col_header_align
-            cell.border = thin_border
-        
-        worksheet.row_dimensions[row_header].height = 30
-        
-        # Lignes de données
-        for row_idx, row_data in enumerate(df.itertuples(index=False), start=row_header + 1):
-            for col_idx, value in enumerate(row_data, start=1):
-                cell = worksheet.cell(row=row_idx, column=col_idx)
-                cell.value = value
-                cell.font = data_font
-                cell.alignment = data_align
-                cell.border = thin_border
-                
-                # Formater les montants
-                if df.columns[col_idx - 1] == 'MONTANT' and value:
-                    cell.number_format = '#,##0'
-        
-        # === AJUSTER LARGEURS ===
-        col_widths = {
-            'UC': 10,
-            'CODE AGCE': 12,
-            'SITES': 25,
-            'CORRESPONDANCE': 20,
-            'IDENTIFIANT': 15,
-            'REFERENCE': 15,
-            'TENSION': 10,
-            'MONTANT': 12,
-            'CONSO': 12,
-            'DATE': 12
-        }
-        
-        for col_idx, col_name in enumerate(df.columns, start=1):
-            col_letter = get_column_letter(col_idx)
-            width = col_widths.get(col_name, 15)
-            worksheet.column_dimensions[col_letter].width = width
-    
-    output.seek(0)
-    return output
+    base, ecritures, doublons = modifier_base(STOCKAGE, calculer)
+    utiliser_base(base)
+    return ecritures, doublons
 
-def export_factures_cie(df, type_tension="BT"):
-    """Génère un fichier Excel avec le style CIE professionnel pour BT (bleu) ou HT (orange)"""
-    output = io.BytesIO()
-    
-    # Définir les couleurs selon le type
-    if type_tension == "BT":
-        header_color = '2F5597'  # Bleu
-        col_header_color = '4472C4'  # Bleu clair
-        subtitle_color = '2F5597'  # Bleu
-    else:  # HT
-        header_color = 'C65911'  # Orange foncé
-        col_header_color = 'ED7D31'  # Orange
-        subtitle_color = 'C65911'  # Orange foncé
+def utiliser_base(base):
+    """La session référence une version de la base partagée (aucune copie)"""
+    st.session_state.version_base = base['version']
+    st.session_state.df_sites = base['sites']
+    st.session_state.df_faits = base['faits']
+    st.session_state.cube = base['cube']
+    st.session_state.index_base = base['index']
+
+def bouton_export(df, type_export, libelle, file_name, key):
+    """Export à la demande : le classeur est construit au clic dans le pool de processus
+    (la session reste réactive), puis servi depuis le cache tant que les données ne changent pas"""
+    export_pret = st.session_state.get(key)
+    if export_pret is not None and export_pret[0] != empreinte_dataframe(df):
+        export_pret = None
     
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        workbook = writer.book
-        worksheet = workbook.create_sheet('Factures')
-        
-        # Supprimer la feuille par défaut
-        if 'Sheet' in workbook.sheetnames:
-            del workbook['Sheet']
-        
-        from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
-        from openpyxl.utils import get_column_letter
-        
-        # === STYLES ===
-        header_fill = PatternFill(start_color=header_color, end_color=header_color, fill_type='solid')
-        header_font = Font(bold=True, size=16, color='FFFFFF', name='Calibri')
-        header_align = Alignment(horizontal='center', vertical='center')
-        
-        subtitle_font = Font(bold=True, size=12, color=subtitle_color, name='Calibri')
-        subtitle_align = Alignment(horizontal='center', vertical='center')
-        
-        info_font = Font(bold=True, size=10, name='Calibri')
-        info_align = Alignment(horizontal='left', vertical='center')
-        
-        col_header_fill = PatternFill(start_color=col_header_color, end_color=col_header_color, fill_type='solid')
-        col_header_font = Font(bold=True, size=10, color='FFFFFF', name='Calibri')
-        col_header_align = Alignment(horizontal='center', vertical='center', wrap_text=True)
-        
-        thin_border = Border(
-            left=Side(style='thin', color='000000'),
-            right=Side(style='thin', color='000000'),
-            top=Side(style='thin', color='000000'),
-            bottom=Side(style='thin', color='000000')
+    if export_pret is not None and export_pret[1].done():
+        duree = duree_export(type_export, export_pret[0])
+        if duree is not None:
+            enregistrer_mesure(f"export Excel {type_export}", duree)
+        if export_pret[1].exception() is not None:
+            st.error(f"❌ Erreur lors de la génération : {export_pret[1].exception()}")
+            del st.session_state[key]
+            return
+        st.download_button(
+            libelle,
+            data=export_pret[1].result(),
+            file_name=file_name,
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            use_container_width=True,
+            key=f"dl_{key}"
         )
-        
-        data_align = Alignment(horizontal='left', vertical='center')
-        data_font = Font(size=10, name='Calibri')
-        
-        # === CONSTRUCTION ===
-        nb_cols = len(df.columns)
-        
-        # Ligne 1-2: EN-TÊTE PRINCIPAL
-        worksheet.merge_cells(f'A1:{get_column_letter(nb_cols)}2')
-        cell = worksheet['A1']
-        cell.value = "⚡ COMPAGNIE IVOIRIENNE D'ÉLECTRICITÉ (CIE)"
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = header_align
-        worksheet.row_dimensions[1].height = 25
-        worksheet.row_dimensions[2].height = 25
-        
-        # Ligne 3: SOUS-TITRE
-        worksheet.merge_cells(f'A3:{get_column_letter(nb_cols)}3')
-        cell = worksheet['A3']
-        tension_txt = "BASSE TENSION (BT)" if type_tension == "BT" else "HAUTE TENSION (HT)"
-        cell.value = f"FACTURES {tension_txt} - RAPPORT MENSUEL"
-        cell.font = subtitle_font
-        cell.alignment = subtitle_align
-        worksheet.row_dimensions[3].height = 20
-        
-        # Ligne 4: Date et Montant
-        current_date = datetime.now().strftime('%d/%m/%Y %H:%M')
-        montant_total = df['MONTANT'].sum() if 'MONTANT' in df.columns else 0
-        
-        worksheet['A4'] = "Date d'édition:"
-        worksheet['B4'] = current_date
-        worksheet['D4'] = "Montant"
-        worksheet['E4'] = f"{montant_total:,.0f} FCFA"
-        
-        for cell_ref in ['A4', 'D4']:
-            worksheet[cell_ref].font = info_font
-            worksheet[cell_ref].alignment = info_align
-        
-        for cell_ref in ['B4', 'E4']:
-            worksheet[cell_ref].font = data_font
-            worksheet[cell_ref].alignment = info_align
-        
-        # Ligne 5: Nombre de factures
-        worksheet['A5'] = "Nombre de factures:"
-        worksheet['B5'] = len(df)
-        worksheet['A5'].font = info_font
-        worksheet['B5'].font = data_font
-        worksheet.row_dimensions[5].height = 18
-        
-        # Ligne 6: Vide
-        worksheet.row_dimensions[6].height = 5
-        
-        # Ligne 7: EN-TÊTES DE COLONNES
-        row_header = 7
-        for col_idx, col_name in enumerate(df.columns, start=1):
-            cell = worksheet.cell(row=row_header, column=col_idx)
-            cell.value = col_name
-            cell.fill = col_header_fill
-            cell.font = col_header_font
-            cell.alignment = col_header_align
-            cell.border = thin_border
-        
-        worksheet.row_dimensions[row_header].height = 30
-        
-        # Lignes de données
-        for row_idx, row_data in enumerate(df.itertuples(index=False), start=row_header + 1):
-            for col_idx, value in enumerate(row_data, start=1):
-                cell = worksheet.cell(row=row_idx, column=col_idx)
-                cell.value = value
-                cell.font = data_font
-                cell.alignment = data_align
-                cell.border = thin_border
-                
-                # Formater les montants
-                if df.columns[col_idx - 1] == 'MONTANT' and value:
-                    cell.number_format = '#,##0'
-        
-        # === SECTION SIGNATURES ===
-        derniere_ligne_data = row_header + len(df)
-        ligne_vide = derniere_ligne_data + 2
-        ligne_titre_sig = ligne_vide + 1
-        
-        # Titre "SIGNATURES ET APPROBATIONS"
-        worksheet.merge_cells(f'A{ligne_titre_sig}:{get_column_letter(nb_cols)}{ligne_titre_sig}')
-        cell = worksheet[f'A{ligne_titre_sig}']
-        cell.value = "SIGNATURES ET APPROBATIONS"
-        cell.font = Font(bold=True, size=12, color=subtitle_color, name='Calibri')
-        cell.alignment = Alignment(horizontal='center', vertical='center')
-        cell.fill = PatternFill(start_color='D9E1F2', end_color='D9E1F2', fill_type='solid')
-        worksheet.row_dimensions[ligne_titre_sig].height = 25
-        
-        # Ligne des labels
-        ligne_labels = ligne_titre_sig + 2
-        
-        # Calculer l'espacement
-        col_prep = 1
-        col_verif = max(4, nb_cols // 4)
-        col_valid = max(7, nb_cols // 2)
-        col_appro = max(10, 3 * nb_cols // 4)
-        
-        # Labels
-        labels = [
-            (col_prep, "Préparé par:"),
-            (col_verif, "Vérifié par:"),
-            (col_valid, "Validé par:"),
-            (col_appro, "Approuvé par:")
-        ]
-        
-        for col, label in labels:
-            cell = worksheet.cell(row=ligne_labels, column=col)
-            cell.value = label
-            cell.font = Font(bold=True, size=10, name='Calibri')
-            cell.alignment = Alignment(horizontal='center', vertical='center')
-            cell.border = Border(bottom=Side(style='medium', color='000000'))
-        
-        # Rectangles pour signatures
-        ligne_sig_start = ligne_labels + 1
-        ligne_sig_end = ligne_sig_start + 3
-        
-        rectangles = [
-            (col_prep, col_prep + 2),
-            (col_verif, col_verif + 2),
-            (col_valid, col_valid + 2),
-            (col_appro, col_appro + 2)
-        ]
-        
-        for start_col, end_col in rectangles:
-            worksheet.merge_cells(
-                start_row=ligne_sig_start,
-                start_column=start_col,
-                end_row=ligne_sig_end,
-                end_column=end_col
-            )
-            
-            cell = worksheet.cell(row=ligne_sig_start, column=start_col)
-            cell.border = thin_border
-            cell.alignment = Alignment(horizontal='center', vertical='center')
-        
-        for row in range(ligne_sig_start, ligne_sig_end + 1):
-            worksheet.row_dimensions[row].height = 20
-        
-        # Lignes Nom: et Date:
-        ligne_nom = ligne_sig_end + 1
-        ligne_date = ligne_nom + 1
-        
-        for col, _ in labels:
-            worksheet.cell(row=ligne_nom, column=col, value="Nom:")
-            worksheet.cell(row=ligne_nom, column=col).font = Font(size=9, name='Calibri')
-            
-            worksheet.cell(row=ligne_date, column=col, value="Date:")
-            worksheet.cell(row=ligne_date, column=col).font = Font(size=9, name='Calibri')
-        
-        # === AJUSTER LARGEURS ===
-        for col_idx, col_name in enumerate(df.columns, start=1):
-            col_letter = get_column_letter(col_idx)
-            worksheet.column_dimensions[col_letter].width = 15
-    
-    output.seek(0)
-    return output
+    elif export_pret is not None:
+        # Suivi de la génération en cours, sans bloquer le processus Streamlit
+        avancement = avancement_export(type_export, export_pret[0])
+        st.progress(avancement, text=f"⏳ Génération du fichier Excel... {avancement:.0%}")
+        relancer_suivi(0.5)
+    elif st.button("📦 Préparer l'export Excel", use_container_width=True, key=f"prep_{key}"):
+        empreinte = empreinte_dataframe(df)
+        st.session_state[key] = (empreinte, soumettre_export(df, type_export, empreinte))
+        st.rerun()
+
+def soumettre_import(fichiers, type_tension):
+    """Dépose les fichiers téléversés ([(fichier, empreinte)]) sur le disque et place leur import
+    (un seul travail, toutes périodes confondues) dans la file de travaux"""
+    os.makedirs(DOSSIER_TRAVAUX, exist_ok=True)
+    deposes = []
+    for fichier, empreinte in fichiers:
+        chemin = os.path.join(DOSSIER_TRAVAUX, f"{empreinte[:16]}_{fichier.name}")
+        with open(chemin, "wb") as f:
+            f.write(fichier.getvalue())
+        deposes.append({"fichier": chemin, "nom": fichier.name, "empreinte": empreinte})
+    libelle = fichiers[0][0].name if len(fichiers) == 1 else f"{len(fichiers)} fichiers"
+    return soumettre_travail(BASE_TRAVAUX, "import", f"Import {type_tension} - {libelle}", {
+        "tension": type_tension, "fichiers": deposes, "stockage": STOCKAGE, "registre": REGISTRE_IMPORTS,
+    })
+
+def suivi_travail(id_travail):
+    """Avancement d'un travail en arrière-plan, rafraîchi tant qu'il n'est pas terminé"""
+    travail = lire_travail(BASE_TRAVAUX, id_travail)
+    if travail is None:
+        return
+    if travail['statut'] in ('en_attente', 'en_cours'):
+        texte = "⏳ En attente..." if travail['statut'] == 'en_attente' else f"⏳ {travail['etape'] or 'En cours'}"
+        st.progress(float(travail['progression'] or 0), text=texte)
+        st.caption("🧵 Vous pouvez continuer à naviguer : le travail se poursuit en arrière-plan (page Travaux).")
+        relancer_suivi(1)
+    elif travail['statut'] == 'termine':
+        st.success(f"🎉 {travail['libelle']} terminé : {travail['message']}")
+    else:
+        st.error(f"❌ {travail['libelle']} : {travail['message']}")
+
+def afficher_rapprochement(df_factures, type_tension, empreintes):
+    """Clés du fichier sans site dans la base (avant import), avec les identifiants les plus proches"""
+    cle = f"rapprochement_{type_tension.lower()}"
+    rapport = st.session_state.get(cle)
+    if rapport is None or rapport[0] != (empreintes, st.session_state.version_base):
+        with mesure(f"rapprochement {type_tension}"):
+            rapport = ((empreintes, st.session_state.version_base),
+                       rapport_non_rapproches(df_factures, st.session_state.df_sites, type_tension))
+        st.session_state[cle] = rapport
+    non_rapproches = rapport[1]
+    if non_rapproches.empty:
+        st.success("🔎 Toutes les clés du fichier correspondent à un site de la base")
+        return
+    with st.expander(f"🔎 Rapprochement : {len(non_rapproches)} clé(s) sans site", expanded=True):
+        st.caption("Clés comparées telles quelles à l'IDENTIFIANT, puis sans espaces ni zéros de tête à "
+                   "l'IDENTIFIANT et à la REFERENCE. Une clé « ambiguë » correspond à plusieurs sites. "
+                   "Ces lignes ne seront pas importées.")
+        st.dataframe(non_rapproches, use_container_width=True, hide_index=True)
+
+def get_central(colonnes=None, periodes=None, ids=None):
+    """Vue à plat de la base centrale (jointure faits + sites), limitée aux `periodes` si fournies,
+    ou aux faits `ids` dans cet ordre (un fait supprimé depuis reste une ligne vide).
+    Pendant le premier chargement de la base partagée, seules ces périodes sont lues dans le stockage."""
+    if base_courante is None:
+        with mesure("lecture des périodes dans le stockage"):
+            return charger_periodes(STOCKAGE, periodes, colonnes)
+    with mesure("jointure faits + sites"):
+        df_faits = st.session_state.df_faits
+        if ids is not None:
+            df_faits = df_faits.reindex(ids)
+        elif periodes is not None:
+            df_faits = faits_periodes(df_faits, st.session_state.index_base, periodes)
+        return joindre_base(st.session_state.df_sites, df_faits, colonnes)
 
-# Initialisation
-if 'df_central' not in st.session_state:
-    st.session_state.df_central = load_central()
+def valeurs_filtre(colonne):
+    """Valeurs distinctes (triées) d'une colonne, lues dans l'index de la base ; les périodes sont
+    lues dans le stockage pendant le premier chargement"""
+    if base_courante is None and colonne == "DATE":
+        return periodes_stockage(STOCKAGE)
+    return st.session_state.index_base['valeurs'][colonne]
+
+# Initialisation : base partagée par toutes les sessions du serveur, chargée une seule fois,
+# en arrière-plan dès la première session : la navigation s'affiche sans attendre le chargement.
+# Une session passe à la dernière version publiée (import en arrière-plan, autre session) au rerun suivant.
+demarrer_travaux(BASE_TRAVAUX)
+chargement_base = prechauffer_base(STOCKAGE, charger=load_central)
+base_courante = base_disponible(STOCKAGE)
+if base_courante is not None and st.session_state.get('version_base') != base_courante['version']:
+    utiliser_base(base_courante)
 
 # Header
 st.markdown("""
@@ -453,25 +306,65 @@ with st.sidebar:
     
     page = st.radio(
         "Menu principal",
-        ["📊 Base Centrale", "🔄 Import Factures BT", "🔄 Import Factures HT", "📈 Statistiques", "⚙️ Génération Fichiers"]
+        ["📊 Base Centrale", "🔄 Import Factures BT", "🔄 Import Factures HT", "📈 Statistiques", "⚙️ Génération Fichiers", "🧵 Travaux"],
+        key="page"
     )
+    st.session_state.rerun_en_cours["page"] = page
+    if page != "📊 Base Centrale":
+        st.session_state.pop("vue_editeur", None)
     
     st.markdown("---")
     st.markdown("### 📊 Informations")
     
-    df_central = st.session_state.df_central
-    st.metric("📝 Lignes totales", len(df_central))
+    if base_courante is None:
+        st.caption("⏳ Chargement de la base centrale...")
+    else:
+        st.metric("📝 Lignes totales", len(st.session_state.df_faits))
+        st.metric("📅 Périodes", len(valeurs_filtre('DATE')))
+    
+    st.caption(
+        f"🗂️ Cache Excel : {STATS_CACHE_EXCEL['hits']} hit(s), "
+        f"{STATS_CACHE_EXCEL['disque']} depuis disque, {STATS_CACHE_EXCEL['misses']} miss"
+    )
     
-    if 'DATE' in df_central.columns:
-        periodes = df_central['DATE'].dropna().nunique()
-        st.metric("📅 Périodes", periodes)
+    if FORMAT_STOCKAGE == "parquet":
+        nb_journal = nb_changements_journal(DOSSIER_PARQUET)
+        st.caption(f"📒 Journal : {nb_journal} changement(s) non compacté(s)")
+        if nb_journal and st.button("🗜️ Compacter le journal", use_container_width=True):
+            compacter_stockage(STOCKAGE)
+            st.rerun()
+
+# Pendant le premier chargement de la base, Génération lit les périodes choisies dans le stockage et
+# Base Centrale affiche une période en lecture seule ; les autres pages (sauf Travaux) attendent
+if base_courante is None and page == "📊 Base Centrale":
+    st.markdown("## 📊 Base Centrale - Historique Complet")
+    st.info("⏳ Chargement de l'historique complet en cours : consultation par période, en lecture seule. "
+            "Actualisez pour filtrer, modifier ou exporter toute la base.")
+    periodes_stockees = valeurs_filtre('DATE')[::-1]
+    if periodes_stockees:
+        periode_consultee = st.selectbox("Filtrer par DATE", periodes_stockees, format_func=format_periode)
+        df_periode = get_central(periodes=[periode_consultee])
+        st.markdown(f"### 📋 Données de {format_periode(periode_consultee)} ({len(df_periode)} ligne(s))")
+        st.dataframe(df_periode, use_container_width=True, height=500)
+    if st.button("🔄 Actualiser", use_container_width=True):
+        st.rerun()
+elif base_courante is None and page not in ("🧵 Travaux", "⚙️ Génération Fichiers"):
+    with st.spinner("⏳ Chargement de la base centrale..."):
+        try:
+            chargement_base.result()
+        except FileNotFoundError as erreur:
+            st.error(f"❌ {erreur}")
+            st.stop()
+    st.rerun()
 
 # CONTENU PRINCIPAL
-if page == "📊 Base Centrale":
+if page == "📊 Base Centrale" and base_courante is not None:
     st.markdown("## 📊 Base Centrale - Historique Complet")
     st.markdown("---")
     
-    df_central = st.session_state.df_central
+    # Cartes et filtres servis par la table de faits et l'index : la vue à plat n'est
+    # construite que pour les lignes affichées
+    df_faits = st.session_state.df_faits
     
     # Statistiques
     col1, col2, col3, col4 = st.columns(4)
@@ -480,13 +373,13 @@ if page == "📊 Base Centrale":
         st.markdown(f"""
         <div class="metric-card">
             <h3 style="color: #667eea;">📝</h3>
-            <h2>{len(df_central)}</h2>
+            <h2>{len(df_faits)}</h2>
             <p style="color: #666;">Lignes totales</p>
         </div>
         """, unsafe_allow_html=True)
     
     with col2:
-        sites_uniques = df_central['IDENTIFIANT'].nunique() if 'IDENTIFIANT' in df_central.columns else 0
+        sites_uniques = df_faits['IDENTIFIANT'].nunique()
         st.markdown(f"""
         <div class="metric-card">
             <h3 style="color: #667eea;">🏢</h3>
@@ -496,7 +389,7 @@ if page == "📊 Base Centrale":
         """, unsafe_allow_html=True)
     
     with col3:
-        periodes = df_central['DATE'].dropna().nunique() if 'DATE' in df_central.columns else 0
+        periodes = len(valeurs_filtre('DATE'))
         st.markdown(f"""
         <div class="metric-card">
             <h3 style="color: #667eea;">📅</h3>
@@ -506,7 +399,7 @@ if page == "📊 Base Centrale":
         """, unsafe_allow_html=True)
     
     with col4:
-        total = df_central['MONTANT'].sum() if 'MONTANT' in df_central.columns else 0
+        total = df_faits['MONTANT'].sum()
         st.markdown(f"""
         <div class="metric-card">
             <h3 style="color: #667eea;">💰</h3>
@@ -521,40 +414,57 @@ if page == "📊 Base Centrale":
     col_f1, col_f2, col_f3 = st.columns(3)
     
     with col_f1:
-        if 'UC' in df_central.columns:
-            ucs = ['Tous'] + sorted(df_central['UC'].dropna().unique().tolist())
+        if 'UC' in st.session_state.df_sites.columns:
+            ucs = ['Tous'] + valeurs_filtre('UC')
             uc_filter = st.selectbox("Filtrer par UC", ucs)
         else:
             uc_filter = 'Tous'
     
     with col_f2:
-        if 'DATE' in df_central.columns:
-            dates = ['Tous'] + sorted(df_central['DATE'].dropna().unique().tolist(), reverse=True)
-            date_filter = st.selectbox("Filtrer par DATE", dates)
-        else:
-            date_filter = 'Tous'
+        dates = ['Tous'] + valeurs_filtre('DATE')[::-1]
+        date_filter = st.selectbox(
+            "Filtrer par DATE", dates, format_func=lambda d: d if d == 'Tous' else format_periode(d)
+        )
     
     with col_f3:
-        if 'TENSION' in df_central.columns:
-            tensions = ['Tous'] + sorted(df_central['TENSION'].dropna().unique().tolist())
+        if 'TENSION' in st.session_state.df_sites.columns:
+            tensions = ['Tous'] + valeurs_filtre('TENSION')
             tension_filter = st.selectbox("Filtrer par TENSION", tensions)
         else:
             tension_filter = 'Tous'
     
-    # Appliquer les filtres
-    df_filtered = df_central.copy()
+    # Appliquer les filtres (la période est lue par l'index)
+    df_filtered = get_central(periodes=None if date_filter == 'Tous' else [date_filter])
     if uc_filter != 'Tous' and 'UC' in df_filtered.columns:
         df_filtered = df_filtered[df_filtered['UC'] == uc_filter]
-    if date_filter != 'Tous' and 'DATE' in df_filtered.columns:
-        df_filtered = df_filtered[df_filtered['DATE'] == date_filter]
     if tension_filter != 'Tous' and 'TENSION' in df_filtered.columns:
         df_filtered = df_filtered[df_filtered['TENSION'] == tension_filter]
     
     st.markdown(f"### 📋 Données filtrées ({len(df_filtered)} ligne(s))")
     
     # Tableau
-    edited_df = st.data_editor(
-        df_filtered,
+    # Les modifications en cours portent sur les lignes affichées quand elles ont commencé : la
+    # session n'en garde que la version, les filtres et les ids des faits, et la vue est reconstruite
+    # à partir de la base partagée si une version a été publiée depuis (import en arrière-plan)
+    changements = st.session_state.get("editor_central") or {}
+    en_cours = any(changements.get(cle) for cle in ("edited_rows", "added_rows", "deleted_rows"))
+    filtres = (uc_filter, date_filter, tension_filter)
+    if not en_cours or "vue_editeur" not in st.session_state:
+        st.session_state.vue_editeur = {
+            "version": st.session_state.version_base, "filtres": filtres, "ids": df_filtered.index
+        }
+    vue_editeur = st.session_state.vue_editeur
+    if vue_editeur["version"] == st.session_state.version_base and vue_editeur["filtres"] == filtres:
+        df_editeur = df_filtered
+    else:
+        df_editeur = get_central(ids=vue_editeur["ids"])
+    if en_cours and vue_editeur["version"] != st.session_state.version_base:
+        st.info("ℹ️ La base a été mise à jour depuis le début de vos modifications : "
+                "elles seront appliquées à la dernière version lors de la sauvegarde.")
+    
+    # Colonnes catégorielles éditées comme du texte libre (nouvelles UC, nouveaux sites...)
+    st.data_editor(
+        sans_categories(df_editeur),
         use_container_width=True,
         num_rows="dynamic",
         height=500,
@@ -566,24 +476,35 @@ if page == "📊 Base Centrale":
     
     with col1:
         if st.button("💾 Sauvegarder", type="primary", use_container_width=True):
-            for idx in edited_df.index:
-                if idx in st.session_state.df_central.index:
-                    st.session_state.df_central.loc[idx] = edited_df.loc[idx]
-            save_central(st.session_state.df_central)
-            st.success("✅ Base centrale sauvegardée !")
-            st.rerun()
+            # Seules les cellules modifiées et les lignes ajoutées / supprimées sont appliquées,
+            # à la dernière version de la base ; une ligne par (IDENTIFIANT, DATE)
+            try:
+                ecritures, doublons = save_central(df_editeur, changements)
+            except ValueError as erreur:
+                ecritures, doublons = None, []
+                st.error(f"❌ Sauvegarde annulée : {erreur}")
+            if doublons:
+                st.error(
+                    "❌ Sauvegarde annulée : ligne(s) en double pour "
+                    + ", ".join(f"{identifiant} / {format_periode(date)}" for identifiant, date in doublons[:10])
+                )
+            elif ecritures is not None:
+                del st.session_state["editor_central"]
+                del st.session_state["vue_editeur"]
+                resume = ecritures['resume']
+                st.success(
+                    f"✅ Base centrale sauvegardée ! ({resume['cellules']} cellule(s) modifiée(s), "
+                    f"{resume['ajouts']} ajout(s), {resume['suppressions']} suppression(s))"
+                )
+                st.rerun()
     
     with col2:
         # Export base centrale avec design vert
-        excel_data = export_base_centrale(df_filtered)
-        
-        st.download_button(
+        bouton_export(
+            df_filtered, 'CENTRALE',
             "📥 Exporter Excel",
-            data=excel_data,
             file_name=f"Base_Centrale_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            use_container_width=True,
-            key="dl_central"
+            key="export_central"
         )
     
     with col3:
@@ -612,20 +533,29 @@ elif page == "🔄 Import Factures BT":
     - Données : **Montant facture TTC**, **conso**, **caract** (période)
     
     💡 Pour chaque ligne trouvée, une **nouvelle ligne** sera ajoutée dans la base centrale avec les données du mois.
+    📅 Plusieurs fichiers, ou un fichier couvrant plusieurs mois, peuvent être importés en une fois : chaque ligne prend la période de sa colonne **caract**.
     """)
     
-    # Upload fichier
-    fichier_bt = st.file_uploader(
-        "Sélectionnez le fichier de factures BT",
-        type=['xlsx', 'xls'],
+    # Upload : un ou plusieurs fichiers, chacun pouvant couvrir plusieurs mois
+    fichiers_bt = st.file_uploader(
+        "Sélectionnez le(s) fichier(s) de factures BT",
+        type=['xlsx', 'xls', 'csv'],
+        accept_multiple_files=True,
         key="upload_bt"
     )
     
-    if fichier_bt:
+    if fichiers_bt:
         try:
-            df_bt = pd.read_excel(fichier_bt)
+            # Seules les colonnes utiles à l'import sont lues (xlsx en flux, xls ou csv)
+            empreintes_bt = [empreinte_fichier(f) for f in fichiers_bt]
+            lecture = st.session_state.get("lecture_bt")
+            if lecture is None or lecture[0] != empreintes_bt:
+                with mesure("lecture factures BT"):
+                    lecture = (empreintes_bt, [lire_factures(f, "BT") for f in fichiers_bt])
+                st.session_state.lecture_bt = lecture
+            lectures_bt = lecture[1]
             
-            st.success(f"✅ Fichier chargé : {len(df_bt)} ligne(s)")
+            st.success(f"✅ {len(fichiers_bt)} fichier(s) chargé(s) : {sum(len(df) for df in lectures_bt)} ligne(s)")
             
             # Configuration des colonnes
             cle_facture = "reference contrat"
@@ -633,24 +563,53 @@ elif page == "🔄 Import Factures BT":
             conso_col = "conso"
             caract_col = "caract"
             
-            # Vérifications
-            colonnes_manquantes = []
-            for col in [cle_facture, montant_col, caract_col]:
-                if col not in df_bt.columns:
-                    colonnes_manquantes.append(col)
+            # Vérifications (fichier par fichier)
+            erreurs_colonnes = False
+            for fichier, df in zip(fichiers_bt, lectures_bt):
+                colonnes_manquantes = [col for col in [cle_facture, montant_col, caract_col] if col not in df.columns]
+                if colonnes_manquantes:
+                    erreurs_colonnes = True
+                    st.error(f"❌ {fichier.name} : colonnes manquantes : {', '.join(colonnes_manquantes)}")
+                    st.info(f"📋 Colonnes disponibles : {', '.join(df.attrs['colonnes_source'])}")
             
-            if colonnes_manquantes:
-                st.error(f"❌ Colonnes manquantes : {', '.join(colonnes_manquantes)}")
-                st.info(f"📋 Colonnes disponibles : {', '.join(df_bt.columns)}")
-            else:
-                # Récupérer la période
-                periode_bt = df_bt[caract_col].dropna().unique()
-                if len(periode_bt) > 0:
-                    periode_bt = str(periode_bt[0])
-                    st.success(f"✅ Période BT détectée : **{periode_bt}**")
+            if not erreurs_colonnes:
+                df_bt = pd.concat(lectures_bt, ignore_index=True)
+                
+                # Périodes détectées : une par valeur de caract, toutes importées en une fois
+                periodes_bt = periodes_factures(df_bt, "BT")
+                repartition = periodes_bt.value_counts().sort_index()
+                repartition.index = repartition.index.map(format_periode)
+                if len(repartition) > 0:
+                    st.success(f"✅ Période(s) BT détectée(s) : **{', '.join(repartition.index)}**")
+                    if len(repartition) > 1:
+                        with st.expander(f"📅 Répartition par période ({len(repartition)} périodes)"):
+                            st.dataframe(repartition.rename("Lignes").rename_axis("Période"), use_container_width=True)
                 else:
-                    periode_bt = ""
                     st.warning("⚠️ Aucune période détectée")
+                if periodes_bt.isna().any():
+                    st.warning(f"⚠️ {int(periodes_bt.isna().sum())} ligne(s) sans période (caract vide ou invalide) seront ignorées")
+                for fichier, df in zip(fichiers_bt, lectures_bt):
+                    if df.attrs.get("montants_illisibles"):
+                        st.warning(
+                            f"⚠️ {fichier.name} : {df.attrs['montants_illisibles']} montant(s) illisible(s) "
+                            f"(ex. : {', '.join(df.attrs['exemples_illisibles'])}) : importés vides, "
+                            f"les montants déjà en base sont conservés"
+                        )
+                
+                # Les fichiers identiques déjà importés ne sont pas retraités
+                registre = lire_registre_imports(REGISTRE_IMPORTS)
+                deja_importes = [(f, registre[e]) for f, e in zip(fichiers_bt, empreintes_bt) if e in registre]
+                forcer_import = False
+                if deja_importes:
+                    for fichier, deja_importe in deja_importes:
+                        st.info(
+                            f"ℹ️ {fichier.name} a déjà été importé le {deja_importe['date'][:10]} "
+                            f"(période {deja_importe['periode']}, {deja_importe['lignes']} ligne(s))."
+                        )
+                    forcer_import = st.checkbox("Réimporter quand même (remplace les lignes des périodes)", key="forcer_bt")
+                a_importer = [
+                    (f, e) for f, e in zip(fichiers_bt, empreintes_bt) if forcer_import or e not in registre
+                ]
                 
                 # Aperçu
                 with st.expander("👁️ Aperçu du fichier BT"):
@@ -659,70 +618,23 @@ elif page == "🔄 Import Factures BT":
                         cols_to_show.insert(2, conso_col)
                     st.dataframe(df_bt[cols_to_show].head(10), use_container_width=True)
                 
+                afficher_rapprochement(df_bt, "BT", empreintes_bt)
+                
                 st.markdown("---")
                 
                 # Bouton import
                 col1, col2, col3 = st.columns([1, 2, 1])
                 with col2:
-                    if st.button("🔄 LANCER L'IMPORT BT", type="primary", use_container_width=True):
-                        with st.spinner("⏳ Import BT en cours..."):
-                            df_central = st.session_state.df_central.copy()
-                            df_template_bt = load_template_bt()
-                            
-                            if df_template_bt is None:
-                                st.error("❌ Fichier template BT introuvable !")
-                            else:
-                                nouvelles_lignes = []
-                                nb_ajouts = 0
-                                
-                                for _, row_facture in df_bt.iterrows():
-                                    ref_contrat = str(row_facture[cle_facture])
-                                    
-                                    # Chercher dans la base centrale pour récupérer les infos du site
-                                    ligne_centrale = df_central[df_central['IDENTIFIANT'].astype(str) == ref_contrat]
-                                    
-                                    if not ligne_centrale.empty:
-                                        # Créer une nouvelle ligne avec les colonnes de la base centrale
-                                        nouvelle_ligne = pd.Series({
-                                            'UC': ligne_centrale.iloc[0]['UC'] if 'UC' in ligne_centrale.columns else '',
-                                            'CODE AGCE': ligne_centrale.iloc[0]['CODE AGCE'] if 'CODE AGCE' in ligne_centrale.columns else '',
-                                            'SITES': ligne_centrale.iloc[0]['SITES'] if 'SITES' in ligne_centrale.columns else '',
-                                            'CORRESPONDANCE': ligne_centrale.iloc[0]['CORRESPONDANCE'] if 'CORRESPONDANCE' in ligne_centrale.columns else '',
-                                            'IDENTIFIANT': ref_contrat,
-                                            'REFERENCE': ligne_centrale.iloc[0]['REFERENCE'] if 'REFERENCE' in ligne_centrale.columns else '',
-                                            'TENSION': ligne_centrale.iloc[0]['TENSION'] if 'TENSION' in ligne_centrale.columns else '',
-                                            'MONTANT': row_facture[montant_col],
-                                            'CONSO': row_facture.get(conso_col, None) if conso_col in df_bt.columns else None,
-                                            'DATE': periode_bt
-                                        })
-                                        
-                                        nouvelles_lignes.append(nouvelle_ligne)
-                                        nb_ajouts += 1
-                            
-                            if nouvelles_lignes:
-                                # Ajouter les nouvelles lignes à la base centrale
-                                df_nouvelles = pd.DataFrame(nouvelles_lignes)
-                                df_central = pd.concat([df_central, df_nouvelles], ignore_index=True)
-                                
-                                # Sauvegarder
-                                st.session_state.df_central = df_central
-                                save_central(df_central)
-                                
-                                # Résultats
-                                st.markdown("---")
-                                st.success(f"🎉 Import BT terminé : {nb_ajouts} ligne(s) ajoutée(s) !")
-                                
-                                col_r1, col_r2, col_r3 = st.columns(3)
-                                with col_r1:
-                                    st.metric("✅ Lignes ajoutées", nb_ajouts)
-                                with col_r2:
-                                    st.metric("📊 Total lignes", len(df_central))
-                                with col_r3:
-                                    st.metric("📅 Période", periode_bt)
-                                
-                                st.balloons()
-                            else:
-                                st.warning("⚠️ Aucune correspondance trouvée")
+                    if st.button("🔄 LANCER L'IMPORT BT", type="primary", use_container_width=True,
+                                 disabled=not a_importer):
+                        if load_template_bt() is None:
+                            st.error("❌ Fichier template BT introuvable !")
+                        else:
+                            # L'import tourne en arrière-plan : la page peut être quittée ou rechargée
+                            st.session_state.travail_import_bt = soumettre_import(a_importer, "BT")
+                
+                if 'travail_import_bt' in st.session_state:
+                    suivi_travail(st.session_state.travail_import_bt)
         
         except Exception as e:
             st.error(f"❌ Erreur : {str(e)}")
@@ -750,20 +662,29 @@ elif page == "🔄 Import Factures HT":
     - Données : **montfact**, **conso**, **caract** (période)
     
     💡 Pour chaque ligne trouvée, une **nouvelle ligne** sera ajoutée dans la base centrale avec les données du mois.
+    📅 Plusieurs fichiers, ou un fichier couvrant plusieurs mois, peuvent être importés en une fois : chaque ligne prend la période de sa colonne **caract**.
     """)
     
-    # Upload fichier
-    fichier_ht = st.file_uploader(
-        "Sélectionnez le fichier de factures HT",
-        type=['xlsx', 'xls'],
+    # Upload : un ou plusieurs fichiers, chacun pouvant couvrir plusieurs mois
+    fichiers_ht = st.file_uploader(
+        "Sélectionnez le(s) fichier(s) de factures HT",
+        type=['xlsx', 'xls', 'csv'],
+        accept_multiple_files=True,
         key="upload_ht"
     )
     
-    if fichier_ht:
+    if fichiers_ht:
         try:
-            df_ht = pd.read_excel(fichier_ht)
+            # Seules les colonnes utiles à l'import sont lues (xlsx en flux, xls ou csv)
+            empreintes_ht = [empreinte_fichier(f) for f in fichiers_ht]
+            lecture = st.session_state.get("lecture_ht")
+            if lecture is None or lecture[0] != empreintes_ht:
+                with mesure("lecture factures HT"):
+                    lecture = (empreintes_ht, [lire_factures(f, "HT") for f in fichiers_ht])
+                st.session_state.lecture_ht = lecture
+            lectures_ht = lecture[1]
             
-            st.success(f"✅ Fichier chargé : {len(df_ht)} ligne(s)")
+            st.success(f"✅ {len(fichiers_ht)} fichier(s) chargé(s) : {sum(len(df) for df in lectures_ht)} ligne(s)")
             
             # Configuration des colonnes
             cle_facture = "refraccord"
@@ -771,24 +692,53 @@ elif page == "🔄 Import Factures HT":
             conso_col = "conso"
             caract_col = "caract"
             
-            # Vérifications
-            colonnes_manquantes = []
-            for col in [cle_facture, montant_col, caract_col]:
-                if col not in df_ht.columns:
-                    colonnes_manquantes.append(col)
+            # Vérifications (fichier par fichier)
+            erreurs_colonnes = False
+            for fichier, df in zip(fichiers_ht, lectures_ht):
+                colonnes_manquantes = [col for col in [cle_facture, montant_col, caract_col] if col not in df.columns]
+                if colonnes_manquantes:
+                    erreurs_colonnes = True
+                    st.error(f"❌ {fichier.name} : colonnes manquantes : {', '.join(colonnes_manquantes)}")
+                    st.info(f"📋 Colonnes disponibles : {', '.join(df.attrs['colonnes_source'])}")
             
-            if colonnes_manquantes:
-                st.error(f"❌ Colonnes manquantes : {', '.join(colonnes_manquantes)}")
-                st.info(f"📋 Colonnes disponibles : {', '.join(df_ht.columns)}")
-            else:
-                # Récupérer la période
-                periode_ht = df_ht[caract_col].dropna().unique()
-                if len(periode_ht) > 0:
-                    periode_ht = str(periode_ht[0])
-                    st.success(f"✅ Période HT détectée : **{periode_ht}**")
+            if not erreurs_colonnes:
+                df_ht = pd.concat(lectures_ht, ignore_index=True)
+                
+                # Périodes détectées : une par valeur de caract, toutes importées en une fois
+                periodes_ht = periodes_factures(df_ht, "HT")
+                repartition = periodes_ht.value_counts().sort_index()
+                repartition.index = repartition.index.map(format_periode)
+                if len(repartition) > 0:
+                    st.success(f"✅ Période(s) HT détectée(s) : **{', '.join(repartition.index)}**")
+                    if len(repartition) > 1:
+                        with st.expander(f"📅 Répartition par période ({len(repartition)} périodes)"):
+                            st.dataframe(repartition.rename("Lignes").rename_axis("Période"), use_container_width=True)
                 else:
-                    periode_ht = ""
                     st.warning("⚠️ Aucune période détectée")
+                if periodes_ht.isna().any():
+                    st.warning(f"⚠️ {int(periodes_ht.isna().sum())} ligne(s) sans période (caract vide ou invalide) seront ignorées")
+                for fichier, df in zip(fichiers_ht, lectures_ht):
+                    if df.attrs.get("montants_illisibles"):
+                        st.warning(
+                            f"⚠️ {fichier.name} : {df.attrs['montants_illisibles']} montant(s) illisible(s) "
+                            f"(ex. : {', '.join(df.attrs['exemples_illisibles'])}) : importés vides, "
+                            f"les montants déjà en base sont conservés"
+                        )
+                
+                # Les fichiers identiques déjà importés ne sont pas retraités
+                registre = lire_registre_imports(REGISTRE_IMPORTS)
+                deja_importes = [(f, registre[e]) for f, e in zip(fichiers_ht, empreintes_ht) if e in registre]
+                forcer_import = False
+                if deja_importes:
+                    for fichier, deja_importe in deja_importes:
+                        st.info(
+                            f"ℹ️ {fichier.name} a déjà été importé le {deja_importe['date'][:10]} "
+                            f"(période {deja_importe['periode']}, {deja_importe['lignes']} ligne(s))."
+                        )
+                    forcer_import = st.checkbox("Réimporter quand même (remplace les lignes des périodes)", key="forcer_ht")
+                a_importer = [
+                    (f, e) for f, e in zip(fichiers_ht, empreintes_ht) if forcer_import or e not in registre
+                ]
                 
                 # Aperçu
                 with st.expander("👁️ Aperçu du fichier HT"):
@@ -797,85 +747,42 @@ elif page == "🔄 Import Factures HT":
                         cols_to_show.insert(2, conso_col)
                     st.dataframe(df_ht[cols_to_show].head(10), use_container_width=True)
                 
+                afficher_rapprochement(df_ht, "HT", empreintes_ht)
+                
                 st.markdown("---")
                 
                 # Bouton import
                 col1, col2, col3 = st.columns([1, 2, 1])
                 with col2:
-                    if st.button("🔄 LANCER L'IMPORT HT", type="primary", use_container_width=True):
-                        with st.spinner("⏳ Import HT en cours..."):
-                            df_central = st.session_state.df_central.copy()
-                            df_template_ht = load_template_ht()
-                            
-                            if df_template_ht is None:
-                                st.error("❌ Fichier template HT introuvable !")
-                            else:
-                                nouvelles_lignes = []
-                                nb_ajouts = 0
-                                
-                                for _, row_facture in df_ht.iterrows():
-                                    refraccord = str(row_facture[cle_facture])
-                                    
-                                    # Chercher dans la base centrale pour récupérer les infos du site
-                                    ligne_centrale = df_central[df_central['IDENTIFIANT'].astype(str) == refraccord]
-                                    
-                                    if not ligne_centrale.empty:
-                                        # Créer une nouvelle ligne avec les colonnes de la base centrale
-                                        nouvelle_ligne = pd.Series({
-                                            'UC': ligne_centrale.iloc[0]['UC'] if 'UC' in ligne_centrale.columns else '',
-                                            'CODE AGCE': ligne_centrale.iloc[0]['CODE AGCE'] if 'CODE AGCE' in ligne_centrale.columns else '',
-                                            'SITES': ligne_centrale.iloc[0]['SITES'] if 'SITES' in ligne_centrale.columns else '',
-                                            'CORRESPONDANCE': ligne_centrale.iloc[0]['CORRESPONDANCE'] if 'CORRESPONDANCE' in ligne_centrale.columns else '',
-                                            'IDENTIFIANT': refraccord,
-                                            'REFERENCE': ligne_centrale.iloc[0]['REFERENCE'] if 'REFERENCE' in ligne_centrale.columns else '',
-                                            'TENSION': ligne_centrale.iloc[0]['TENSION'] if 'TENSION' in ligne_centrale.columns else '',
-                                            'MONTANT': row_facture[montant_col],
-                                            'CONSO': row_facture.get(conso_col, None) if conso_col in df_ht.columns else None,
-                                            'DATE': periode_ht
-                                        })
-                                        
-                                        nouvelles_lignes.append(nouvelle_ligne)
-                                        nb_ajouts += 1
-                            
-                            if nouvelles_lignes:
-                                # Ajouter les nouvelles lignes à la base centrale
-                                df_nouvelles = pd.DataFrame(nouvelles_lignes)
-                                df_central = pd.concat([df_central, df_nouvelles], ignore_index=True)
-                                
-                                # Sauvegarder
-                                st.session_state.df_central = df_central
-                                save_central(df_central)
-                                
-                                # Résultats
-                                st.markdown("---")
-                                st.success(f"🎉 Import HT terminé : {nb_ajouts} ligne(s) ajoutée(s) !")
-                                
-                                col_r1, col_r2, col_r3 = st.columns(3)
-                                with col_r1:
-                                    st.metric("✅ Lignes ajoutées", nb_ajouts)
-                                with col_r2:
-                                    st.metric("📊 Total lignes", len(df_central))
-                                with col_r3:
-                                    st.metric("📅 Période", periode_ht)
-                                
-                                st.balloons()
-                            else:
-                                st.warning("⚠️ Aucune correspondance trouvée")
+                    if st.button("🔄 LANCER L'IMPORT HT", type="primary", use_container_width=True,
+                                 disabled=not a_importer):
+                        if load_template_ht() is None:
+                            st.error("❌ Fichier template HT introuvable !")
+                        else:
+                            # L'import tourne en arrière-plan : la page peut être quittée ou rechargée
+                            st.session_state.travail_import_ht = soumettre_import(a_importer, "HT")
+                
+                if 'travail_import_ht' in st.session_state:
+                    suivi_travail(st.session_state.travail_import_ht)
         
         except Exception as e:
             st.error(f"❌ Erreur : {str(e)}")
             st.exception(e)
 
 elif page == "📈 Statistiques":
+    # plotly n'est importé qu'à la première ouverture de la page
+    import plotly.graph_objects as go
+    
     st.markdown("## 📈 Statistiques et Évolution")
     st.markdown("---")
     
-    df_central = st.session_state.df_central
+    # Toutes les requêtes de la page sont servies par le cube d'agrégats
+    cube = st.session_state.cube
     
-    if 'DATE' not in df_central.columns or df_central['DATE'].isna().all():
+    if cube['DATE'].isna().all():
         st.warning("⚠️ Aucune période enregistrée. Importez d'abord des factures.")
     else:
-        periodes_brutes = sorted(df_central['DATE'].dropna().unique().tolist())
+        periodes_brutes = valeurs_filtre('DATE')
         
         if len(periodes_brutes) == 0:
             st.warning("⚠️ Aucune donnée disponible.")
@@ -886,11 +793,9 @@ elif page == "📈 Statistiques":
             col_f1, col_f2 = st.columns(2)
             
             with col_f1:
-                if 'SITES' in df_central.columns:
-                    sites = ['Tous'] + sorted(df_central['SITES'].dropna().unique().tolist())
-                    site_filter = st.selectbox("🏢 Filtrer par SITE", sites)
-                else:
-                    site_filter = 'Tous'
+                # Valeurs telles qu'elles sont dans le cube (un site au nom numérique reste un nombre)
+                sites = ['Tous'] + valeurs_filtre('SITES')
+                site_filter = st.selectbox("🏢 Filtrer par SITE", sites, format_func=str)
             
             with col_f2:
                 type_graphique = st.selectbox(
@@ -899,133 +804,130 @@ elif page == "📈 Statistiques":
                 )
             
             # Appliquer les filtres
-            df_filtered = df_central.copy()
+            filtres = {}
             
             if site_filter != 'Tous':
-                df_filtered = df_filtered[df_filtered['SITES'] == site_filter]
+                filtres['SITES'] = site_filter
             
             if "Basse Tension" in type_graphique:
-                df_filtered = df_filtered[df_filtered['TENSION'] == 'BASSE']
+                filtres['TENSION'] = 'BASSE'
             elif "Haute Tension" in type_graphique:
-                df_filtered = df_filtered[df_filtered['TENSION'] == 'HAUTE']
+                filtres['TENSION'] = 'HAUTE'
             
-            # Grouper par DATE
-            df_grouped = df_filtered.groupby('DATE').agg({
-                'MONTANT': 'sum',
-                'CONSO': 'sum'
-            }).reset_index()
-            
-            df_grouped['DATE_DISPLAY'] = df_grouped['DATE'].apply(
-                lambda x: f"{str(x)[4:6]}/{str(x)[:4]}" if len(str(x)) == 6 else str(x)
-            )
-            
-            df_grouped = df_grouped.sort_values('DATE')
+            # Totaux par DATE lus dans le cube
+            df_grouped = interroger_cube(cube, filtres)
             
             st.markdown("---")
             
             # GRAPHIQUE MONTANTS
             st.markdown("### 💰 Évolution des Montants")
             
-            fig_montant = go.Figure()
-            
-            fig_montant.add_trace(go.Scatter(
-                x=df_grouped['DATE_DISPLAY'],
-                y=df_grouped['MONTANT'],
-                mode='lines+markers',
-                name='Montant',
-                line=dict(color='#667eea', width=3),
-                marker=dict(size=10, color='#667eea'),
-                hovertemplate='<b>%{x}</b><br>Montant: %{y:,.0f} FCFA<extra></extra>'
-            ))
-            
-            fig_montant.update_layout(
-                title=f"Évolution des Montants - {type_graphique.split(' ', 1)[1] if site_filter == 'Tous' else site_filter}",
-                xaxis_title="Période",
-                yaxis_title="Montant (FCFA)",
-                hovermode='x unified',
-                template='plotly_white',
-                height=400
-            )
-            
-            st.plotly_chart(fig_montant, use_container_width=True)
+            with mesure("figures plotly"):
+                fig_montant = go.Figure()
+                
+                fig_montant.add_trace(go.Scatter(
+                    x=df_grouped['DATE_DISPLAY'],
+                    y=df_grouped['MONTANT'],
+                    mode='lines+markers',
+                    name='Montant',
+                    line=dict(color='#667eea', width=3),
+                    marker=dict(size=10, color='#667eea'),
+                    hovertemplate='<b>%{x}</b><br>Montant: %{y:,.0f} FCFA<extra></extra>'
+                ))
+                
+                fig_montant.update_layout(
+                    title=f"Évolution des Montants - {type_graphique.split(' ', 1)[1] if site_filter == 'Tous' else site_filter}",
+                    xaxis_title="Période",
+                    yaxis_title="Montant (FCFA)",
+                    hovermode='x unified',
+                    template='plotly_white',
+                    height=400
+                )
+                
+            with mesure("rendu plotly"):
+                st.plotly_chart(fig_montant, use_container_width=True)
             
             # GRAPHIQUE CONSOMMATIONS
             st.markdown("### ⚡ Évolution des Consommations")
             
-            fig_conso = go.Figure()
-            
-            fig_conso.add_trace(go.Scatter(
-                x=df_grouped['DATE_DISPLAY'],
-                y=df_grouped['CONSO'],
-                mode='lines+markers',
-                name='Consommation',
-                line=dict(color='#f5576c', width=3),
-                marker=dict(size=10, color='#f5576c'),
-                hovertemplate='<b>%{x}</b><br>Conso: %{y:,.0f} kWh<extra></extra>'
-            ))
-            
-            fig_conso.update_layout(
-                title=f"Évolution des Consommations - {type_graphique.split(' ', 1)[1] if site_filter == 'Tous' else site_filter}",
-                xaxis_title="Période",
-                yaxis_title="Consommation (kWh)",
-                hovermode='x unified',
-                template='plotly_white',
-                height=400
-            )
-            
-            st.plotly_chart(fig_conso, use_container_width=True)
+            with mesure("figures plotly"):
+                fig_conso = go.Figure()
+                
+                fig_conso.add_trace(go.Scatter(
+                    x=df_grouped['DATE_DISPLAY'],
+                    y=df_grouped['CONSO'],
+                    mode='lines+markers',
+                    name='Consommation',
+                    line=dict(color='#f5576c', width=3),
+                    marker=dict(size=10, color='#f5576c'),
+                    hovertemplate='<b>%{x}</b><br>Conso: %{y:,.0f} kWh<extra></extra>'
+                ))
+                
+                fig_conso.update_layout(
+                    title=f"Évolution des Consommations - {type_graphique.split(' ', 1)[1] if site_filter == 'Tous' else site_filter}",
+                    xaxis_title="Période",
+                    yaxis_title="Consommation (kWh)",
+                    hovermode='x unified',
+                    template='plotly_white',
+                    height=400
+                )
+                
+            with mesure("rendu plotly"):
+                st.plotly_chart(fig_conso, use_container_width=True)
             
             # GRAPHIQUE COMBINÉ
             st.markdown("### 📊 Vue Combinée (Montant + Consommation)")
             
-            fig_combine = go.Figure()
-            
-            fig_combine.add_trace(go.Bar(
-                x=df_grouped['DATE_DISPLAY'],
-                y=df_grouped['MONTANT'],
-                name='Montant',
-                marker_color='#667eea',
-                yaxis='y',
-                hovertemplate='<b>%{x}</b><br>Montant: %{y:,.0f} FCFA<extra></extra>'
-            ))
-            
-            fig_combine.add_trace(go.Scatter(
-                x=df_grouped['DATE_DISPLAY'],
-                y=df_grouped['CONSO'],
-                name='Consommation',
-                line=dict(color='#f5576c', width=3),
-                marker=dict(size=10, color='#f5576c'),
-                yaxis='y2',
-                hovertemplate='<b>%{x}</b><br>Conso: %{y:,.0f} kWh<extra></extra>'
-            ))
-            
-            fig_combine.update_layout(
-                title=f"Montant vs Consommation - {type_graphique.split(' ', 1)[1] if site_filter == 'Tous' else site_filter}",
-                xaxis_title="Période",
-                yaxis=dict(
-                    title="Montant (FCFA)",
-                    side='left',
-                    showgrid=False
-                ),
-                yaxis2=dict(
-                    title="Consommation (kWh)",
-                    side='right',
-                    overlaying='y',
-                    showgrid=False
-                ),
-                hovermode='x unified',
-                template='plotly_white',
-                height=500,
-                legend=dict(
-                    orientation="h",
-                    yanchor="bottom",
-                    y=1.02,
-                    xanchor="right",
-                    x=1
+            with mesure("figures plotly"):
+                fig_combine = go.Figure()
+                
+                fig_combine.add_trace(go.Bar(
+                    x=df_grouped['DATE_DISPLAY'],
+                    y=df_grouped['MONTANT'],
+                    name='Montant',
+                    marker_color='#667eea',
+                    yaxis='y',
+                    hovertemplate='<b>%{x}</b><br>Montant: %{y:,.0f} FCFA<extra></extra>'
+                ))
+                
+                fig_combine.add_trace(go.Scatter(
+                    x=df_grouped['DATE_DISPLAY'],
+                    y=df_grouped['CONSO'],
+                    name='Consommation',
+                    line=dict(color='#f5576c', width=3),
+                    marker=dict(size=10, color='#f5576c'),
+                    yaxis='y2',
+                    hovertemplate='<b>%{x}</b><br>Conso: %{y:,.0f} kWh<extra></extra>'
+                ))
+                
+                fig_combine.update_layout(
+                    title=f"Montant vs Consommation - {type_graphique.split(' ', 1)[1] if site_filter == 'Tous' else site_filter}",
+                    xaxis_title="Période",
+                    yaxis=dict(
+                        title="Montant (FCFA)",
+                        side='left',
+                        showgrid=False
+                    ),
+                    yaxis2=dict(
+                        title="Consommation (kWh)",
+                        side='right',
+                        overlaying='y',
+                        showgrid=False
+                    ),
+                    hovermode='x unified',
+                    template='plotly_white',
+                    height=500,
+                    legend=dict(
+                        orientation="h",
+                        yanchor="bottom",
+                        y=1.02,
+                        xanchor="right",
+                        x=1
+                    )
                 )
-            )
-            
-            st.plotly_chart(fig_combine, use_container_width=True)
+                
+            with mesure("rendu plotly"):
+                st.plotly_chart(fig_combine, use_container_width=True)
             
             # TABLEAU DE DONNÉES
             st.markdown("### 📋 Données détaillées")
@@ -1059,7 +961,7 @@ elif page == "⚙️ Génération Fichiers":
     st.markdown("---")
     
     # Tabs pour BT et HT
-    tab_bt, tab_ht = st.tabs(["🔌 Basse Tension (BT)", "⚡ Haute Tension (HT)"])
+    tab_bt, tab_ht, tab_lot = st.tabs(["🔌 Basse Tension (BT)", "⚡ Haute Tension (HT)", "📦 Génération par lot"])
     
     with tab_bt:
         st.markdown("### 📋 Génération Fichier CIE BT")
@@ -1071,112 +973,89 @@ elif page == "⚙️ Génération Fichiers":
         if df_template_bt is None:
             st.error("❌ Template BT introuvable : FACTURAT_ELECTRICITE_BT.xlsx")
         else:
-            # Filtre de date
-            df_central = st.session_state.df_central
+            # Filtre de date (périodes de l'index, ou du stockage pendant le premier chargement)
+            periodes_disponibles = valeurs_filtre('DATE')[::-1]
             
-            if 'DATE' in df_central.columns:
-                periodes_disponibles = sorted(df_central['DATE'].dropna().unique().tolist(), reverse=True)
+            if len(periodes_disponibles) > 0:
+                col_f1, col_f2 = st.columns(2)
                 
-                if len(periodes_disponibles) > 0:
-                    col_f1, col_f2 = st.columns(2)
-                    
-                    with col_f1:
-                        periode_selectionnee = st.selectbox(
-                            "📅 Sélectionner la période",
-                            periodes_disponibles,
-                            help="Choisissez la période pour générer le fichier"
+                with col_f1:
+                    periode_selectionnee = st.selectbox(
+                        "📅 Sélectionner la période",
+                        periodes_disponibles,
+                        format_func=format_periode,
+                        help="Choisissez la période pour générer le fichier"
+                    )
+                
+                with col_f2:
+                    if periode_selectionnee:
+                        periode_affichage = format_periode(periode_selectionnee)
+                        st.info(f"📊 Période sélectionnée : **{periode_affichage}**")
+                
+                st.markdown("---")
+                
+                # Filtrer la base centrale par la période sélectionnée
+                df_central_filtre = get_central(['SITES', 'IDENTIFIANT', 'MONTANT', 'DATE'], periodes=[periode_selectionnee])
+                
+                if len(df_central_filtre) == 0:
+                    st.warning(f"⚠️ Aucune donnée pour la période {periode_affichage}")
+                else:
+                    # Remplir MONTANT et LIBELLE COMPLEMENTAIRE de tout le template en une jointure
+                    with mesure("remplissage template BT"):
+                        df_export_bt, rapport_bt = remplir_template(
+                            df_template_bt, df_central_filtre, "BT", periode_selectionnee
                         )
+                    nb_maj = rapport_bt['trouves']
                     
-                    with col_f2:
-                        if periode_selectionnee:
-                            # Convertir la période en format lisible
-                            periode_str = str(periode_selectionnee)
-                            if len(periode_str) == 6:
-                                periode_affichage = f"{periode_str[4:6]}/{periode_str[:4]}"
-                            else:
-                                periode_affichage = periode_str
-                            st.info(f"📊 Période sélectionnée : **{periode_affichage}**")
+                    # Afficher les statistiques
+                    col_stat1, col_stat2, col_stat3 = st.columns(3)
+                    with col_stat1:
+                        st.metric("📝 Lignes template", len(df_export_bt))
+                    with col_stat2:
+                        st.metric("✅ Lignes mises à jour", nb_maj)
+                    with col_stat3:
+                        st.metric("💰 Total", f"{rapport_bt['total']:,.0f} FCFA")
+                    
+                    if rapport_bt['non_trouves'] or rapport_bt['doublons_periode'] or rapport_bt['doublons_template']:
+                        with st.expander(f"⚠️ Contrôle des identifiants ({len(rapport_bt['non_trouves'])} non trouvé(s))"):
+                            st.write(f"**Non trouvés dans la période** : {', '.join(rapport_bt['non_trouves']) or '-'}")
+                            st.write(f"**En double dans la période** (1re ligne utilisée) : {', '.join(rapport_bt['doublons_periode']) or '-'}")
+                            st.write(f"**En double dans le template** : {', '.join(rapport_bt['doublons_template']) or '-'}")
                     
                     st.markdown("---")
                     
-                    # Filtrer la base centrale par la période sélectionnée
-                    df_central_filtre = df_central[df_central['DATE'] == periode_selectionnee]
+                    # Aperçu
+                    with st.expander("👁️ Aperçu du fichier à générer"):
+                        st.dataframe(df_export_bt.head(10), use_container_width=True)
                     
-                    if len(df_central_filtre) == 0:
-                        st.warning(f"⚠️ Aucune donnée pour la période {periode_affichage}")
-                    else:
-                        # Créer une copie du template pour mise à jour
-                        df_export_bt = df_template_bt.copy()
-                        
-                        nb_maj = 0
-                        
-                        # Pour chaque ligne du template
-                        for idx, row_template in df_export_bt.iterrows():
-                            identifiant_template = str(row_template['IDENTIFIANT']) if 'IDENTIFIANT' in row_template else ''
-                            
-                            # Chercher dans la base centrale filtrée
-                            ligne_centrale = df_central_filtre[df_central_filtre['IDENTIFIANT'].astype(str) == identifiant_template]
-                            
-                            if not ligne_centrale.empty:
-                                # Mettre à jour le MONTANT
-                                df_export_bt.at[idx, 'MONTANT'] = ligne_centrale.iloc[0]['MONTANT']
-                                
-                                # Mettre à jour le LIBELLE COMPLEMENTAIRE
-                                site = ligne_centrale.iloc[0]['SITES'] if 'SITES' in ligne_centrale.columns else ''
-                                df_export_bt.at[idx, 'LIBELLE COMPLEMENTAIRE'] = f"CIE BT {periode_selectionnee} {site}"
-                                
-                                nb_maj += 1
-                        
-                        # Afficher les statistiques
-                        col_stat1, col_stat2, col_stat3 = st.columns(3)
-                        with col_stat1:
-                            st.metric("📝 Lignes template", len(df_export_bt))
-                        with col_stat2:
-                            st.metric("✅ Lignes mises à jour", nb_maj)
-                        with col_stat3:
-                            total_bt = pd.to_numeric(df_export_bt['MONTANT'], errors='coerce').fillna(0).sum()
-                            st.metric("💰 Total", f"{total_bt:,.0f} FCFA")
-                        
-                        st.markdown("---")
-                        
-                        # Aperçu
-                        with st.expander("👁️ Aperçu du fichier à générer"):
-                            st.dataframe(df_export_bt.head(10), use_container_width=True)
-                        
-                        st.markdown("---")
-                        
-                        # Boutons d'action
-                        col1, col2, col3 = st.columns(3)
-                        
-                        with col1:
-                            if st.button("💾 Sauvegarder template", use_container_width=True, key="save_bt_gen"):
-                                df_export_bt.to_excel(FICHIER_TEMPLATE_BT, index=False)
-                                st.success("✅ Template BT sauvegardé !")
-                                st.rerun()
-                        
-                        with col2:
-                            # Supprimer IDENTIFIANT pour l'export
-                            df_final_bt = df_export_bt.drop(columns=['IDENTIFIANT']) if 'IDENTIFIANT' in df_export_bt.columns else df_export_bt
-                            
-                            # Export avec signatures - style BT bleu
-                            excel_data_bt = export_factures_cie(df_final_bt, type_tension="BT")
-                            
-                            st.download_button(
-                                "📥 Télécharger Excel BT avec signatures",
-                                data=excel_data_bt,
-                                file_name=f"FACTURAT_ELECTRICITE_BT_{periode_selectionnee}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-                                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                                use_container_width=True,
-                                key="dl_bt_gen"
-                            )
+                    st.markdown("---")
+                    
+                    # Boutons d'action
+                    col1, col2, col3 = st.columns(3)
+                    
+                    with col1:
+                        if st.button("💾 Sauvegarder template", use_container_width=True, key="save_bt_gen"):
+                            df_export_bt.to_excel(FICHIER_TEMPLATE_BT, index=False)
+                            st.success("✅ Template BT sauvegardé !")
+                            st.rerun()
+                    
+                    with col2:
+                        # Supprimer IDENTIFIANT pour l'export
+                        df_final_bt = df_export_bt.drop(columns=['IDENTIFIANT']) if 'IDENTIFIANT' in df_export_bt.columns else df_export_bt
                         
-                        with col3:
-                            if st.button("🔄 Actualiser", use_container_width=True, key="refresh_bt_gen"):
-                                st.rerun()
-                else:
-                    st.warning("⚠️ Aucune période disponible dans la base centrale")
+                        # Export avec signatures - style BT bleu
+                        bouton_export(
+                            df_final_bt, "BT",
+                            "📥 Télécharger Excel BT avec signatures",
+                            file_name=f"FACTURAT_ELECTRICITE_BT_{periode_selectionnee}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
+                            key="export_bt_gen"
+                        )
+                    
+                    with col3:
+                        if st.button("🔄 Actualiser", use_container_width=True, key="refresh_bt_gen"):
+                            st.rerun()
             else:
-                st.warning("⚠️ La colonne DATE n'existe pas dans la base centrale")
+                st.warning("⚠️ Aucune période disponible dans la base centrale")
     
     with tab_ht:
         st.markdown("### 📋 Génération Fichier CIE HT")
@@ -1188,113 +1067,231 @@ elif page == "⚙️ Génération Fichiers":
         if df_template_ht is None:
             st.error("❌ Template HT introuvable : FACTURAT_ELECTRICITE_HT.xlsx")
         else:
-            # Filtre de date
-            df_central = st.session_state.df_central
+            # Filtre de date (périodes de l'index, ou du stockage pendant le premier chargement)
+            periodes_disponibles = valeurs_filtre('DATE')[::-1]
             
-            if 'DATE' in df_central.columns:
-                periodes_disponibles = sorted(df_central['DATE'].dropna().unique().tolist(), reverse=True)
+            if len(periodes_disponibles) > 0:
+                col_f1, col_f2 = st.columns(2)
                 
-                if len(periodes_disponibles) > 0:
-                    col_f1, col_f2 = st.columns(2)
-                    
-                    with col_f1:
-                        periode_selectionnee = st.selectbox(
-                            "📅 Sélectionner la période",
-                            periodes_disponibles,
-                            help="Choisissez la période pour générer le fichier",
-                            key="periode_ht"
+                with col_f1:
+                    periode_selectionnee = st.selectbox(
+                        "📅 Sélectionner la période",
+                        periodes_disponibles,
+                        format_func=format_periode,
+                        help="Choisissez la période pour générer le fichier",
+                        key="periode_ht"
+                    )
+                
+                with col_f2:
+                    if periode_selectionnee:
+                        periode_affichage = format_periode(periode_selectionnee)
+                        st.info(f"📊 Période sélectionnée : **{periode_affichage}**")
+                
+                st.markdown("---")
+                
+                # Filtrer la base centrale par la période sélectionnée
+                df_central_filtre = get_central(['SITES', 'IDENTIFIANT', 'MONTANT', 'DATE'], periodes=[periode_selectionnee])
+                
+                if len(df_central_filtre) == 0:
+                    st.warning(f"⚠️ Aucune donnée pour la période {periode_affichage}")
+                else:
+                    # Remplir MONTANT et LIBELLE COMPLEMENTAIRE de tout le template en une jointure
+                    with mesure("remplissage template HT"):
+                        df_export_ht, rapport_ht = remplir_template(
+                            df_template_ht, df_central_filtre, "HT", periode_selectionnee
                         )
+                    nb_maj = rapport_ht['trouves']
+                    
+                    # Afficher les statistiques
+                    col_stat1, col_stat2, col_stat3 = st.columns(3)
+                    with col_stat1:
+                        st.metric("📝 Lignes template", len(df_export_ht))
+                    with col_stat2:
+                        st.metric("✅ Lignes mises à jour", nb_maj)
+                    with col_stat3:
+                        st.metric("💰 Total", f"{rapport_ht['total']:,.0f} FCFA")
                     
-                    with col_f2:
-                        if periode_selectionnee:
-                            # Convertir la période en format lisible
-                            periode_str = str(periode_selectionnee)
-                            if len(periode_str) == 6:
-                                periode_affichage = f"{periode_str[4:6]}/{periode_str[:4]}"
-                            else:
-                                periode_affichage = periode_str
-                            st.info(f"📊 Période sélectionnée : **{periode_affichage}**")
+                    if rapport_ht['non_trouves'] or rapport_ht['doublons_periode'] or rapport_ht['doublons_template']:
+                        with st.expander(f"⚠️ Contrôle des identifiants ({len(rapport_ht['non_trouves'])} non trouvé(s))"):
+                            st.write(f"**Non trouvés dans la période** : {', '.join(rapport_ht['non_trouves']) or '-'}")
+                            st.write(f"**En double dans la période** (1re ligne utilisée) : {', '.join(rapport_ht['doublons_periode']) or '-'}")
+                            st.write(f"**En double dans le template** : {', '.join(rapport_ht['doublons_template']) or '-'}")
                     
                     st.markdown("---")
                     
-                    # Filtrer la base centrale par la période sélectionnée
-                    df_central_filtre = df_central[df_central['DATE'] == periode_selectionnee]
+                    # Aperçu
+                    with st.expander("👁️ Aperçu du fichier à générer"):
+                        st.dataframe(df_export_ht.head(10), use_container_width=True)
                     
-                    if len(df_central_filtre) == 0:
-                        st.warning(f"⚠️ Aucune donnée pour la période {periode_affichage}")
-                    else:
-                        # Créer une copie du template pour mise à jour
-                        df_export_ht = df_template_ht.copy()
-                        
-                        nb_maj = 0
-                        
-                        # Pour chaque ligne du template
-                        for idx, row_template in df_export_ht.iterrows():
-                            identifiant_template = str(row_template['IDENTIFIANT']) if 'IDENTIFIANT' in row_template else ''
-                            
-                            # Chercher dans la base centrale filtrée
-                            ligne_centrale = df_central_filtre[df_central_filtre['IDENTIFIANT'].astype(str) == identifiant_template]
-                            
-                            if not ligne_centrale.empty:
-                                # Mettre à jour le MONTANT
-                                df_export_ht.at[idx, 'MONTANT'] = ligne_centrale.iloc[0]['MONTANT']
-                                
-                                # Mettre à jour le LIBELLE COMPLEMENTAIRE
-                                site = ligne_centrale.iloc[0]['SITES'] if 'SITES' in ligne_centrale.columns else ''
-                                df_export_ht.at[idx, 'LIBELLE COMPLEMENTAIRE'] = f"CIE HT {periode_selectionnee} {site}"
-                                
-                                nb_maj += 1
-                        
-                        # Afficher les statistiques
-                        col_stat1, col_stat2, col_stat3 = st.columns(3)
-                        with col_stat1:
-                            st.metric("📝 Lignes template", len(df_export_ht))
-                        with col_stat2:
-                            st.metric("✅ Lignes mises à jour", nb_maj)
-                        with col_stat3:
-                            total_ht = pd.to_numeric(df_export_ht['MONTANT'], errors='coerce').fillna(0).sum()
-                            st.metric("💰 Total", f"{total_ht:,.0f} FCFA")
-                        
-                        st.markdown("---")
-                        
-                        # Aperçu
-                        with st.expander("👁️ Aperçu du fichier à générer"):
-                            st.dataframe(df_export_ht.head(10), use_container_width=True)
-                        
-                        st.markdown("---")
-                        
-                        # Boutons d'action
-                        col1, col2, col3 = st.columns(3)
-                        
-                        with col1:
-                            if st.button("💾 Sauvegarder template", use_container_width=True, key="save_ht_gen"):
-                                df_export_ht.to_excel(FICHIER_TEMPLATE_HT, index=False)
-                                st.success("✅ Template HT sauvegardé !")
-                                st.rerun()
-                        
-                        with col2:
-                            # Supprimer IDENTIFIANT pour l'export
-                            df_final_ht = df_export_ht.drop(columns=['IDENTIFIANT']) if 'IDENTIFIANT' in df_export_ht.columns else df_export_ht
-                            
-                            # Export avec signatures - style HT orange
-                            excel_data_ht = export_factures_cie(df_final_ht, type_tension="HT")
-                            
-                            st.download_button(
-                                "📥 Télécharger Excel HT avec signatures",
-                                data=excel_data_ht,
-                                file_name=f"FACTURAT_ELECTRICITE_HT_{periode_selectionnee}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-                                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                                use_container_width=True,
-                                key="dl_ht_gen"
-                            )
+                    st.markdown("---")
+                    
+                    # Boutons d'action
+                    col1, col2, col3 = st.columns(3)
+                    
+                    with col1:
+                        if st.button("💾 Sauvegarder template", use_container_width=True, key="save_ht_gen"):
+                            df_export_ht.to_excel(FICHIER_TEMPLATE_HT, index=False)
+                            st.success("✅ Template HT sauvegardé !")
+                            st.rerun()
+                    
+                    with col2:
+                        # Supprimer IDENTIFIANT pour l'export
+                        df_final_ht = df_export_ht.drop(columns=['IDENTIFIANT']) if 'IDENTIFIANT' in df_export_ht.columns else df_export_ht
                         
-                        with col3:
-                            if st.button("🔄 Actualiser", use_container_width=True, key="refresh_ht_gen"):
-                                st.rerun()
-                else:
-                    st.warning("⚠️ Aucune période disponible dans la base centrale")
+                        # Export avec signatures - style HT orange
+                        bouton_export(
+                            df_final_ht, "HT",
+                            "📥 Télécharger Excel HT avec signatures",
+                            file_name=f"FACTURAT_ELECTRICITE_HT_{periode_selectionnee}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
+                            key="export_ht_gen"
+                        )
+                    
+                    with col3:
+                        if st.button("🔄 Actualiser", use_container_width=True, key="refresh_ht_gen"):
+                            st.rerun()
             else:
-                st.warning("⚠️ La colonne DATE n'existe pas dans la base centrale")
+                st.warning("⚠️ Aucune période disponible dans la base centrale")
+
+    with tab_lot:
+        st.markdown("### 📦 Génération de tous les fichiers d'une plage de périodes")
+        st.markdown("*Un fichier FACTURAT par période et par tension, regroupés dans une archive ZIP*")
+        
+        periodes_lot = valeurs_filtre('DATE')
+        templates_lot = {"BT": load_template_bt(), "HT": load_template_ht()}
+        templates_lot = {t: df for t, df in templates_lot.items() if df is not None}
+        
+        if len(periodes_lot) == 0:
+            st.warning("⚠️ Aucune période disponible dans la base centrale")
+        elif not templates_lot:
+            st.error("❌ Aucun template BT/HT trouvé")
+        else:
+            col_l1, col_l2, col_l3 = st.columns(3)
+            with col_l1:
+                periode_debut = st.selectbox(
+                    "📅 Du", periodes_lot, index=max(len(periodes_lot) - 12, 0), format_func=format_periode, key="lot_debut"
+                )
+            with col_l2:
+                periode_fin = st.selectbox(
+                    "📅 Au", periodes_lot, index=len(periodes_lot) - 1, format_func=format_periode, key="lot_fin"
+                )
+            with col_l3:
+                tensions_lot = st.multiselect("⚡ Tensions", list(templates_lot), default=list(templates_lot), key="lot_tensions")
+            
+            periodes_choisies = [p for p in periodes_lot if periode_debut <= p <= periode_fin]
+            st.info(f"📊 {len(periodes_choisies)} période(s) × {len(tensions_lot)} tension(s) = **{len(periodes_choisies) * len(tensions_lot)} fichier(s)**")
+            
+            col_b1, col_b2 = st.columns(2)
+            with col_b2:
+                if st.button("🧵 Générer en arrière-plan", use_container_width=True, key="lot_travail",
+                             disabled=not periodes_choisies or not tensions_lot):
+                    os.makedirs(DOSSIER_TRAVAUX, exist_ok=True)
+                    fichiers_templates = {"BT": FICHIER_TEMPLATE_BT, "HT": FICHIER_TEMPLATE_HT}
+                    st.session_state.travail_lot = soumettre_travail(
+                        BASE_TRAVAUX, "generation", f"Génération {periode_debut} → {periode_fin}", {
+                            "templates": {t: fichiers_templates[t] for t in tensions_lot},
+                            "periodes": periodes_choisies, "stockage": STOCKAGE, "dossier_cache": DOSSIER_CACHE,
+                            "sortie": os.path.join(
+                                DOSSIER_TRAVAUX,
+                                f"FACTURAT_{periode_debut}_{periode_fin}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+                            ),
+                        }
+                    )
+            
+            if 'travail_lot' in st.session_state:
+                suivi_travail(st.session_state.travail_lot)
+            
+            if col_b1.button("🚀 Générer l'archive", use_container_width=True, key="lot_generer",
+                             disabled=not periodes_choisies or not tensions_lot):
+                df_periodes = get_central(['SITES', 'IDENTIFIANT', 'MONTANT', 'DATE'], periodes=periodes_choisies)
+                barre = st.progress(0.0, text="⏳ Génération des fichiers...")
+                
+                def avancer(termine, total, ligne):
+                    barre.progress(termine / total, text=f"⏳ {termine}/{total} - {ligne['FICHIER']}")
+                
+                contenu_zip, manifeste = generer_lot_zip(
+                    {t: templates_lot[t] for t in tensions_lot}, df_periodes, periodes_choisies,
+                    progression=avancer
+                )
+                st.session_state.lot_zip = (f"FACTURAT_{periode_debut}_{periode_fin}.zip", contenu_zip, manifeste)
+                barre.empty()
+            
+            if 'lot_zip' in st.session_state:
+                nom_zip, contenu_zip, manifeste = st.session_state.lot_zip
+                st.success(f"✅ {len(manifeste)} fichier(s) générés - Total {manifeste['TOTAL_MONTANT'].sum():,.0f} FCFA")
+                st.dataframe(manifeste, use_container_width=True, hide_index=True)
+                st.download_button(
+                    "📥 Télécharger l'archive ZIP",
+                    data=contenu_zip,
+                    file_name=nom_zip,
+                    mime="application/zip",
+                    use_container_width=True,
+                    key="lot_dl"
+                )
+
+elif page == "🧵 Travaux":
+    st.markdown("## 🧵 Travaux en arrière-plan")
+    st.markdown("*Imports et générations exécutés par le serveur, un à la fois : ils se poursuivent si la page est rechargée*")
+    st.markdown("---")
+    
+    df_travaux = lister_travaux(BASE_TRAVAUX)
+    
+    if df_travaux.empty:
+        st.info("ℹ️ Aucun travail pour le moment")
+    else:
+        actifs = df_travaux[df_travaux['statut'].isin(['en_attente', 'en_cours'])]
+        
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("⏳ En cours / en attente", len(actifs))
+        with col2:
+            st.metric("✅ Terminés", int((df_travaux['statut'] == 'termine').sum()))
+        with col3:
+            st.metric("❌ En erreur", int((df_travaux['statut'] == 'erreur').sum()))
+        
+        # Travaux actifs
+        for _, travail in actifs.iterrows():
+            texte = f"#{travail['id']} {travail['libelle']} - {travail['etape'] or 'En attente'}"
+            if pd.notna(travail['debit']):
+                texte += f" ({travail['debit']:,.0f} lignes/s)"
+            st.progress(float(travail['progression'] or 0), text=texte)
+        
+        # Historique
+        statuts = {'en_attente': '🕓 En attente', 'en_cours': '⏳ En cours', 'termine': '✅ Terminé', 'erreur': '❌ Erreur'}
+        df_affichage = pd.DataFrame({
+            'N°': df_travaux['id'],
+            'Travail': df_travaux['libelle'],
+            'Statut': df_travaux['statut'].map(statuts),
+            'Progression': (df_travaux['progression'].fillna(0) * 100).round(0),
+            'Lignes': df_travaux['lignes'],
+            'Lignes/s': df_travaux['debit'],
+            'Durée (s)': df_travaux['duree'].round(1),
+            'Créé le': df_travaux['cree_le'],
+            'Résultat': df_travaux['message'],
+        })
+        st.dataframe(df_affichage, use_container_width=True, hide_index=True)
+        
+        # Archives produites par les générations terminées
+        archives = df_travaux[(df_travaux['statut'] == 'termine') & df_travaux['resultat'].notna()].head(5)
+        for _, travail in archives.iterrows():
+            if os.path.exists(travail['resultat']):
+                with open(travail['resultat'], "rb") as f:
+                    st.download_button(
+                        f"📥 #{travail['id']} {os.path.basename(travail['resultat'])}",
+                        data=f.read(),
+                        file_name=os.path.basename(travail['resultat']),
+                        mime="application/zip",
+                        key=f"dl_travail_{travail['id']}"
+                    )
+        
+        col_a1, col_a2 = st.columns(2)
+        with col_a1:
+            rafraichir = st.checkbox("🔄 Actualisation automatique", value=len(actifs) > 0, key="travaux_auto")
+        with col_a2:
+            if st.button("🔄 Actualiser", use_container_width=True, key="travaux_refresh"):
+                st.rerun()
+        
+        if rafraichir and len(actifs) > 0:
+            relancer_suivi(2)
 
 # Footer
 st.markdown("---")
@@ -1303,3 +1300,6 @@ st.markdown("""
     <p><strong>Système Centralisé</strong> - Version 3.2 - Export Professionnel avec Signatures</p>
 </div>
 """, unsafe_allow_html=True)
+
+# Mesures du rerun : panneau optionnel dans la barre latérale et journal local
+terminer_rerun(time.perf_counter())
@@ -0,0 +1,2259 @@
+import io
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import pickle
+import queue
+import sqlite3
+import threading
+import multiprocessing
+import bisect
+import difflib
+import weakref
+import zipfile
+import contextvars
+from collections import OrderedDict
+from copy import copy
+from contextlib import contextmanager
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Colonnes de la base centrale
+COLONNES_SITE = ['UC', 'CODE AGCE', 'SITES', 'CORRESPONDANCE', 'REFERENCE', 'TENSION']
+COLONNES_FAITS = ['IDENTIFIANT', 'DATE', 'MONTANT', 'CONSO']
+COLONNES_CENTRALE = ['UC', 'CODE AGCE', 'SITES', 'CORRESPONDANCE', 'IDENTIFIANT', 'REFERENCE',
+                     'TENSION', 'MONTANT', 'CONSO', 'DATE']
+
+# Configuration des fichiers de factures CIE
+CONFIG_FACTURES = {
+    'BT': {'cle': 'reference contrat', 'montant': 'Montant facture TTC', 'conso': 'conso', 'caract': 'caract'},
+    'HT': {'cle': 'refraccord', 'montant': 'montfact', 'conso': 'conso', 'caract': 'caract'},
+}
+
+
+# === INSTRUMENTATION (durées par rerun, mémoire de la session) ===
+# Une collecte est ouverte au début de chaque rerun ; les blocs `with mesure(nom)` exécutés dans
+# le même contexte y ajoutent leur durée. Sans collecte ouverte, mesure() ne coûte rien.
+_MESURES = contextvars.ContextVar('mesures_factures', default=None)
+TAILLE_MAX_JOURNAL_MESURES = 10 * 2 ** 20
+
+def demarrer_mesures():
+    """Ouvre la collecte des durées du rerun en cours ; retourne la liste alimentée par mesure()"""
+    mesures = []
+    _MESURES.set(mesures)
+    return mesures
+
+def terminer_mesures():
+    """Ferme la collecte et retourne les durées [(nom, secondes)] dans l'ordre de fin"""
+    mesures = _MESURES.get() or []
+    _MESURES.set(None)
+    return mesures
+
+def enregistrer_mesure(nom, secondes):
+    """Ajoute une durée mesurée ailleurs (processus du pool d'exports...) à la collecte ouverte"""
+    mesures = _MESURES.get()
+    if mesures is not None:
+        mesures.append((nom, secondes))
+
+@contextmanager
+def mesure(nom):
+    """Chronomètre un bloc nommé"""
+    if _MESURES.get() is None:
+        yield
+        return
+    debut = time.perf_counter()
+    try:
+        yield
+    finally:
+        enregistrer_mesure(nom, time.perf_counter() - debut)
+
+def resumer_mesures(mesures):
+    """Durées regroupées par nom : DataFrame (ETAPE, APPELS, DUREE_MS) trié par durée décroissante"""
+    df = pd.DataFrame(mesures, columns=['ETAPE', 'SECONDES'])
+    resume = df.groupby('ETAPE', sort=False).agg(APPELS=('SECONDES', 'size'), DUREE_MS=('SECONDES', 'sum'))
+    resume['DUREE_MS'] = (resume['DUREE_MS'] * 1000).round(1)
+    return resume.sort_values('DUREE_MS', ascending=False).reset_index()
+
+def taille_memoire(valeur, profondeur=2):
+    """Empreinte mémoire approximative (octets) d'un objet de session"""
+    if isinstance(valeur, (pd.DataFrame, pd.Series, pd.Index)):
+        taille = valeur.memory_usage(deep=True)
+        return int(taille.sum()) if isinstance(taille, pd.Series) else int(taille)
+    if isinstance(valeur, io.BytesIO):
+        return valeur.getbuffer().nbytes
+    if isinstance(valeur, (bytes, bytearray)):
+        return len(valeur)
+    if profondeur > 0 and isinstance(valeur, dict):
+        return sys.getsizeof(valeur) + sum(taille_memoire(v, profondeur - 1) for v in valeur.values())
+    if profondeur > 0 and isinstance(valeur, (list, tuple)):
+        return sys.getsizeof(valeur) + sum(taille_memoire(v, profondeur - 1) for v in valeur)
+    return sys.getsizeof(valeur)
+
+def journaliser_mesures(chemin, enregistrement):
+    """Ajoute un enregistrement (une ligne JSON) au journal des mesures ; au-delà de
+    TAILLE_MAX_JOURNAL_MESURES, le journal est archivé en `chemin`.1. Sous verrou de fichier :
+    deux sessions qui archivent en même temps n'écrasent pas l'archive avec un journal neuf."""
+    ligne = json.dumps(enregistrement, ensure_ascii=False, default=str) + '\n'
+    with verrou_fichier(chemin + '.verrou'):
+        if os.path.exists(chemin) and os.path.getsize(chemin) > TAILLE_MAX_JOURNAL_MESURES:
+            os.replace(chemin, chemin + '.1')
+        with open(chemin, 'a', encoding='utf-8') as f:
+            f.write(ligne)
+
+
+# === CACHE DES FICHIERS EXCEL ===
+# Partagé par toutes les sessions du processus : clé = (chemin, mtime, taille)
+_CACHE_EXCEL = {}
+_VERROU_CACHE_EXCEL = threading.Lock()
+STATS_CACHE_EXCEL = {'hits': 0, 'disque': 0, 'misses': 0}
+
+def lire_excel_cache(chemin, dossier_cache=None):
+    """pd.read_excel mis en cache : le fichier n'est re-parsé que s'il a changé sur le disque.
+    Les DataFrames parsés sont aussi conservés dans `dossier_cache` (fichier pickle annexe)."""
+    stat = os.stat(chemin)
+    cle = (os.path.abspath(chemin), stat.st_mtime_ns, stat.st_size)
+
+    with _VERROU_CACHE_EXCEL:
+        if cle in _CACHE_EXCEL:
+            STATS_CACHE_EXCEL['hits'] += 1
+            return _CACHE_EXCEL[cle].copy()
+
+    nom_annexe = None
+    if dossier_cache:
+        os.makedirs(dossier_cache, exist_ok=True)
+        base = os.path.basename(chemin)
+        nom_annexe = os.path.join(dossier_cache, f"{base}.{stat.st_mtime_ns}.{stat.st_size}.pkl")
+
+    if nom_annexe and os.path.exists(nom_annexe):
+        df = pd.read_pickle(nom_annexe)
+        STATS_CACHE_EXCEL['disque'] += 1
+    else:
+        with mesure('lecture Excel (read_excel)'):
+            df = pd.read_excel(chemin)
+        STATS_CACHE_EXCEL['misses'] += 1
+        if nom_annexe:
+            # Supprimer les annexes des versions précédentes du fichier
+            for ancien in os.listdir(dossier_cache):
+                if ancien.startswith(os.path.basename(chemin) + '.') and ancien.endswith('.pkl'):
+                    os.remove(os.path.join(dossier_cache, ancien))
+            _ecrire_atomique(nom_annexe, df.to_pickle)
+
+    with _VERROU_CACHE_EXCEL:
+        for ancienne_cle in [c for c in _CACHE_EXCEL if c[0] == cle[0]]:
+            del _CACHE_EXCEL[ancienne_cle]
+        _CACHE_EXCEL[cle] = df
+    return df.copy()
+
+
+# === BASE CENTRALE : DIMENSION SITES + TABLE DE FAITS ===
+# Schéma typé, appliqué au chargement et à l'import : attributs répétés des sites en catégories,
+# période en entier AAAAMM, MONTANT et CONSO en float64 (valeurs saisies conservées à l'identique).
+COLONNES_CATEGORIES = ['UC', 'CODE AGCE', 'SITES', 'CORRESPONDANCE', 'TENSION', 'REFERENCE']
+TYPES_FAITS = {'DATE': 'Int32', 'MONTANT': 'float64', 'CONSO': 'float64'}
+
+ANNEES_PERIODES = (1900, 2100)
+
+def typer_periodes(serie):
+    """Périodes (202409, 202409.0, '202409', '09/2024') -> entiers AAAAMM (Int32), <NA> si invalides :
+    non entières, mois hors de 1-12 ou année hors de ANNEES_PERIODES (45383, 202413, 19000101)"""
+    if pd.api.types.is_numeric_dtype(serie) and not pd.api.types.is_bool_dtype(serie):
+        nombres = serie.astype('float64')
+    else:
+        texte = serie.astype('string').str.strip()
+        nombres = pd.to_numeric(texte, errors='coerce').astype('float64')
+        mois_annee = texte.str.extract(r'^(\d{1,2})[/-](\d{4})$').astype('float64')
+        nombres = nombres.fillna(mois_annee[1] * 100 + mois_annee[0])
+    annees, mois = nombres // 100, nombres % 100
+    valides = (nombres.round() == nombres) & mois.between(1, 12) & annees.between(*ANNEES_PERIODES)
+    return nombres.where(valides).astype('Int32')
+
+def normaliser_periode(valeur):
+    """Période unique en entier AAAAMM (None si absente ou invalide)"""
+    periode = typer_periodes(pd.Series([valeur], dtype=object)).iloc[0]
+    return None if pd.isna(periode) else int(periode)
+
+def format_periode(periode):
+    """Affichage MM/AAAA d'une période AAAAMM"""
+    if periode is None or pd.isna(periode):
+        return ''
+    return f"{int(periode) % 100:02d}/{int(periode) // 100}"
+
+def typer_colonne_fait(col, serie):
+    """Type d'une colonne de la table de faits"""
+    if col == 'IDENTIFIANT':
+        return serie.astype(str)
+    if col == 'DATE':
+        return typer_periodes(serie)
+    return pd.to_numeric(serie, errors='coerce').astype(TYPES_FAITS[col])
+
+def typer_faits(df_faits):
+    """Applique les types de la table de faits (validés une fois, au chargement ou à l'import)"""
+    df_faits = df_faits[COLONNES_FAITS].copy()
+    for col in COLONNES_FAITS:
+        df_faits[col] = typer_colonne_fait(col, df_faits[col])
+    return df_faits
+
+def typer_sites(df_sites):
+    """Colonnes répétitives de la dimension sites en catégories"""
+    categories = [col for col in COLONNES_CATEGORIES
+                  if col in df_sites.columns and not isinstance(df_sites[col].dtype, pd.CategoricalDtype)]
+    if not categories:
+        return df_sites
+    return df_sites.astype({col: 'category' for col in categories})
+
+def sans_categories(df):
+    """Colonnes catégorielles remises en objet (édition de valeurs hors catégories)"""
+    categories = [col for col in df.columns if isinstance(df[col].dtype, pd.CategoricalDtype)]
+    if not categories:
+        return df
+    return df.astype({col: object for col in categories})
+
+def construire_index_sites(df_central):
+    """Construit l'index IDENTIFIANT -> attributs du site (première occurrence par identifiant)"""
+    colonnes = [col for col in df_central.columns if col not in COLONNES_FAITS]
+    index_sites = df_central[colonnes].copy()
+    index_sites.index = pd.Index(df_central['IDENTIFIANT'].astype(str).values, name='IDENTIFIANT')
+    index_sites = index_sites[~index_sites.index.duplicated(keep='first')]
+
+    # Les attributs absents de la base centrale sont laissés vides
+    for col in COLONNES_SITE:
+        if col not in index_sites.columns:
+            index_sites[col] = ''
+
+    return typer_sites(index_sites)
+
+def separer_base(df_central):
+    """Sépare une base centrale à plat en dimension sites et table de faits"""
+    df_central = df_central.copy()
+    for col in COLONNES_FAITS:
+        if col not in df_central.columns:
+            df_central[col] = None
+
+    df_sites = construire_index_sites(df_central)
+    df_faits = typer_faits(df_central)
+    return df_sites, df_faits
+
+def joindre_base(df_sites, df_faits, colonnes=None):
+    """Couche de jointure : reconstitue la vue à plat (faits + attributs du site)"""
+    if colonnes is None:
+        extra = [col for col in df_sites.columns if col not in COLONNES_CENTRALE]
+        colonnes = COLONNES_CENTRALE + extra
+
+    colonnes_sites = [col for col in colonnes if col in df_sites.columns]
+    positions = df_sites.index.get_indexer(df_faits['IDENTIFIANT'].values)
+
+    df_vue = df_sites[colonnes_sites].iloc[positions].copy()
+    df_vue.index = df_faits.index
+    if (positions < 0).any():
+        df_vue.loc[positions < 0, colonnes_sites] = None
+
+    for col in COLONNES_FAITS:
+        if col in colonnes:
+            df_vue[col] = df_faits[col]
+
+    return df_vue[[col for col in colonnes if col in df_vue.columns]]
+
+def _nouveaux_sites(df_sites, df_lignes):
+    """Lignes de la dimension pour les IDENTIFIANT de df_lignes encore inconnus"""
+    inconnus = df_lignes[~df_lignes['IDENTIFIANT'].isin(df_sites.index)]
+    if inconnus.empty:
+        return df_sites.iloc[:0]
+    inconnus = inconnus.drop_duplicates('IDENTIFIANT', keep='last')
+    nouveaux = inconnus.set_index('IDENTIFIANT').reindex(columns=df_sites.columns)
+    nouveaux.index.name = df_sites.index.name
+    return nouveaux.fillna('')
+
+def appliquer_changements_editeur(df_sites, df_faits, df_vue, changements):
+    """Applique le jeu de changements de st.data_editor (cellules modifiées, lignes ajoutées,
+    lignes supprimées) à la dimension sites et à la table de faits. Les positions de l'éditeur
+    sont traduites en ids de faits par df_vue (la vue affichée), qui peut venir d'une version
+    antérieure de la base : une ligne éditée ou supprimée absente de df_faits lève ValueError.
+    Retourne (sites, faits, écritures) où écritures liste uniquement ce qui doit être persisté."""
+    edited_rows = changements.get('edited_rows', {})
+    added_rows = changements.get('added_rows', [])
+    deleted_rows = changements.get('deleted_rows', [])
+
+    references = df_vue.index[[int(position) for position in list(edited_rows) + list(deleted_rows)]]
+    disparues = references.difference(df_faits.index)
+    if len(disparues):
+        raise ValueError(
+            f"{len(disparues)} ligne(s) éditée(s) ont été supprimée(s) de la base entre-temps "
+            f"(ids {', '.join(map(str, disparues[:10]))})"
+        )
+
+    faits_avant = df_faits
+    df_sites = sans_categories(df_sites).copy()
+    df_faits = df_faits.copy()
+    periodes = set()
+    ids_sites = set()
+
+    # Cellules modifiées : une Series par colonne (index = id du fait)
+    par_colonne = {}
+    for position, valeurs in edited_rows.items():
+        id_fait = df_vue.index[int(position)]
+        for col, valeur in valeurs.items():
+            par_colonne.setdefault(col, {})[id_fait] = valeur
+    ids_modifies = pd.Index(sorted({i for valeurs in par_colonne.values() for i in valeurs}))
+    periodes |= set(faits_avant.loc[ids_modifies, 'DATE'])
+
+    for col in COLONNES_FAITS:
+        if col in par_colonne:
+            serie = typer_colonne_fait(col, pd.Series(par_colonne[col]))
+            df_faits.loc[serie.index, col] = serie
+
+    if len(ids_modifies):
+        # Un IDENTIFIANT modifié vers un site inconnu crée ce site avec les attributs de la ligne
+        lignes = df_vue.loc[ids_modifies, [col for col in df_sites.columns if col in df_vue.columns]].copy()
+        lignes['IDENTIFIANT'] = df_faits.loc[ids_modifies, 'IDENTIFIANT']
+        nouveaux = _nouveaux_sites(df_sites, lignes)
+        df_sites = pd.concat([df_sites, nouveaux])
+        ids_sites |= set(nouveaux.index)
+
+    for col in df_sites.columns:
+        if col in par_colonne:
+            serie = pd.Series(par_colonne[col])
+            serie.index = df_faits.loc[serie.index, 'IDENTIFIANT'].values
+            serie = serie[~serie.index.duplicated(keep='last')]
+            df_sites.loc[serie.index, col] = serie.values
+            ids_sites |= set(serie.index)
+
+    # Lignes supprimées
+    ids_supprimes = df_vue.index[[int(position) for position in deleted_rows]]
+    periodes |= set(faits_avant.loc[ids_supprimes, 'DATE'])
+    df_faits = df_faits.drop(ids_supprimes)
+
+    # Lignes ajoutées (celles sans IDENTIFIANT sont ignorées)
+    ids_ajoutes = pd.Index([])
+    if added_rows:
+        df_ajouts = pd.DataFrame(added_rows)
+        for col in COLONNES_FAITS:
+            if col not in df_ajouts.columns:
+                df_ajouts[col] = None
+        df_ajouts = df_ajouts[df_ajouts['IDENTIFIANT'].notna() & (df_ajouts['IDENTIFIANT'].astype(str) != '')]
+        df_ajouts['IDENTIFIANT'] = df_ajouts['IDENTIFIANT'].astype(str)
+
+        nouveaux = _nouveaux_sites(df_sites, df_ajouts)
+        df_sites = pd.concat([df_sites, nouveaux])
+        ids_sites |= set(nouveaux.index)
+
+        nb_avant = len(df_faits)
+        df_faits = ajouter_faits(df_faits, typer_faits(df_ajouts))
+        ids_ajoutes = df_faits.index[nb_avant:]
+
+    df_sites = typer_sites(df_sites)
+    ids_ecrits = ids_modifies.difference(ids_supprimes).append(ids_ajoutes)
+    faits_ecrits = df_faits.loc[ids_ecrits]
+    periodes |= set(faits_ecrits['DATE'])
+
+    ecritures = {
+        'sites': df_sites.loc[sorted(ids_sites)],
+        'faits': faits_ecrits,
+        'supprimes': ids_supprimes,
+        'periodes': periodes,
+        'resume': {
+            'cellules': sum(len(valeurs) for valeurs in edited_rows.values()),
+            'ajouts': len(ids_ajoutes),
+            'suppressions': len(ids_supprimes),
+        }
+    }
+    return df_sites, df_faits, ecritures
+
+def charger_base(fichier_sauvegarde, fichier_excel):
+    """Charge (sites, faits) depuis la sauvegarde, ou depuis l'Excel initial. None si absent."""
+    if os.path.exists(fichier_sauvegarde):
+        with open(fichier_sauvegarde, 'rb') as f:
+            data = pickle.load(f)
+        # Ancien format : DataFrame à plat
+        if isinstance(data, pd.DataFrame):
+            return separer_base(data)
+        return data['sites'], data['faits']
+    elif os.path.exists(fichier_excel):
+        return separer_base(lire_excel_cache(fichier_excel))
+    return None
+
+def ajouter_faits(df_faits, df_nouveaux):
+    """Ajoute de nouveaux faits en leur attribuant des identifiants de ligne à la suite"""
+    debut = int(df_faits.index.max()) + 1 if len(df_faits) else 1
+    df_nouveaux = df_nouveaux.copy()
+    df_nouveaux.index = pd.RangeIndex(debut, debut + len(df_nouveaux))
+    return pd.concat([df_faits, df_nouveaux])
+
+CLE_FAITS = ['IDENTIFIANT', 'DATE']
+
+def upserter_faits(df_faits, df_nouveaux, fichiers=None):
+    """Import idempotent : au plus un fait par (IDENTIFIANT, DATE). La TENSION étant portée par
+    le site, c'est la clé unique (IDENTIFIANT, DATE, TENSION). Un fait existant est remplacé en
+    gardant son id (sauf ses valeurs non vides remplacées par du vide), ses doublons éventuels
+    sont supprimés. Les lignes d'un même fichier ayant la
+    même clé sont additionnées ; d'un fichier à l'autre (`fichiers` : numéro du fichier de chaque
+    ligne), le dernier fichier l'emporte. Retourne (df_faits, ecritures) ; ecritures['resume']
+    compte les ajouts, remplacements, lignes inchangées, doublons supprimés et clés présentes
+    dans plusieurs fichiers."""
+    fichiers = np.zeros(len(df_nouveaux), dtype=int) if fichiers is None else np.asarray(fichiers)
+    df_nouveaux = df_nouveaux.assign(FICHIER=fichiers).groupby(
+        CLE_FAITS + ['FICHIER'], sort=False, as_index=False
+    )[['MONTANT', 'CONSO']].sum(min_count=1).sort_values('FICHIER', kind='stable')
+    recouvrements = int(df_nouveaux.duplicated(CLE_FAITS).sum())
+    df_nouveaux = df_nouveaux.drop_duplicates(CLE_FAITS, keep='last')
+    cles_nouveaux = pd.MultiIndex.from_frame(df_nouveaux[CLE_FAITS])
+
+    existants = df_faits[pd.MultiIndex.from_frame(df_faits[CLE_FAITS]).isin(cles_nouveaux)]
+    gardes = existants[~existants.duplicated(CLE_FAITS)]
+    supprimes = existants.index.difference(gardes.index)
+
+    positions = pd.MultiIndex.from_frame(gardes[CLE_FAITS]).get_indexer(cles_nouveaux)
+    remplaces = df_nouveaux[positions >= 0].set_axis(gardes.index[positions[positions >= 0]])
+    # Un montant ou une conso vide (illisible) ne remplace jamais une valeur existante
+    for col in ('MONTANT', 'CONSO'):
+        remplaces[col] = remplaces[col].fillna(df_faits.loc[remplaces.index, col])
+    ajoutes = df_nouveaux[positions < 0]
+    modifies = lignes_modifiees(df_faits, typer_faits(remplaces[COLONNES_FAITS]))[1]
+
+    debut = int(df_faits.index.max()) + 1 if len(df_faits) else 1
+    ajoutes = typer_faits(ajoutes[COLONNES_FAITS]).set_axis(pd.RangeIndex(debut, debut + len(ajoutes)))
+    df_faits = _fusionner(df_faits.drop(supprimes), modifies)
+    if len(ajoutes):
+        df_faits = pd.concat([df_faits, ajoutes])
+
+    ecritures = {
+        'sites': pd.DataFrame(),
+        'faits': pd.concat([modifies, ajoutes]),
+        'supprimes': supprimes,
+        'periodes': set(df_nouveaux['DATE']),
+        'resume': {
+            'ajouts': len(ajoutes),
+            'remplacements': len(modifies),
+            'inchanges': len(remplaces) - len(modifies),
+            'doublons_supprimes': len(supprimes),
+            'recouvrements': recouvrements,
+        },
+    }
+    return df_faits, ecritures
+
+def doublons_faits(df_faits, faits_ecrits):
+    """Clés (IDENTIFIANT, DATE) des faits écrits qui apparaissent plusieurs fois dans df_faits"""
+    cles = df_faits[CLE_FAITS].dropna()
+    cles = cles[cles.duplicated(keep=False)]
+    ecrites = pd.MultiIndex.from_frame(faits_ecrits[CLE_FAITS])
+    return sorted(set(map(tuple, cles[pd.MultiIndex.from_frame(cles).isin(ecrites)].values.tolist())))
+
+def lignes_modifiees(df_avant, df_apres):
+    """Retourne les lignes de df_apres absentes ou différentes dans df_avant"""
+    communs = df_apres.index.intersection(df_avant.index)
+    colonnes = [col for col in df_apres.columns if col in df_avant.columns]
+    avant = df_avant.loc[communs, colonnes]
+    apres = df_apres.loc[communs, colonnes]
+    identiques = ((avant == apres) | (avant.isna() & apres.isna())).all(axis=1)
+
+    nouvelles = df_apres[~df_apres.index.isin(df_avant.index)]
+    modifiees = df_apres.loc[communs[~identiques.values]]
+    return nouvelles, modifiees
+
+
+# === STOCKAGE SQLITE ===
+def _valeurs_sql(df):
+    """Convertit un DataFrame en lignes de valeurs Python (NaN -> NULL)"""
+    df = df.astype(object)
+    return df.where(df.notna(), None).values.tolist()
+
+def _colonnes_sql(colonnes):
+    return ', '.join(f'"{col}"' for col in colonnes)
+
+def connexion_sqlite(chemin_db):
+    con = sqlite3.connect(chemin_db)
+    con.execute('PRAGMA journal_mode=WAL')
+    return con
+
+def creer_schema_sqlite(con, colonnes_sites):
+    """Crée les tables sites / faits et leurs index (l'index de clé est créé après chargement)"""
+    con.execute(f'CREATE TABLE IF NOT EXISTS sites ("IDENTIFIANT" TEXT PRIMARY KEY, {_colonnes_sql(colonnes_sites)})')
+    con.execute(
+        'CREATE TABLE IF NOT EXISTS faits ('
+        'id INTEGER PRIMARY KEY, "IDENTIFIANT" TEXT NOT NULL, "DATE" TEXT, "MONTANT" REAL, "CONSO" REAL)'
+    )
+    con.execute('CREATE INDEX IF NOT EXISTS idx_faits_date ON faits ("DATE")')
+    con.execute('CREATE INDEX IF NOT EXISTS idx_sites_tension ON sites ("TENSION", "IDENTIFIANT")')
+
+def _incrementer_version_sqlite(con):
+    """Compteur d'écritures, incrémenté dans la transaction de chaque écriture : les autres
+    processus détectent ainsi une modification de la base (les lectures ne le changent pas)"""
+    con.execute('CREATE TABLE IF NOT EXISTS meta (cle TEXT PRIMARY KEY, valeur INTEGER NOT NULL)')
+    con.execute(
+        "INSERT INTO meta (cle, valeur) VALUES ('version', 1) "
+        "ON CONFLICT (cle) DO UPDATE SET valeur = valeur + 1"
+    )
+
+def version_sqlite(chemin_db):
+    """Compteur d'écritures de la base (0 pour une base antérieure au compteur, None si absente)"""
+    if not os.path.exists(chemin_db):
+        return None
+    con = sqlite3.connect(chemin_db)
+    try:
+        ligne = con.execute("SELECT valeur FROM meta WHERE cle = 'version'").fetchone()
+    except sqlite3.OperationalError:
+        ligne = None
+    finally:
+        con.close()
+    return ligne[0] if ligne else 0
+
+def _creer_index_cle_faits(con):
+    """Index unique (IDENTIFIANT, DATE) ; non unique tant que la base contient d'anciens doublons"""
+    if con.execute("SELECT 1 FROM sqlite_master WHERE name = 'ux_faits_identifiant_date'").fetchone():
+        return
+    try:
+        con.execute('CREATE UNIQUE INDEX IF NOT EXISTS ux_faits_identifiant_date ON faits ("IDENTIFIANT", "DATE")')
+        con.execute('DROP INDEX IF EXISTS idx_faits_identifiant_date')
+    except sqlite3.IntegrityError:
+        con.execute('CREATE INDEX IF NOT EXISTS idx_faits_identifiant_date ON faits ("IDENTIFIANT", "DATE")')
+
+def _inserer_sites(con, df_sites, upsert=False):
+    colonnes = ['IDENTIFIANT'] + list(df_sites.columns)
+    lignes = _valeurs_sql(df_sites.reset_index(names='IDENTIFIANT')[colonnes])
+    marques = ', '.join('?' * len(colonnes))
+    requete = f'INSERT INTO sites ({_colonnes_sql(colonnes)}) VALUES ({marques})'
+    if upsert:
+        maj = ', '.join(f'"{col}" = excluded."{col}"' for col in df_sites.columns)
+        requete += f' ON CONFLICT ("IDENTIFIANT") DO UPDATE SET {maj}'
+    con.executemany(requete, lignes)
+
+def _inserer_faits(con, df_faits, mode='INSERT'):
+    lignes = _valeurs_sql(df_faits[COLONNES_FAITS].reset_index(names='id')[['id'] + COLONNES_FAITS])
+    con.executemany(f'{mode} INTO faits (id, {_colonnes_sql(COLONNES_FAITS)}) VALUES (?, ?, ?, ?, ?)', lignes)
+
+def sauvegarder_base_sqlite(chemin_db, df_sites, df_faits):
+    """Réécrit entièrement la base SQLite (migration, restauration)"""
+    with connexion_sqlite(chemin_db) as con:
+        con.execute('DROP TABLE IF EXISTS sites')
+        con.execute('DROP TABLE IF EXISTS faits')
+        creer_schema_sqlite(con, list(df_sites.columns))
+        _inserer_sites(con, df_sites)
+        _inserer_faits(con, df_faits)
+        _creer_index_cle_faits(con)
+        _incrementer_version_sqlite(con)
+    con.close()
+
+def enregistrer_changements_sqlite(chemin_db, sites_ecrits, faits_ecrits, faits_supprimes):
+    """Persiste un jeu de changements connu, en une transaction.
+    Les suppressions passent en premier pour libérer les clés (IDENTIFIANT, DATE) réutilisées."""
+    with connexion_sqlite(chemin_db) as con:
+        con.executemany('DELETE FROM faits WHERE id = ?', [(int(i),) for i in faits_supprimes])
+        if len(sites_ecrits):
+            _inserer_sites(con, sites_ecrits, upsert=True)
+        if len(faits_ecrits):
+            _inserer_faits(con, faits_ecrits, mode='INSERT OR REPLACE')
+        if len(faits_supprimes):
+            # Les doublons hérités viennent peut-être d'être supprimés
+            _creer_index_cle_faits(con)
+        _incrementer_version_sqlite(con)
+    con.close()
+
+def charger_base_sqlite(chemin_db):
+    """Charge (sites, faits) depuis la base SQLite"""
+    with connexion_sqlite(chemin_db) as con:
+        df_sites = pd.read_sql_query('SELECT * FROM sites ORDER BY rowid', con, index_col='IDENTIFIANT')
+        df_faits = pd.read_sql_query(
+            f'SELECT id, {_colonnes_sql(COLONNES_FAITS)} FROM faits ORDER BY id', con, index_col='id'
+        )
+    con.close()
+    df_faits.index.name = None
+    return typer_sites(df_sites), typer_faits(df_faits)
+
+def requeter_periode_sqlite(chemin_db, periode, colonnes, tension=None):
+    """Lit uniquement les lignes d'une période (et d'une tension) jointes à leurs sites"""
+    select = ', '.join(
+        f'f."{col}"' if col in COLONNES_FAITS else f's."{col}"' for col in colonnes
+    )
+    requete = f'SELECT f.id, {select} FROM faits f LEFT JOIN sites s ON s."IDENTIFIANT" = f."IDENTIFIANT" WHERE f."DATE" = ?'
+    params = [str(periode)]
+    if tension is not None:
+        requete += ' AND s."TENSION" = ?'
+        params.append(tension)
+
+    with connexion_sqlite(chemin_db) as con:
+        df = pd.read_sql_query(requete + ' ORDER BY f.id', con, params=params, index_col='id')
+    con.close()
+    df.index.name = None
+    for col in df.columns.intersection(['DATE', 'MONTANT', 'CONSO']):
+        df[col] = typer_colonne_fait(col, df[col])
+    return df
+
+def periodes_sqlite(chemin_db):
+    """Périodes présentes dans la base SQLite (index sur DATE), sans lire les faits"""
+    if not os.path.exists(chemin_db):
+        return []
+    with connexion_sqlite(chemin_db) as con:
+        valeurs = [ligne[0] for ligne in con.execute('SELECT DISTINCT "DATE" FROM faits WHERE "DATE" IS NOT NULL')]
+    con.close()
+    return sorted(int(p) for p in typer_periodes(pd.Series(valeurs, dtype=object)).dropna())
+
+def migrer_vers_sqlite(chemin_db, fichier_sauvegarde, fichier_excel):
+    """Migration unique depuis la sauvegarde pickle ou l'Excel initial. False si aucune source."""
+    if os.path.exists(chemin_db):
+        return True
+    base = charger_base(fichier_sauvegarde, fichier_excel)
+    if base is None:
+        return False
+    df_sites, df_faits = base
+    df_faits = df_faits.reset_index(drop=True)
+    df_faits.index = df_faits.index + 1
+
+    # Écriture dans un fichier temporaire pour qu'une migration interrompue soit relancée
+    chemin_tmp = chemin_db + '.tmp'
+    if os.path.exists(chemin_tmp):
+        os.remove(chemin_tmp)
+    sauvegarder_base_sqlite(chemin_tmp, df_sites, df_faits)
+    os.replace(chemin_tmp, chemin_db)
+    return True
+
+
+# === STOCKAGE PARQUET PARTITIONNÉ PAR PÉRIODE ===
+PARTITION_SANS_DATE = '__SANS_DATE__'
+
+def _chemin_manifeste(dossier):
+    return os.path.join(dossier, 'manifest.json')
+
+def lire_manifeste(dossier):
+    """Manifeste du snapshot Parquet (None si le snapshot n'existe pas)"""
+    chemin = _chemin_manifeste(dossier)
+    if not os.path.exists(chemin):
+        return None
+    with open(chemin, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def _ecrire_atomique(chemin, ecrire):
+    chemin_tmp = chemin + '.tmp'
+    ecrire(chemin_tmp)
+    os.replace(chemin_tmp, chemin)
+
+@contextmanager
+def verrou_fichier(chemin):
+    """Verrou exclusif entre processus (application, ligne de commande) et entre threads :
+    chaque entrée ouvre son propre descripteur. Non réentrant."""
+    with open(chemin, 'a+b') as f:
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+def _ecrire_parquet(df, chemin):
+    df = df.copy()
+    # Parquet exige un type par colonne : les colonnes texte mixtes (int + str) passent en texte
+    for col in df.columns:
+        if df[col].dtype == object and pd.api.types.infer_dtype(df[col], skipna=True).startswith('mixed'):
+            df[col] = df[col].map(lambda x: x if pd.isna(x) else str(x))
+    _ecrire_atomique(chemin, lambda tmp: df.to_parquet(tmp, index=False))
+
+def _ecrire_manifeste(dossier, manifeste):
+    manifeste['maj'] = datetime.now().isoformat(timespec='seconds')
+
+    def ecrire(tmp):
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(manifeste, f, ensure_ascii=False, indent=2)
+
+    _ecrire_atomique(_chemin_manifeste(dossier), ecrire)
+
+def _cle_partition(periode):
+    return PARTITION_SANS_DATE if pd.isna(periode) else str(periode)
+
+def sauvegarder_base_parquet(dossier, df_sites, df_faits, periodes=None, sites=True):
+    """Écrit le snapshot : sites.parquet + une partition par période.
+    Si `periodes` est fourni, seules ces partitions sont réécrites. Les partitions vidées ne
+    sont supprimées qu'après l'écriture du manifeste, qui ne pointe jamais vers un fichier absent."""
+    os.makedirs(os.path.join(dossier, 'faits'), exist_ok=True)
+    manifeste = lire_manifeste(dossier) or {'partitions': {}}
+
+    if sites:
+        _ecrire_parquet(df_sites.reset_index(names='IDENTIFIANT'), os.path.join(dossier, 'sites.parquet'))
+        manifeste['sites'] = {'fichier': 'sites.parquet', 'lignes': len(df_sites)}
+
+    cles = df_faits['DATE'].map(_cle_partition)
+    a_ecrire = set(cles.unique()) if periodes is None else {_cle_partition(p) for p in periodes}
+    if periodes is None:
+        manifeste['partitions'] = {}
+
+    videes = []
+    for cle in sorted(a_ecrire):
+        partition = df_faits[cles == cle]
+        fichier = os.path.join('faits', 'DATE=' + re.sub(r'[^0-9A-Za-z_-]', '_', cle) + '.parquet')
+        chemin = os.path.join(dossier, fichier)
+        if partition.empty:
+            videes.append(chemin)
+            manifeste['partitions'].pop(cle, None)
+            continue
+        _ecrire_parquet(partition.reset_index(names='id'), chemin)
+        manifeste['partitions'][cle] = {
+            'fichier': fichier,
+            'lignes': len(partition),
+            'montant': float(partition['MONTANT'].sum()),
+            'id_max': int(partition.index.max())
+        }
+
+    _ecrire_manifeste(dossier, manifeste)
+    for chemin in videes:
+        if os.path.exists(chemin):
+            os.remove(chemin)
+
+def _lire_snapshot_parquet(dossier, cles=None):
+    """Lit sites.parquet et les partitions demandées (toutes si cles est None), sans le journal"""
+    manifeste = lire_manifeste(dossier)
+    df_sites = pd.read_parquet(os.path.join(dossier, manifeste['sites']['fichier'])).set_index('IDENTIFIANT')
+
+    partitions = manifeste['partitions']
+    if cles is not None:
+        partitions = {cle: info for cle, info in partitions.items() if cle in cles}
+
+    morceaux = [pd.read_parquet(os.path.join(dossier, info['fichier'])) for info in partitions.values()]
+    if morceaux:
+        df_faits = pd.concat(morceaux).set_index('id').sort_index()
+    else:
+        df_faits = pd.DataFrame(columns=['id'] + COLONNES_FAITS).set_index('id')
+    df_faits.index.name = None
+    return typer_sites(df_sites), typer_faits(df_faits)
+
+def charger_base_parquet(dossier, periodes=None):
+    """Charge (sites, faits) en ne lisant que les partitions des périodes demandées,
+    puis rejoue le journal des changements non encore compactés"""
+    cles = None if periodes is None else {_cle_partition(p) for p in periodes}
+    df_sites, df_faits = _lire_snapshot_parquet(dossier, cles)
+
+    df_sites, df_faits = rejouer_journal(dossier, df_sites, df_faits)[:2]
+    if cles is not None:
+        df_faits = df_faits[df_faits['DATE'].map(_cle_partition).isin(cles)]
+    return df_sites, df_faits
+
+def periodes_parquet(dossier):
+    """Liste des périodes disponibles, lue dans le manifeste et le journal sans ouvrir les partitions"""
+    manifeste = lire_manifeste(dossier) or {'partitions': {}}
+    periodes = set(manifeste['partitions'])
+    for enregistrement in lire_journal(dossier):
+        colonne = enregistrement['faits']['columns'].index('DATE')
+        periodes |= {_cle_partition(normaliser_periode(ligne[colonne])) for ligne in enregistrement['faits']['data']}
+    return sorted(int(p) for p in periodes - {PARTITION_SANS_DATE})
+
+def migrer_vers_parquet(dossier, chemin_db, fichier_sauvegarde, fichier_excel):
+    """Migration unique vers le snapshot Parquet. False si aucune source."""
+    if lire_manifeste(dossier) is not None:
+        return True
+    if os.path.exists(chemin_db):
+        base = charger_base_sqlite(chemin_db)
+    else:
+        base = charger_base(fichier_sauvegarde, fichier_excel)
+        if base is None:
+            return False
+        base[1].index = pd.RangeIndex(1, len(base[1]) + 1)
+    sauvegarder_base_parquet(dossier, *base)
+    return True
+
+
+# === JOURNAL DES CHANGEMENTS (snapshot Parquet) ===
+# Chaque sauvegarde ajoute un enregistrement JSON au journal : coût O(changement), et une
+# écriture interrompue ne laisse au pire qu'une dernière ligne incomplète, ignorée au rejeu.
+# Ajouts et compactage se font sous un verrou fichier (l'application et la ligne de commande
+# peuvent écrire en même temps) ; le nombre d'enregistrements est tenu dans le manifeste.
+SEUIL_COMPACTAGE = 20 * 1024 * 1024  # octets
+
+def chemin_journal(dossier):
+    return os.path.join(dossier, 'journal.jsonl')
+
+def _chemin_verrou(dossier):
+    return os.path.join(dossier, '.verrou')
+
+def _vers_json(df, nom_index):
+    return json.loads(df.reset_index(names=nom_index).to_json(orient='split', index=False))
+
+def _depuis_json(data, nom_index):
+    df = pd.DataFrame(data['data'], columns=data['columns'])
+    return df.set_index(nom_index)
+
+def _fusionner(df, maj):
+    """Met à jour les lignes existantes de df et ajoute les nouvelles (ordre conservé)"""
+    if maj.empty:
+        return df
+    existantes = maj.index.intersection(df.index)
+    if len(existantes):
+        # Copie seulement si des lignes existantes changent : df peut être une version publiée
+        colonnes = [col for col in maj.columns if col in df.columns]
+        df = sans_categories(df).copy()
+        df.loc[existantes, colonnes] = maj.loc[existantes, colonnes]
+    nouvelles = maj.loc[~maj.index.isin(df.index)].reindex(columns=df.columns)
+    return pd.concat([df, nouvelles]) if len(nouvelles) else df
+
+def _reparer_journal(chemin):
+    """Supprime une dernière ligne incomplète (écriture interrompue) avant un nouvel ajout"""
+    if not os.path.exists(chemin) or os.path.getsize(chemin) == 0:
+        return
+    with open(chemin, 'rb+') as f:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) == b'\n':
+            return
+        f.seek(0)
+        contenu = f.read()
+        f.truncate(contenu.rfind(b'\n') + 1)
+
+def journaliser_changements(dossier, ecritures):
+    """Ajoute le jeu de changements au journal (append + fsync). Retourne la taille du journal."""
+    enregistrement = {
+        'horodatage': datetime.now().isoformat(timespec='seconds'),
+        'sites': _vers_json(ecritures['sites'], 'IDENTIFIANT'),
+        'faits': _vers_json(ecritures['faits'][COLONNES_FAITS], 'id'),
+        'supprimes': [int(i) for i in ecritures['supprimes']],
+    }
+    chemin = chemin_journal(dossier)
+    with verrou_fichier(_chemin_verrou(dossier)):
+        nb = nb_changements_journal(dossier)
+        _reparer_journal(chemin)
+        with open(chemin, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(enregistrement, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+            taille = f.tell()
+        manifeste = lire_manifeste(dossier)
+        manifeste['journal'] = nb + 1
+        _ecrire_manifeste(dossier, manifeste)
+    return taille
+
+def nb_changements_journal(dossier):
+    """Nombre d'enregistrements du journal, lu dans le manifeste (sans parcourir le journal)"""
+    if not os.path.exists(chemin_journal(dossier)):
+        return 0
+    manifeste = lire_manifeste(dossier) or {}
+    if 'journal' not in manifeste:
+        # Manifeste antérieur au compteur
+        return len(lire_journal(dossier))
+    return manifeste['journal']
+
+def lire_journal(dossier):
+    """Enregistrements valides du journal (une dernière ligne tronquée est ignorée)"""
+    chemin = chemin_journal(dossier)
+    if not os.path.exists(chemin):
+        return []
+    enregistrements = []
+    with open(chemin, 'r', encoding='utf-8') as f:
+        for ligne in f:
+            try:
+                enregistrements.append(json.loads(ligne))
+            except json.JSONDecodeError:
+                break
+    return enregistrements
+
+def rejouer_journal(dossier, df_sites, df_faits):
+    """Applique le journal à un snapshot. Retourne (sites, faits, périodes touchées, sites touchés)."""
+    periodes = set()
+    sites_touches = False
+    for enregistrement in lire_journal(dossier):
+        sites = _depuis_json(enregistrement['sites'], 'IDENTIFIANT')
+        faits = typer_faits(_depuis_json(enregistrement['faits'], 'id'))
+        faits.index.name = None
+        supprimes = pd.Index(enregistrement['supprimes'])
+
+        periodes |= set(df_faits.loc[df_faits.index.intersection(faits.index.append(supprimes)), 'DATE'])
+        periodes |= set(faits['DATE'])
+        sites_touches = sites_touches or len(sites) > 0
+
+        df_sites = _fusionner(df_sites, sites)
+        df_faits = _fusionner(df_faits.drop(df_faits.index.intersection(supprimes)), faits).sort_index()
+    return typer_sites(df_sites), typer_faits(df_faits), periodes, sites_touches
+
+def compacter_journal(dossier):
+    """Intègre le journal au snapshot (partitions touchées uniquement) puis le vide, sans
+    ajout concurrent entre le rejeu et la suppression du journal"""
+    with verrou_fichier(_chemin_verrou(dossier)):
+        nb = len(lire_journal(dossier))
+        if nb == 0:
+            return 0
+        df_sites, df_faits = _lire_snapshot_parquet(dossier)
+        df_sites, df_faits, periodes, sites_touches = rejouer_journal(dossier, df_sites, df_faits)
+        sauvegarder_base_parquet(dossier, df_sites, df_faits, periodes=periodes, sites=sites_touches)
+
+        # Le rejeu est idempotent : un arrêt avant cette ligne ne fait que rejouer le journal au prochain chargement
+        os.remove(chemin_journal(dossier))
+    return nb
+
+def enregistrer_changements_parquet(dossier, ecritures, seuil=SEUIL_COMPACTAGE):
+    """Journalise les changements et compacte quand le journal dépasse le seuil"""
+    if journaliser_changements(dossier, ecritures) > seuil:
+        compacter_journal(dossier)
+
+
+# === ACCÈS AU STOCKAGE CONFIGURÉ ===
+# stockage = {'format': 'sqlite' | 'parquet', 'chemin': base SQLite ou dossier du snapshot}
+def charger_stockage(stockage):
+    """Charge (sites, faits) depuis le stockage configuré"""
+    if stockage['format'] == 'parquet':
+        return charger_base_parquet(stockage['chemin'])
+    return charger_base_sqlite(stockage['chemin'])
+
+def periodes_stockage(stockage):
+    """Périodes disponibles, lues dans l'index SQLite ou le manifeste Parquet sans charger les faits"""
+    if stockage['format'] == 'parquet':
+        return periodes_parquet(stockage['chemin'])
+    return periodes_sqlite(stockage['chemin'])
+
+def charger_periodes(stockage, periodes, colonnes=None):
+    """Vue à plat (faits + attributs du site) des seules périodes demandées : requête par période
+    en SQLite, partitions de ces périodes en Parquet"""
+    colonnes = colonnes or COLONNES_CENTRALE
+    if stockage['format'] == 'parquet':
+        df_sites, df_faits = charger_base_parquet(stockage['chemin'], periodes)
+        return joindre_base(df_sites, df_faits, colonnes)
+    vues = [requeter_periode_sqlite(stockage['chemin'], periode, colonnes) for periode in periodes]
+    return pd.concat(vues) if vues else pd.DataFrame(columns=colonnes)
+
+def compacter_stockage(stockage):
+    """Compactage à la demande du journal Parquet, sans écriture concurrente de ce processus.
+    Le contenu ne change pas : la version publiée reste valable et n'est pas rechargée."""
+    with _verrou_ecriture(stockage):
+        base = _BASES_PARTAGEES.get(_cle_stockage(stockage))
+        a_jour = base is not None and base['marque'] == _marque_stockage(stockage)
+        nb = compacter_journal(stockage['chemin'])
+        if a_jour:
+            _BASES_PARTAGEES[_cle_stockage(stockage)] = dict(base, marque=_marque_stockage(stockage))
+    return nb
+
+def enregistrer_stockage(stockage, ecritures):
+    """Persiste un jeu de changements dans le stockage configuré"""
+    if stockage['format'] == 'parquet':
+        # Ajout au journal, compacté dans le snapshot au-delà d'un seuil
+        enregistrer_changements_parquet(stockage['chemin'], ecritures)
+    else:
+        enregistrer_changements_sqlite(
+            stockage['chemin'], ecritures['sites'], ecritures['faits'], ecritures['supprimes']
+        )
+
+
+# === CUBE D'AGRÉGATS (Statistiques) ===
+DIMENSIONS_CUBE = ['DATE', 'TENSION', 'UC', 'SITES']
+
+def _agreger_cube(df_vue):
+    """Somme et nombre de MONTANT / CONSO par DATE x TENSION x UC x SITES"""
+    return df_vue.groupby(DIMENSIONS_CUBE, dropna=False, sort=False, observed=True).agg(
+        MONTANT=('MONTANT', 'sum'),
+        NB_MONTANT=('MONTANT', 'count'),
+        CONSO=('CONSO', 'sum'),
+        NB_CONSO=('CONSO', 'count'),
+        NB_LIGNES=('MONTANT', 'size')
+    ).reset_index()
+
+def construire_cube(df_sites, df_faits):
+    """Matérialise le cube d'agrégats à partir de toute la base"""
+    return _agreger_cube(joindre_base(df_sites, df_faits, DIMENSIONS_CUBE + ['MONTANT', 'CONSO']))
+
+def mettre_a_jour_cube(cube, df_sites, faits_nouveaux):
+    """Ajoute au cube la contribution de nouveaux faits (import) sans tout recalculer"""
+    delta = construire_cube(df_sites, faits_nouveaux)
+    cumul = pd.concat([cube, delta], ignore_index=True)
+    return cumul.groupby(DIMENSIONS_CUBE, dropna=False, sort=False, observed=True).sum().reset_index()
+
+def interroger_cube(cube, filtres=None):
+    """Totaux par DATE pour une combinaison de filtres {dimension: valeur}"""
+    selection = cube
+    for dimension, valeur in (filtres or {}).items():
+        selection = selection[selection[dimension] == valeur]
+
+    df_grouped = selection.groupby('DATE').agg({
+        'MONTANT': 'sum',
+        'CONSO': 'sum',
+        'NB_LIGNES': 'sum'
+    }).reset_index()
+
+    dates = df_grouped['DATE']
+    df_grouped['DATE_DISPLAY'] = (
+        (dates % 100).astype('string').str.zfill(2) + '/' + (dates // 100).astype('string')
+    ).fillna('')
+    return df_grouped.sort_values('DATE')
+
+
+# === INDEX PAR PÉRIODE ET VALEURS DES FILTRES ===
+# Construit avec chaque version publiée : positions des faits de chaque période (périodes
+# triées) et valeurs distinctes des listes déroulantes. Extraire une période ou remplir un
+# filtre ne parcourt plus toute la base.
+DIMENSIONS_FILTRES = ['UC', 'SITES', 'TENSION']
+
+def _valeurs_sites(df_sites):
+    return {
+        col: sorted(df_sites[col].dropna().unique().tolist(), key=str) if col in df_sites.columns else []
+        for col in DIMENSIONS_FILTRES
+    }
+
+def construire_index(df_sites, df_faits):
+    """{'lignes', 'periodes': {période: positions des faits}, 'valeurs': {colonne: valeurs triées}}"""
+    periodes = {int(p): positions for p, positions in df_faits.groupby('DATE', sort=True).indices.items()}
+    return {
+        'lignes': len(df_faits),
+        'periodes': periodes,
+        'valeurs': dict(_valeurs_sites(df_sites), DATE=list(periodes)),
+    }
+
+def mettre_a_jour_index(index, df_sites, df_faits, ecritures):
+    """Index de la version suivante, sans modifier celui de la version publiée : les faits ajoutés
+    en fin de table sont rattachés à leur période ; reconstruit si des faits existants ont bougé"""
+    faits = ecritures['faits']
+    positions = df_faits.index.searchsorted(faits.index)
+    ajout_en_fin = (
+        len(ecritures['supprimes']) == 0 and len(df_faits) == index['lignes'] + len(faits)
+        and (len(faits) == 0 or positions.min() >= index['lignes'])
+    )
+    if not ajout_en_fin:
+        return construire_index(df_sites, df_faits)
+
+    periodes = dict(index['periodes'])
+    for periode, relatives in faits.groupby('DATE', sort=False).indices.items():
+        nouvelles = np.sort(positions[relatives])
+        periode = int(periode)
+        periodes[periode] = np.concatenate([periodes[periode], nouvelles]) if periode in periodes else nouvelles
+    periodes = dict(sorted(periodes.items()))
+
+    valeurs = _valeurs_sites(df_sites) if len(ecritures['sites']) else index['valeurs']
+    return {
+        'lignes': len(df_faits),
+        'periodes': periodes,
+        'valeurs': dict(valeurs, DATE=list(periodes)),
+    }
+
+def faits_periodes(df_faits, index, periodes):
+    """Faits des périodes demandées, lus par leurs positions (triés par période)"""
+    positions = [index['periodes'][p] for p in periodes if p in index['periodes']]
+    if not positions:
+        return df_faits.iloc[:0]
+    return df_faits.iloc[np.concatenate(positions)]
+
+
+# === BASE PARTAGÉE PAR LES SESSIONS (copie sur écriture) ===
+# Une seule copie de la base par processus serveur. Une version publiée n'est jamais modifiée :
+# les sessions en gardent une référence et le numéro, et chaque écriture publie une nouvelle
+# version construite à partir de la dernière. Une écriture faite par un autre processus
+# (détectée par le compteur d'écritures SQLite ou les fichiers Parquet) provoque un rechargement.
+_BASES_PARTAGEES = {}
+_PRECHARGEMENTS = {}
+_VERROUS_ECRITURE = {}
+_VERROU_BASES_PARTAGEES = threading.Lock()
+
+def _cle_stockage(stockage):
+    return stockage['format'], os.path.abspath(stockage['chemin'])
+
+def _verrou_ecriture(stockage):
+    with _VERROU_BASES_PARTAGEES:
+        return _VERROUS_ECRITURE.setdefault(_cle_stockage(stockage), threading.RLock())
+
+def _marque_stockage(stockage):
+    """Marque changeant à chaque écriture dans le stockage, et seulement à ce moment : compteur
+    d'écritures SQLite (les connexions de lecture créent et modifient le fichier -wal), ou
+    (mtime, taille) du manifeste et du journal Parquet"""
+    chemin = stockage['chemin']
+    if stockage['format'] != 'parquet':
+        return version_sqlite(chemin)
+    if not os.path.exists(_chemin_manifeste(chemin)):
+        return None
+    marque = []
+    for fichier in [_chemin_manifeste(chemin), chemin_journal(chemin)]:
+        try:
+            stat = os.stat(fichier)
+            marque.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            marque.append(None)
+    return tuple(marque)
+
+def _publier(stockage, df_sites, df_faits, cube, index, marque=None):
+    cle = _cle_stockage(stockage)
+    precedente = _BASES_PARTAGEES.get(cle)
+    base = {
+        'version': precedente['version'] + 1 if precedente else 1,
+        'sites': df_sites,
+        'faits': df_faits,
+        'cube': cube,
+        'index': index,
+        'marque': _marque_stockage(stockage) if marque is None else marque,
+    }
+    _BASES_PARTAGEES[cle] = base
+    return base
+
+def base_partagee(stockage, charger=None):
+    """Dernière version publiée {'version', 'sites', 'faits', 'cube', 'index'}, chargée au premier appel
+    (par `charger()` si fourni, sinon depuis le stockage) ou si le stockage a changé ailleurs"""
+    base = _BASES_PARTAGEES.get(_cle_stockage(stockage))
+    if base is not None and base['marque'] == _marque_stockage(stockage):
+        return base
+    with _verrou_ecriture(stockage):
+        base = _BASES_PARTAGEES.get(_cle_stockage(stockage))
+        marque = _marque_stockage(stockage)
+        if base is None or base['marque'] != marque:
+            with mesure('chargement base centrale'):
+                df_sites, df_faits = charger() if charger else charger_stockage(stockage)
+            with mesure('cube et index'):
+                cube, index = construire_cube(df_sites, df_faits), construire_index(df_sites, df_faits)
+            # Marque lue avant le chargement : une écriture concurrente sera rechargée au prochain appel
+            # (stockage encore absent : relue après la migration faite par `charger`)
+            base = _publier(stockage, df_sites, df_faits, cube, index, marque=marque)
+    return base
+
+def prechauffer_base(stockage, charger=None):
+    """Charge la base partagée dans un thread, une seule fois par stockage (démarrage du serveur) ;
+    retourne un Future résolu par la base publiée. Un échec est oublié pour être retenté."""
+    cle = _cle_stockage(stockage)
+    with _VERROU_BASES_PARTAGEES:
+        future = _PRECHARGEMENTS.get(cle)
+        if future is not None:
+            return future
+        future = _PRECHARGEMENTS[cle] = Future()
+
+    def charger_en_fond():
+        try:
+            future.set_result(base_partagee(stockage, charger))
+        except BaseException as erreur:
+            with _VERROU_BASES_PARTAGEES:
+                _PRECHARGEMENTS.pop(cle, None)
+            future.set_exception(erreur)
+
+    threading.Thread(target=charger_en_fond, name='prechargement-base', daemon=True).start()
+    return future
+
+def base_disponible(stockage):
+    """Dernière version de la base si elle est déjà chargée, None pendant le premier chargement"""
+    if _cle_stockage(stockage) not in _BASES_PARTAGEES:
+        return None
+    return base_partagee(stockage)
+
+def appliquer_ecritures(df_sites, df_faits, ecritures):
+    """Nouvel état (sites, faits) après un jeu de changements, sans modifier les DataFrames reçus"""
+    df_sites = _fusionner(df_sites, ecritures['sites'])
+    supprimes = df_faits.index.intersection(ecritures['supprimes'])
+    if len(supprimes):
+        df_faits = df_faits.drop(supprimes)
+    df_faits = _fusionner(df_faits, ecritures['faits'][COLONNES_FAITS])
+    if not df_faits.index.is_monotonic_increasing:
+        df_faits = df_faits.sort_index()
+    return typer_sites(df_sites), df_faits
+
+def publier_ecritures(stockage, ecritures):
+    """Persiste un jeu de changements et publie la version suivante de la base partagée.
+    Les changements sont appliqués à la dernière version publiée, sous le verrou d'écriture :
+    deux sessions qui écrivent en même temps ne s'écrasent pas."""
+    with _verrou_ecriture(stockage), mesure('enregistrement base centrale'):
+        base = base_partagee(stockage)
+        enregistrer_stockage(stockage, ecritures)
+        df_sites, df_faits = appliquer_ecritures(base['sites'], base['faits'], ecritures)
+
+        # Cube des Statistiques : mis à jour par ajout pour un import, recalculé sinon
+        ajout_seul = (
+            len(ecritures['sites']) == 0 and len(ecritures['supprimes']) == 0
+            and not ecritures['faits'].index.isin(base['faits'].index).any()
+        )
+        if ajout_seul:
+            cube = mettre_a_jour_cube(base['cube'], df_sites, ecritures['faits'])
+        else:
+            cube = construire_cube(df_sites, df_faits)
+        index = mettre_a_jour_index(base['index'], df_sites, df_faits, ecritures)
+        return _publier(stockage, df_sites, df_faits, cube, index)
+
+def modifier_base(stockage, calculer):
+    """Calcule un jeu de changements sur la dernière version (`calculer(sites, faits)` retourne
+    (écritures, résultat)) puis le publie s'il n'est pas vide, sans écriture concurrente entre les
+    deux. Retourne (base, écritures, résultat)."""
+    with _verrou_ecriture(stockage):
+        base = base_partagee(stockage)
+        ecritures, resultat = calculer(base['sites'], base['faits'])
+        if len(ecritures['sites']) or len(ecritures['faits']) or len(ecritures['supprimes']):
+            base = publier_ecritures(stockage, ecritures)
+    return base, ecritures, resultat
+
+
+# === LECTURE DES FICHIERS DE FACTURES CIE ===
+def _colonnes_utiles(type_tension):
+    config = CONFIG_FACTURES[type_tension]
+    return [config['cle'], config['montant'], config['conso'], config['caract']]
+
+def convertir_nombres(serie, decimal=None):
+    """Nombres en float64 : les cellules numériques sont gardées, les textes ('1 500,5', '1.500,5',
+    espaces insécables) lus avec le séparateur `decimal` (sans `decimal` : le dernier de ',' ou
+    '.' dans chaque texte). Retourne (nombres, textes illisibles)."""
+    if pd.api.types.is_numeric_dtype(serie) and not pd.api.types.is_bool_dtype(serie):
+        return serie.astype('float64'), serie.iloc[:0].astype(str)
+    if pd.api.types.is_string_dtype(serie):
+        est_texte = serie.notna()
+    else:
+        est_texte = serie.map(lambda v: isinstance(v, str), na_action='ignore').fillna(False).astype(bool)
+    nombres = pd.to_numeric(serie.where(~est_texte), errors='coerce').astype('float64')
+
+    textes = serie[est_texte].astype('string').str.replace('[\\s\u00a0\u202f]', '', regex=True)
+    if decimal is None:
+        virgule = (textes.str.rfind(',') > textes.str.rfind('.')).fillna(False)
+    else:
+        virgule = pd.Series(decimal == ',', index=textes.index)
+    textes = textes.where(
+        virgule, textes.str.replace(',', '', regex=False)
+    ).where(
+        ~virgule, textes.str.replace('.', '', regex=False).str.replace(',', '.', regex=False)
+    )
+    convertis = pd.to_numeric(textes.replace('', pd.NA), errors='coerce').astype('float64')
+    nombres[est_texte] = convertis
+    illisibles = serie[est_texte][convertis.isna().values & (textes != '').fillna(False).values]
+    return nombres, illisibles.astype(str)
+
+def _typer_factures(df, type_tension, colonnes_source, decimal=None):
+    """Types explicites : montant et conso en float64, période en entier AAAAMM. Les montants
+    illisibles sont comptés dans df.attrs['montants_illisibles'] (exemples dans 'exemples_illisibles')."""
+    config = CONFIG_FACTURES[type_tension]
+    df.attrs['montants_illisibles'], df.attrs['exemples_illisibles'] = 0, []
+    for col in (config['montant'], config['conso']):
+        if col in df.columns:
+            df[col], illisibles = convertir_nombres(df[col], decimal)
+            if col == config['montant']:
+                df.attrs['montants_illisibles'] = len(illisibles)
+                df.attrs['exemples_illisibles'] = illisibles.unique()[:5].tolist()
+    if config['caract'] in df.columns:
+        df[config['caract']] = typer_periodes(df[config['caract']])
+    df.attrs['colonnes_source'] = [str(c) for c in colonnes_source]
+    return df
+
+_NS_XLSX = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+_NS_REL = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+
+def _chemin_premiere_feuille(archive):
+    """Chemin XML de la première feuille du classeur (via workbook.xml et ses relations)"""
+    from xml.etree.ElementTree import fromstring
+
+    classeur = fromstring(archive.read('xl/workbook.xml'))
+    feuille = classeur.find(f'{_NS_XLSX}sheets/{_NS_XLSX}sheet')
+    rid = feuille.get(f'{_NS_REL}id')
+    relations = fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+    for relation in relations:
+        if relation.get('Id') == rid:
+            cible = relation.get('Target')
+            return cible.lstrip('/') if cible.startswith('/') else 'xl/' + cible
+    return 'xl/worksheets/sheet1.xml'
+
+# Formats de nombre intégrés d'Excel qui affichent une date ou une heure
+FORMATS_DATE_EXCEL = set(range(14, 23)) | set(range(27, 37)) | {45, 46, 47} | set(range(50, 59))
+
+def _est_format_date(code):
+    """Un format personnalisé affiche une date s'il contient d, m, y, h ou s hors texte littéral,
+    caractères échappés et sections entre crochets (couleur, paramètres régionaux)"""
+    code = re.sub(r'"[^"]*"|\\.|\[[^\]]*\]', '', code)
+    return re.search(r'[dmyhs]', code.lower()) is not None
+
+def _formats_xlsx(archive):
+    """(styles de cellule affichant une date, origine des numéros de série : 1900 ou 1904)"""
+    from xml.etree.ElementTree import fromstring
+
+    classeur = fromstring(archive.read('xl/workbook.xml'))
+    proprietes = classeur.find(f'{_NS_XLSX}workbookPr')
+    date1904 = proprietes is not None and proprietes.get('date1904', '').lower() in ('1', 'true')
+    origine = datetime(1904, 1, 1) if date1904 else datetime(1899, 12, 30)
+
+    styles_dates = set()
+    if 'xl/styles.xml' in archive.namelist():
+        styles = fromstring(archive.read('xl/styles.xml'))
+        formats = {int(f.get('numFmtId')): f.get('formatCode', '') for f in styles.iter(f'{_NS_XLSX}numFmt')}
+        styles_cellules = styles.find(f'{_NS_XLSX}cellXfs')
+        for position, style in enumerate(styles_cellules if styles_cellules is not None else []):
+            id_format = int(style.get('numFmtId', 0))
+            if id_format in FORMATS_DATE_EXCEL or (id_format in formats and _est_format_date(formats[id_format])):
+                styles_dates.add(position)
+    return styles_dates, origine
+
+def _valeur_cellule(cellule, partagees, styles_dates=frozenset(), origine=None):
+    type_cellule = cellule.get('t')
+    # Texte vide -> None, comme les cellules vides lues par pandas
+    if type_cellule == 'inlineStr':
+        return ''.join(t.text or '' for t in cellule.iter(f'{_NS_XLSX}t')) or None
+    v = cellule.find(f'{_NS_XLSX}v')
+    if v is None or v.text is None:
+        return None
+    if type_cellule == 's':
+        return partagees[int(v.text)] or None
+    if type_cellule in ('str', 'e'):
+        return v.text or None
+    if type_cellule == 'b':
+        return v.text == '1'
+    # Dates : texte ISO (t="d") ou numéro de série sous un format de date, comme openpyxl
+    if type_cellule == 'd':
+        return datetime.fromisoformat(v.text)
+    if origine is not None and int(cellule.get('s', 0)) in styles_dates:
+        return origine + timedelta(days=float(v.text))
+    # Entier si pas de partie décimale, comme openpyxl
+    return float(v.text) if any(c in v.text for c in '.Ee') else int(v.text)
+
+def _lettre_colonne(position):
+    """1 -> A, 27 -> AA (sans importer openpyxl, réservé aux exports)"""
+    lettres = ''
+    while position:
+        position, reste = divmod(position - 1, 26)
+        lettres = chr(65 + reste) + lettres
+    return lettres
+
+def _lettres_colonnes(ligne):
+    """Lettre de colonne de chaque cellule d'une ligne (position si l'attribut r est absent)"""
+    for position, cellule in enumerate(ligne, start=1):
+        ref = cellule.get('r')
+        yield (ref.rstrip('0123456789') if ref else _lettre_colonne(position)), cellule
+
+def _lire_xlsx_flux(fichier, utiles):
+    """Parcours en flux du XML de la première feuille : seules les cellules des colonnes
+    utiles sont décodées (l'en-tête est la première ligne)"""
+    from xml.etree.ElementTree import iterparse
+
+    with zipfile.ZipFile(fichier) as archive:
+        partagees = []
+        if 'xl/sharedStrings.xml' in archive.namelist():
+            with archive.open('xl/sharedStrings.xml') as f:
+                for _, element in iterparse(f):
+                    if element.tag == f'{_NS_XLSX}si':
+                        partagees.append(''.join(t.text or '' for t in element.iter(f'{_NS_XLSX}t')))
+                        element.clear()
+        styles_dates, origine = _formats_xlsx(archive)
+
+        entete, lettres, valeurs = None, {}, {}
+        with archive.open(_chemin_premiere_feuille(archive)) as f:
+            for _, element in iterparse(f):
+                if element.tag != f'{_NS_XLSX}row':
+                    continue
+                if entete is None:
+                    cellules = {lettre: _valeur_cellule(c, partagees) for lettre, c in _lettres_colonnes(element)}
+                    entete = [v for v in cellules.values() if v is not None]
+                    lettres = {lettre: nom for lettre, nom in cellules.items() if nom in utiles}
+                    valeurs = {nom: [] for nom in lettres.values()}
+                else:
+                    ligne = {}
+                    for lettre, cellule in _lettres_colonnes(element):
+                        if lettre in lettres:
+                            ligne[lettre] = _valeur_cellule(cellule, partagees, styles_dates, origine)
+                    if any(v is not None for v in ligne.values()):
+                        for lettre, nom in lettres.items():
+                            valeurs[nom].append(ligne.get(lettre))
+                element.clear()
+    return pd.DataFrame(valeurs), entete or []
+
+def _rembobiner(fichier):
+    if hasattr(fichier, 'seek'):
+        fichier.seek(0)
+
+def _separateur_csv(fichier):
+    """Séparateur le plus fréquent de la ligne d'en-tête (; , ou tabulation)"""
+    if hasattr(fichier, 'read'):
+        debut = fichier.read(4096)
+        _rembobiner(fichier)
+    else:
+        with open(fichier, 'rb') as f:
+            debut = f.read(4096)
+    if isinstance(debut, bytes):
+        debut = debut.decode('utf-8', errors='ignore')
+    premiere = debut.splitlines()[0] if debut else ''
+    return max([';', ',', '\t'], key=premiere.count)
+
+def _lire_csv(fichier, **options):
+    """pd.read_csv en UTF-8 (BOM éventuel ignoré), sinon en cp1252 : encodage des exports
+    « CSV (séparateur : point-virgule) » d'Excel sous Windows"""
+    for encodage in ('utf-8-sig', 'cp1252'):
+        _rembobiner(fichier)
+        try:
+            return pd.read_csv(fichier, encoding=encodage, **options)
+        except UnicodeDecodeError:
+            if encodage == 'cp1252':
+                raise
+
+def lire_factures(fichier, type_tension, nom=None):
+    """Lit un fichier de factures CIE (xlsx, xls ou csv) en ne chargeant que les colonnes
+    utilisées par l'import. `fichier` est un chemin ou un fichier téléversé.
+    La liste complète des colonnes du fichier est dans df.attrs['colonnes_source']."""
+    nom = nom or getattr(fichier, 'name', None) or str(fichier)
+    extension = os.path.splitext(nom)[1].lower()
+    utiles = _colonnes_utiles(type_tension)
+    config = CONFIG_FACTURES[type_tension]
+
+    if extension == '.csv':
+        sep = _separateur_csv(fichier)
+        decimal = ',' if sep == ';' else '.'
+        entete = _lire_csv(fichier, sep=sep, nrows=0).columns.tolist()
+        # Montants lus en texte : un seul séparateur de milliers ('1 500,5') ferait sinon
+        # basculer toute la colonne en texte, puis en NaN
+        df = _lire_csv(
+            fichier, sep=sep, usecols=[c for c in utiles if c in entete],
+            dtype={config['cle']: str, config['caract']: str, config['montant']: str, config['conso']: str}
+        )
+        return _typer_factures(df, type_tension, entete, decimal=decimal)
+
+    moteur = None
+    if extension != '.xls':
+        try:
+            # Lecteur python-calamine si installé : nettement plus rapide sur les gros fichiers
+            import python_calamine  # noqa: F401
+            moteur = 'calamine'
+        except ImportError:
+            df, entete = _lire_xlsx_flux(fichier, utiles)
+            return _typer_factures(df, type_tension, entete)
+
+    entete = pd.read_excel(fichier, engine=moteur, nrows=0).columns.tolist()
+    _rembobiner(fichier)
+    df = pd.read_excel(fichier, engine=moteur, usecols=lambda c: c in utiles)
+    return _typer_factures(df, type_tension, entete)
+
+
+# === CLÉS CANONIQUES DES IDENTIFIANTS ===
+# Excel rend les numéros de contrat en float (12345.0), sans leurs zéros de tête ou avec des
+# espaces. Une clé est d'abord cherchée telle quelle parmi les IDENTIFIANT, puis sous forme
+# canonique (sans espaces, en majuscules, numérique sans partie décimale nulle ni zéros de tête)
+# parmi les IDENTIFIANT puis les REFERENCE. Une forme canonique partagée par plusieurs sites
+# (0123 et 123) est ambiguë : elle ne rapproche rien et est signalée.
+MOTIF_CLE_NUMERIQUE = r'^(\d+)(?:\.0*)?$'
+_CLES_SITES = {}
+
+def cle_canonique(serie):
+    """Forme canonique de chaque clé d'une Series (texte, <NA> si vide), en une passe vectorisée"""
+    texte = serie.astype('string').str.replace(r'\s+', '', regex=True).str.upper()
+    numerique = texte.str.extract(MOTIF_CLE_NUMERIQUE, expand=False).str.lstrip('0').replace('', '0')
+    return numerique.fillna(texte).replace('', pd.NA)
+
+def _index_canonique(colonnes, identifiants):
+    """Clé canonique -> identifiant, depuis des colonnes de clés alignées sur `identifiants`
+    (par priorité décroissante). Retourne (clés non ambiguës -> identifiant,
+    clés ambiguës -> liste des identifiants)"""
+    identifiants = np.asarray(identifiants, dtype=object)
+    paires = pd.concat([
+        pd.DataFrame({'CLE': cle_canonique(pd.Series(colonne)).values, 'IDENTIFIANT': identifiants, 'RANG': rang})
+        for rang, colonne in enumerate(colonnes)
+    ], ignore_index=True)
+    paires = paires.dropna(subset=['CLE']).drop_duplicates(['CLE', 'IDENTIFIANT'])
+    paires = paires[paires['RANG'] == paires.groupby('CLE')['RANG'].transform('min')]
+    multiples = paires['CLE'].duplicated(keep=False).values
+    uniques = pd.Series(paires['IDENTIFIANT'].values[~multiples], index=pd.Index(paires['CLE'].values[~multiples], name='CLE'))
+    ambigues = paires[multiples].groupby('CLE', sort=False)['IDENTIFIANT'].agg(list)
+    return uniques, ambigues
+
+def index_cles_sites(df_sites):
+    """{'cles': clé canonique -> IDENTIFIANT, 'ambigues': clé canonique -> IDENTIFIANT possibles},
+    sur IDENTIFIANT puis REFERENCE. Calculé une fois par DataFrame de sites : une version publiée
+    n'est jamais modifiée."""
+    memo = _CLES_SITES.get(id(df_sites))
+    if memo is not None and memo[0]() is df_sites:
+        return memo[1]
+
+    identifiants = df_sites.index.astype(str)
+    colonnes = [identifiants] + ([df_sites['REFERENCE'].values] if 'REFERENCE' in df_sites.columns else [])
+    cles, ambigues = _index_canonique(colonnes, identifiants)
+    index = {'cles': cles, 'ambigues': ambigues}
+
+    cle = id(df_sites)
+    _CLES_SITES[cle] = (weakref.ref(df_sites, lambda _: _CLES_SITES.pop(cle, None)), index)
+    return index
+
+def _positions_cles(cles, identifiants, index_canonique):
+    """Position de chaque clé dans `identifiants` : clé exacte, sinon forme canonique non ambiguë
+    (`index_canonique` : clé canonique -> identifiant) ; -1 si aucune"""
+    texte = cles.astype('string')
+    positions = identifiants.get_indexer(texte.fillna('').values)
+    restantes = positions < 0
+    if restantes.any():
+        canoniques = index_canonique.index.get_indexer(cle_canonique(texte[restantes]).values)
+        trouvees = canoniques >= 0
+        cibles = np.full(len(canoniques), -1)
+        cibles[trouvees] = identifiants.get_indexer(index_canonique.values[canoniques[trouvees]])
+        positions[restantes] = cibles
+    return positions
+
+def rapprocher_cles(serie, df_sites):
+    """IDENTIFIANT du site de chaque clé (<NA> si aucun site ou plusieurs ne correspondent)"""
+    positions = _positions_cles(serie, df_sites.index, index_cles_sites(df_sites)['cles'])
+    identifiants = pd.Series(np.asarray(df_sites.index, dtype=object)[positions], index=serie.index, dtype=object)
+    return identifiants.where(positions >= 0)
+
+def rapport_non_rapproches(df_factures, df_sites, type_tension, nb_candidats=3, limite=200):
+    """Clés de factures sans site : lignes, montant et identifiants candidats (au plus `limite`
+    clés, par montant décroissant). MOTIF vaut 'inconnue' (candidats : identifiants les plus
+    proches) ou 'ambiguë' (candidats : les sites partageant la forme canonique)."""
+    config = CONFIG_FACTURES[type_tension]
+    cles = cle_canonique(df_factures[config['cle']])
+    non_rapproches = df_factures[rapprocher_cles(df_factures[config['cle']], df_sites).isna().values]
+    colonnes = ['CLE', 'CLE_NORMALISEE', 'MOTIF', 'LIGNES', 'MONTANT', 'CANDIDATS']
+    if non_rapproches.empty:
+        return pd.DataFrame(columns=colonnes)
+
+    rapport = pd.DataFrame({
+        'CLE': non_rapproches[config['cle']].astype(str).values,
+        'CLE_NORMALISEE': cles[non_rapproches.index].fillna('').values,
+        'MONTANT': pd.to_numeric(non_rapproches[config['montant']], errors='coerce').values,
+    }).groupby('CLE_NORMALISEE', sort=False).agg(
+        CLE=('CLE', 'first'), LIGNES=('CLE', 'size'), MONTANT=('MONTANT', 'sum')
+    ).reset_index().sort_values('MONTANT', ascending=False).head(limite)
+
+    # Candidats : voisines dans l'ordre des clés (même début, y compris sans le dernier caractère)
+    # et des clés inversées (même fin), trouvées par dichotomie puis classées par similarité
+    index = index_cles_sites(df_sites)
+    sites_par_cle = pd.concat([index['cles'].map(lambda identifiant: [identifiant]), index['ambigues']])
+    cles_triees = sorted(sites_par_cle.index)
+    inverses_triees = sorted(cle[::-1] for cle in cles_triees)
+
+    def voisines(triees, cle, largeur=20):
+        position = bisect.bisect_left(triees, cle)
+        return triees[max(position - largeur, 0):position + largeur]
+
+    def candidats(cle):
+        proches = (voisines(cles_triees, cle) + voisines(cles_triees, cle[:-1])
+                   + [c[::-1] for c in voisines(inverses_triees, cle[::-1])])
+        trouves = difflib.get_close_matches(cle, list(dict.fromkeys(proches)), n=nb_candidats, cutoff=0.6)
+        return ', '.join(dict.fromkeys(site for c in trouves for site in sites_par_cle[c]))
+
+    ambigues = rapport['CLE_NORMALISEE'].isin(index['ambigues'].index)
+    rapport['MOTIF'] = np.where(ambigues, 'ambiguë', 'inconnue')
+    rapport['CANDIDATS'] = [
+        ', '.join(index['ambigues'][cle]) if ambigue else candidats(cle)
+        for cle, ambigue in zip(rapport['CLE_NORMALISEE'], ambigues)
+    ]
+    return rapport[colonnes].reset_index(drop=True)
+
+
+# === MOTEUR D'IMPORT ===
+def joindre_factures(df_factures, index_sites, cle_facture, montant_col, conso_col, periode):
+    """Joint toutes les factures à l'index des sites en une passe et retourne les nouveaux faits
+    (indexés comme les factures d'origine). `periode` est une période unique ou une Series
+    (une période par facture). Les clés sont rapprochées par rapprocher_cles (IDENTIFIANT exact,
+    puis forme canonique de l'IDENTIFIANT ou de la REFERENCE)."""
+    identifiants = rapprocher_cles(df_factures[cle_facture], index_sites)
+    trouvees = identifiants.notna().values
+    factures = df_factures[trouvees]
+
+    df_nouveaux = pd.DataFrame({
+        'IDENTIFIANT': identifiants[trouvees].values,
+        'DATE': periode.values[trouvees] if isinstance(periode, pd.Series) else periode,
+        'MONTANT': factures[montant_col].values,
+        'CONSO': factures[conso_col].values if conso_col in factures.columns else None
+    }, index=factures.index)
+    return typer_faits(df_nouveaux)
+
+def empreinte_fichier(fichier):
+    """SHA-256 du contenu d'un fichier (chemin ou fichier téléversé)"""
+    if hasattr(fichier, 'getvalue'):
+        return hashlib.sha256(fichier.getvalue()).hexdigest()
+    h = hashlib.sha256()
+    with open(fichier, 'rb') as f:
+        for bloc in iter(lambda: f.read(1 << 20), b''):
+            h.update(bloc)
+    return h.hexdigest()
+
+def lire_registre_imports(chemin):
+    """Fichiers déjà importés : {empreinte: {tension, periode, nom, lignes, date}}"""
+    if not os.path.exists(chemin):
+        return {}
+    with open(chemin, encoding='utf-8') as f:
+        return json.load(f)
+
+def enregistrer_import(chemin, empreinte, infos):
+    """Ajoute un fichier importé au registre (écriture atomique)"""
+    registre = lire_registre_imports(chemin)
+    registre[empreinte] = dict(infos, date=datetime.now().isoformat(timespec='seconds'))
+
+    def ecrire(tmp):
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(registre, f, ensure_ascii=False, indent=1)
+
+    _ecrire_atomique(chemin, ecrire)
+
+def periodes_factures(df_factures, type_tension):
+    """Période de chaque facture, lue dans la colonne caract"""
+    return typer_periodes(df_factures[CONFIG_FACTURES[type_tension]['caract']])
+
+def importer_factures(df_sites, df_factures, type_tension, periode=None):
+    """Import BT ou HT : retourne les faits à ajouter à la base centrale.
+    Sans `periode`, chaque facture prend la période de sa colonne caract (fichiers multi-mois) ;
+    les factures sans période sont ignorées."""
+    config = CONFIG_FACTURES[type_tension]
+    if periode is None:
+        periode = periodes_factures(df_factures, type_tension)
+        df_factures, periode = df_factures[periode.notna()], periode[periode.notna()]
+    return joindre_factures(
+        df_factures, df_sites,
+        cle_facture=config['cle'],
+        montant_col=config['montant'],
+        conso_col=config['conso'],
+        periode=periode
+    )
+
+
+# === GÉNÉRATION DES FICHIERS COMPTABLES ===
+def remplir_template(df_template, df_periode, type_tension, periode):
+    """Remplit MONTANT et LIBELLE COMPLEMENTAIRE de tout le template en une jointure sur IDENTIFIANT
+    (exact, sinon forme canonique non ambiguë). Retourne (df_export, rapport) ; en cas de doublon
+    dans la période, la première ligne est utilisée."""
+    df_export = df_template.copy()
+    index = df_export.index
+
+    if 'IDENTIFIANT' in df_export.columns:
+        cles_template = df_export['IDENTIFIANT'].astype('string').fillna('')
+    else:
+        cles_template = pd.Series('', index=index, dtype='string')
+
+    cles_periode = df_periode['IDENTIFIANT'].astype(str)
+    doublons_periode = sorted(cles_periode[cles_periode.duplicated()].unique().tolist())
+    premieres = df_periode[~cles_periode.duplicated().values]
+    premieres.index = pd.Index(cles_periode[~cles_periode.duplicated()].values)
+
+    canoniques = _index_canonique([premieres.index], premieres.index)[0]
+    positions = _positions_cles(cles_template, premieres.index, canoniques)
+    trouvees = (positions >= 0) & (cles_template != '').to_numpy(dtype=bool)
+
+    if trouvees.any():
+        lignes = premieres.iloc[positions[trouvees]]
+        montants = pd.Series(lignes['MONTANT'].values, index=index[trouvees])
+        sites = lignes['SITES'].astype(str).values if 'SITES' in lignes.columns else [''] * len(lignes)
+        libelles = f"CIE {type_tension} {periode} " + pd.Series(sites, index=index[trouvees], dtype=object)
+
+        for col, valeurs in [('MONTANT', montants), ('LIBELLE COMPLEMENTAIRE', libelles)]:
+            existant = df_export[col] if col in df_export.columns else pd.Series(None, index=index, dtype=object)
+            df_export[col] = existant.mask(pd.Series(trouvees, index=index), valeurs)
+
+    rapport = {
+        'lignes_template': len(df_export),
+        'trouves': int(trouvees.sum()),
+        'total': float(montants.sum()) if trouvees.any() else 0.0,
+        'non_trouves': sorted(cles_template[~trouvees].unique().tolist()),
+        'doublons_periode': doublons_periode,
+        'doublons_template': sorted(cles_template[cles_template.duplicated()].unique().tolist()),
+    }
+    return df_export, rapport
+
+
+# === EXPORTS EXCEL (écriture en flux, mode write-only) ===
+COULEURS_EXPORT = {
+    'CENTRALE': {'entete': '375623', 'colonnes': '70AD47', 'sous_titre': '375623'},  # Vert
+    'BT': {'entete': '2F5597', 'colonnes': '4472C4', 'sous_titre': '2F5597'},        # Bleu
+    'HT': {'entete': 'C65911', 'colonnes': 'ED7D31', 'sous_titre': 'C65911'},        # Orange
+}
+
+LARGEURS_BASE_CENTRALE = {
+    'UC': 10,
+    'CODE AGCE': 12,
+    'SITES': 25,
+    'CORRESPONDANCE': 20,
+    'IDENTIFIANT': 15,
+    'REFERENCE': 15,
+    'TENSION': 10,
+    'MONTANT': 12,
+    'CONSO': 12,
+    'DATE': 12
+}
+
+def _creer_styles(workbook, couleurs):
+    """Enregistre les styles nommés partagés par toutes les cellules du classeur"""
+    from openpyxl.styles import NamedStyle, Font, Alignment, Border, Side, PatternFill
+
+    bordure = Side(style='thin', color='000000')
+    thin_border = Border(left=bordure, right=bordure, top=bordure, bottom=bordure)
+    centre = Alignment(horizontal='center', vertical='center')
+    gauche = Alignment(horizontal='left', vertical='center')
+
+    styles = {
+        'titre': dict(
+            fill=PatternFill(start_color=couleurs['entete'], end_color=couleurs['entete'], fill_type='solid'),
+            font=Font(bold=True, size=16, color='FFFFFF', name='Calibri'),
+            alignment=centre
+        ),
+        'sous_titre': dict(font=Font(bold=True, size=12, color=couleurs['sous_titre'], name='Calibri'), alignment=centre),
+        'info': dict(font=Font(bold=True, size=10, name='Calibri'), alignment=gauche),
+        'info_seule': dict(font=Font(bold=True, size=10, name='Calibri')),
+        'info_valeur': dict(font=Font(size=10, name='Calibri'), alignment=gauche),
+        'valeur': dict(font=Font(size=10, name='Calibri')),
+        'entete_colonne': dict(
+            fill=PatternFill(start_color=couleurs['colonnes'], end_color=couleurs['colonnes'], fill_type='solid'),
+            font=Font(bold=True, size=10, color='FFFFFF', name='Calibri'),
+            alignment=Alignment(horizontal='center', vertical='center', wrap_text=True),
+            border=thin_border
+        ),
+        'donnee': dict(font=Font(size=10, name='Calibri'), alignment=gauche, border=thin_border),
+        'donnee_montant': dict(font=Font(size=10, name='Calibri'), alignment=gauche, border=thin_border,
+                               number_format='#,##0'),
+        'signature_titre': dict(
+            font=Font(bold=True, size=12, color=couleurs['sous_titre'], name='Calibri'),
+            alignment=centre,
+            fill=PatternFill(start_color='D9E1F2', end_color='D9E1F2', fill_type='solid')
+        ),
+        'signature_label': dict(
+            font=Font(bold=True, size=10, name='Calibri'),
+            alignment=centre,
+            border=Border(bottom=Side(style='medium', color='000000'))
+        ),
+        'signature_cadre': dict(font=Font(size=11, name='Calibri'), border=thin_border, alignment=centre),
+        'signature_nom': dict(font=Font(size=9, name='Calibri')),
+    }
+
+    for nom, attributs in styles.items():
+        style = NamedStyle(name=nom)
+        for attribut, valeur in attributs.items():
+            setattr(style, attribut, valeur)
+        workbook.add_named_style(style)
+
+def _cellule(worksheet, valeur, style):
+    from openpyxl.cell import WriteOnlyCell
+
+    cell = WriteOnlyCell(worksheet, value=valeur)
+    cell.style = style
+    return cell
+
+def _ecrire_entete(worksheet, nb_cols, titre, sous_titre, lignes_info):
+    """Lignes 1 à 7 : titre fusionné, sous-titre, lignes d'information et en-têtes de colonnes"""
+    from openpyxl.utils import get_column_letter
+
+    derniere_col = get_column_letter(max(nb_cols, 1))
+    for ligne, hauteur in [(1, 25), (2, 25), (3, 20), (5, 18), (6, 5), (7, 30)]:
+        worksheet.row_dimensions[ligne].height = hauteur
+    worksheet.merged_cells.add(f'A1:{derniere_col}2')
+    worksheet.merged_cells.add(f'A3:{derniere_col}3')
+
+    # Ligne 1-2: EN-TÊTE PRINCIPAL, Ligne 3: SOUS-TITRE
+    worksheet.append([_cellule(worksheet, titre, 'titre')])
+    worksheet.append([])
+    worksheet.append([_cellule(worksheet, sous_titre, 'sous_titre')])
+
+    # Lignes 4-5: informations (liste de (valeur, style) par colonne), Ligne 6: vide
+    for infos in lignes_info:
+        worksheet.append([_cellule(worksheet, valeur, style) if style else None for valeur, style in infos])
+    worksheet.append([])
+
+def _ecrire_donnees(worksheet, df, progression=None):
+    """Ligne 7 : en-têtes de colonnes, puis les lignes de données écrites en flux.
+    `progression(nb_lignes)` est appelée toutes les PAS_PROGRESSION lignes."""
+    worksheet.append([_cellule(worksheet, col, 'entete_colonne') for col in df.columns])
+
+    from openpyxl.cell import WriteOnlyCell
+
+    # Un style nommé par colonne, résolu une seule fois puis recopié sur chaque cellule
+    styles_colonnes = [
+        _cellule(worksheet, None, 'donnee_montant' if col == 'MONTANT' else 'donnee')._style
+        for col in df.columns
+    ]
+    valeurs = df.astype(object)
+    valeurs = valeurs.where(valeurs.notna(), None)
+    for num, row_data in enumerate(valeurs.itertuples(index=False, name=None), start=1):
+        if progression is not None and num % PAS_PROGRESSION == 0:
+            progression(num)
+        cellules = []
+        for valeur, style in zip(row_data, styles_colonnes):
+            cell = WriteOnlyCell(worksheet, value=valeur)
+            cell._style = copy(style)
+            cellules.append(cell)
+        worksheet.append(cellules)
+
+PAS_PROGRESSION = 2000
+
+def _nouveau_classeur(titre_feuille, couleurs, largeurs):
+    from openpyxl import Workbook
+    from openpyxl.utils import get_column_letter
+
+    workbook = Workbook(write_only=True)
+    _creer_styles(workbook, couleurs)
+    worksheet = workbook.create_sheet(titre_feuille)
+
+    # Les largeurs doivent être fixées avant l'écriture de la première ligne
+    for col_idx, largeur in enumerate(largeurs, start=1):
+        worksheet.column_dimensions[get_column_letter(col_idx)].width = largeur
+    return workbook, worksheet
+
+def _sauvegarder_classeur(workbook):
+    output = io.BytesIO()
+    workbook.save(output)
+    output.seek(0)
+    return output
+
+def export_base_centrale(df, progression=None):
+    """Génère un fichier Excel avec le style pour la Base Centrale (vert)"""
+    largeurs = [LARGEURS_BASE_CENTRALE.get(col, 15) for col in df.columns]
+    workbook, worksheet = _nouveau_classeur('Base_Centrale', COULEURS_EXPORT['CENTRALE'], largeurs)
+
+    current_date = datetime.now().strftime('%d/%m/%Y %H:%M')
+    montant_total = df['MONTANT'].sum() if 'MONTANT' in df.columns else 0
+    sites_uniques = df['IDENTIFIANT'].nunique() if 'IDENTIFIANT' in df.columns else 0
+
+    _ecrire_entete(
+        worksheet, len(df.columns),
+        "📊 BASE CENTRALE - COCODY",
+        "HISTORIQUE COMPLET DES FACTURES ÉLECTRIQUES",
+        [
+            [("Date d'export:", 'info'), (current_date, 'info_valeur'), (None, None),
+             ("Montant Total", 'info'), (f"{montant_total:,.0f} FCFA", 'info_valeur')],
+            [("Nombre de lignes:", 'info'), (len(df), 'info_valeur'), (None, None),
+             ("Sites uniques:", 'info'), (sites_uniques, 'info_valeur')],
+        ]
+    )
+    _ecrire_donnees(worksheet, df, progression)
+    return _sauvegarder_classeur(workbook)
+
+def _ecrire_signatures(worksheet, nb_cols, ligne_titre_sig):
+    """Section SIGNATURES ET APPROBATIONS (4 cadres fusionnés + Nom / Date)"""
+    from openpyxl.utils import get_column_letter
+
+    ligne_labels = ligne_titre_sig + 2
+    ligne_sig_start = ligne_labels + 1
+    ligne_sig_end = ligne_sig_start + 3
+
+    # Calculer l'espacement
+    col_prep = 1
+    col_verif = max(4, nb_cols // 4)
+    col_valid = max(7, nb_cols // 2)
+    col_appro = max(10, 3 * nb_cols // 4)
+    labels = [
+        (col_prep, "Préparé par:"),
+        (col_verif, "Vérifié par:"),
+        (col_valid, "Validé par:"),
+        (col_appro, "Approuvé par:")
+    ]
+    largeur = col_appro + 2
+
+    def ligne(valeurs_par_col, style):
+        cellules = [None] * largeur
+        for col, valeur in valeurs_par_col:
+            cellules[col - 1] = _cellule(worksheet, valeur, style)
+        worksheet.append(cellules)
+
+    worksheet.row_dimensions[ligne_titre_sig].height = 25
+    for row in range(ligne_sig_start, ligne_sig_end + 1):
+        worksheet.row_dimensions[row].height = 20
+    worksheet.merged_cells.add(f'A{ligne_titre_sig}:{get_column_letter(max(nb_cols, 1))}{ligne_titre_sig}')
+    for col, _ in labels:
+        worksheet.merged_cells.add(
+            f'{get_column_letter(col)}{ligne_sig_start}:{get_column_letter(col + 2)}{ligne_sig_end}'
+        )
+
+    worksheet.append([_cellule(worksheet, "SIGNATURES ET APPROBATIONS", 'signature_titre')])
+    worksheet.append([])
+    ligne(labels, 'signature_label')
+    ligne([(col, None) for col, _ in labels], 'signature_cadre')
+    for _ in range(3):
+        worksheet.append([])
+    ligne([(col, "Nom:") for col, _ in labels], 'signature_nom')
+    ligne([(col, "Date:") for col, _ in labels], 'signature_nom')
+
+def export_factures_cie(df, type_tension="BT", progression=None):
+    """Génère un fichier Excel avec le style CIE professionnel pour BT (bleu) ou HT (orange)"""
+    couleurs = COULEURS_EXPORT['BT' if type_tension == "BT" else 'HT']
+    workbook, worksheet = _nouveau_classeur('Factures', couleurs, [15] * len(df.columns))
+
+    current_date = datetime.now().strftime('%d/%m/%Y %H:%M')
+    montant_total = df['MONTANT'].sum() if 'MONTANT' in df.columns else 0
+    tension_txt = "BASSE TENSION (BT)" if type_tension == "BT" else "HAUTE TENSION (HT)"
+
+    _ecrire_entete(
+        worksheet, len(df.columns),
+        "⚡ COMPAGNIE IVOIRIENNE D'ÉLECTRICITÉ (CIE)",
+        f"FACTURES {tension_txt} - RAPPORT MENSUEL",
+        [
+            [("Date d'édition:", 'info'), (current_date, 'info_valeur'), (None, None),
+             ("Montant", 'info'), (f"{montant_total:,.0f} FCFA", 'info_valeur')],
+            [("Nombre de factures:", 'info_seule'), (len(df), 'valeur')],
+        ]
+    )
+    _ecrire_donnees(worksheet, df, progression)
+
+    # === SECTION SIGNATURES === (2 lignes vides après les données)
+    worksheet.append([])
+    worksheet.append([])
+    _ecrire_signatures(worksheet, len(df.columns), ligne_titre_sig=7 + len(df) + 3)
+    return _sauvegarder_classeur(workbook)
+
+
+# === CACHE DES EXPORTS ===
+# Classeurs déjà générés, indexés par (type d'export, empreinte des données)
+_CACHE_EXPORTS = OrderedDict()
+_VERROU_CACHE_EXPORTS = threading.Lock()
+TAILLE_CACHE_EXPORTS = 8
+
+def empreinte_dataframe(df):
+    """Empreinte du contenu d'un DataFrame (colonnes, index et valeurs)"""
+    h = hashlib.sha1()
+    h.update(repr(list(df.columns)).encode('utf-8'))
+    h.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    return h.hexdigest()
+
+def _generer_export(df, type_export, progression=None):
+    if type_export == 'CENTRALE':
+        return export_base_centrale(df, progression).getvalue()
+    return export_factures_cie(df, type_tension=type_export, progression=progression).getvalue()
+
+def _mettre_en_cache(cle, contenu):
+    with _VERROU_CACHE_EXPORTS:
+        _CACHE_EXPORTS[cle] = contenu
+        _CACHE_EXPORTS.move_to_end(cle)
+        while len(_CACHE_EXPORTS) > TAILLE_CACHE_EXPORTS:
+            _CACHE_EXPORTS.popitem(last=False)
+
+
+# === EXPORTS DANS UN POOL DE PROCESSUS ===
+# Les classeurs sont construits hors du processus Streamlit ; le DataFrame y est transmis
+# sous forme colonnaire (un tableau numpy par colonne) plutôt que ligne par ligne.
+TAILLE_POOL_EXPORTS = 2
+_POOL_EXPORTS = None
+_GESTIONNAIRE_EXPORTS = None
+_PROGRESSION_EXPORTS = None
+_DUREES_EXPORTS = OrderedDict()  # bornée comme le cache : une durée jamais lue est oubliée
+_VERROU_POOL_EXPORTS = threading.Lock()
+
+def en_colonnes(df):
+    """Forme colonnaire compacte d'un DataFrame : noms de colonnes + un tableau par colonne"""
+    return {
+        'colonnes': list(df.columns),
+        'valeurs': [df.iloc[:, i].to_numpy() for i in range(df.shape[1])],
+    }
+
+def depuis_colonnes(donnees):
+    """Reconstruit le DataFrame transmis par en_colonnes"""
+    df = pd.DataFrame(dict(enumerate(donnees['valeurs'])))
+    df.columns = donnees['colonnes']
+    return df
+
+def contexte_processus():
+    """Processus démarrés par 'spawn' : un fork du serveur Streamlit (boucle Tornado, threads
+    des travaux, verrous tenus) peut bloquer le processus enfant"""
+    return multiprocessing.get_context('spawn')
+
+def _pool_exports():
+    global _POOL_EXPORTS, _GESTIONNAIRE_EXPORTS, _PROGRESSION_EXPORTS
+    with _VERROU_POOL_EXPORTS:
+        if _POOL_EXPORTS is None:
+            _GESTIONNAIRE_EXPORTS = contexte_processus().Manager()
+            _PROGRESSION_EXPORTS = _GESTIONNAIRE_EXPORTS.dict()
+            _POOL_EXPORTS = ProcessPoolExecutor(max_workers=TAILLE_POOL_EXPORTS, mp_context=contexte_processus())
+    return _POOL_EXPORTS
+
+def _executer_export(type_export, donnees, cle_progression, progression):
+    """Construit un classeur dans un processus du pool en publiant son avancement"""
+    df = depuis_colonnes(donnees)
+    nb_lignes = max(len(df), 1)
+
+    def avancer(num):
+        progression[cle_progression] = num / nb_lignes
+
+    contenu = _generer_export(df, type_export, avancer)
+    progression[cle_progression] = 1.0
+    return contenu
+
+def _cle_progression(type_export, empreinte):
+    return f"{type_export}:{empreinte}"
+
+def soumettre_export(df, type_export, empreinte=None):
+    """Lance la construction du classeur dans le pool et retourne un Future (déjà résolu si
+    le classeur est en cache). Le résultat est ajouté au cache des exports."""
+    cle = (type_export, empreinte or empreinte_dataframe(df))
+    with _VERROU_CACHE_EXPORTS:
+        if cle in _CACHE_EXPORTS:
+            _CACHE_EXPORTS.move_to_end(cle)
+            future = Future()
+            future.set_result(_CACHE_EXPORTS[cle])
+            return future
+
+    pool = _pool_exports()
+    cle_progression = _cle_progression(*cle)
+    _PROGRESSION_EXPORTS[cle_progression] = 0.0
+    debut = time.perf_counter()
+    future = pool.submit(_executer_export, type_export, en_colonnes(df), cle_progression, _PROGRESSION_EXPORTS)
+
+    def terminer(f):
+        _PROGRESSION_EXPORTS.pop(cle_progression, None)
+        with _VERROU_POOL_EXPORTS:
+            _DUREES_EXPORTS[cle_progression] = time.perf_counter() - debut
+            while len(_DUREES_EXPORTS) > TAILLE_CACHE_EXPORTS:
+                _DUREES_EXPORTS.popitem(last=False)
+        if f.exception() is None:
+            _mettre_en_cache(cle, f.result())
+
+    future.add_done_callback(terminer)
+    return future
+
+def duree_export(type_export, empreinte):
+    """Durée (s) du dernier export terminé, rendue une seule fois (None ensuite ou si en cache)"""
+    with _VERROU_POOL_EXPORTS:
+        return _DUREES_EXPORTS.pop(_cle_progression(type_export, empreinte), None)
+
+def avancement_export(type_export, empreinte):
+    """Fraction (0 à 1) des lignes déjà écrites pour un export en cours"""
+    if _PROGRESSION_EXPORTS is None:
+        return 0.0
+    return _PROGRESSION_EXPORTS.get(_cle_progression(type_export, empreinte), 1.0)
+
+
+# === GÉNÉRATION PAR LOT (plusieurs périodes, BT et HT) ===
+def _generer_fichier_lot(type_tension, periode, df_template, df_periode):
+    """Construit un FACTURAT pour une tension et une période (exécuté dans un processus du pool)"""
+    df_export, rapport = remplir_template(df_template, df_periode, type_tension, periode)
+    df_final = df_export.drop(columns=['IDENTIFIANT']) if 'IDENTIFIANT' in df_export.columns else df_export
+    contenu = export_factures_cie(df_final, type_tension=type_tension).getvalue()
+
+    ligne = {
+        'FICHIER': f"FACTURAT_ELECTRICITE_{type_tension}_{periode}.xlsx",
+        'TENSION': type_tension,
+        'PERIODE': periode,
+        'LIGNES_TEMPLATE': rapport['lignes_template'],
+        'LIGNES_MISES_A_JOUR': rapport['trouves'],
+        'NON_TROUVES': len(rapport['non_trouves']),
+        'TOTAL_MONTANT': rapport['total'],
+    }
+    return ligne, contenu
+
+def generer_lot_zip(templates, df_periodes, periodes, max_workers=None, progression=None):
+    """Génère tous les FACTURAT des périodes demandées pour chaque tension de `templates`
+    ({'BT': df_template, ...}) dans un pool de processus, et les écrit dans un ZIP au fil de l'eau.
+    Retourne (contenu du ZIP, manifeste) ; le manifeste est aussi joint au ZIP en CSV."""
+    cles = typer_periodes(df_periodes['DATE'])
+    groupes = {periode: df for periode, df in df_periodes.groupby(cles, sort=False)}
+    periodes = [normaliser_periode(periode) for periode in periodes]
+    taches = [
+        (type_tension, periode, df_template, groupes[periode])
+        for periode in periodes if periode in groupes
+        for type_tension, df_template in templates.items()
+    ]
+
+    buffer = io.BytesIO()
+    lignes = []
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=contexte_processus()) as pool:
+            futures = [pool.submit(_generer_fichier_lot, *tache) for tache in taches]
+            for termine, future in enumerate(as_completed(futures), start=1):
+                ligne, contenu = future.result()
+                archive.writestr(ligne['FICHIER'], contenu)
+                lignes.append(ligne)
+                if progression is not None:
+                    progression(termine, len(taches), ligne)
+
+        manifeste = pd.DataFrame(lignes, columns=[
+            'FICHIER', 'TENSION', 'PERIODE', 'LIGNES_TEMPLATE', 'LIGNES_MISES_A_JOUR',
+            'NON_TROUVES', 'TOTAL_MONTANT'
+        ]).sort_values(['PERIODE', 'TENSION'], ignore_index=True)
+        archive.writestr('manifeste.csv', manifeste.to_csv(index=False, sep=';'))
+    return buffer.getvalue(), manifeste
+
+
+# === FILE DE TRAVAUX EN ARRIÈRE-PLAN ===
+# Imports et générations exécutés par un thread du processus serveur, un travail à la fois
+# (les écritures dans la base restent séquentielles). L'état de chaque travail est persisté
+# dans une base SQLite : il survit au rechargement de la page, et les travaux interrompus par
+# un redémarrage sont relancés (l'import est idempotent).
+STATUTS_ACTIFS = ('en_attente', 'en_cours')
+_FILE_TRAVAUX = queue.Queue()
+_THREADS_TRAVAUX = {}
+_VERROU_TRAVAUX = threading.Lock()
+
+def _connexion_travaux(chemin_db):
+    con = connexion_sqlite(chemin_db)
+    con.execute(
+        'CREATE TABLE IF NOT EXISTS travaux ('
+        'id INTEGER PRIMARY KEY, type TEXT, libelle TEXT, parametres TEXT, statut TEXT, '
+        'etape TEXT, progression REAL DEFAULT 0, lignes INTEGER DEFAULT 0, lignes_total INTEGER, '
+        'cree_le TEXT, debut TEXT, fin TEXT, message TEXT, resultat TEXT, modifie_base INTEGER DEFAULT 0)'
+    )
+    return con
+
+def _maj_travail(chemin_db, id_travail, **champs):
+    with _connexion_travaux(chemin_db) as con:
+        affectations = ', '.join(f'{champ} = ?' for champ in champs)
+        con.execute(f'UPDATE travaux SET {affectations} WHERE id = ?', [*champs.values(), id_travail])
+    con.close()
+
+def _maintenant():
+    return datetime.now().isoformat(timespec='milliseconds')
+
+def demarrer_travaux(chemin_db):
+    """Démarre (une fois par processus) le thread d'exécution et relance les travaux
+    restés en attente ou en cours lors d'un arrêt du serveur"""
+    with _VERROU_TRAVAUX:
+        if chemin_db in _THREADS_TRAVAUX:
+            return
+        with _connexion_travaux(chemin_db) as con:
+            con.execute("UPDATE travaux SET statut = 'en_attente', progression = 0 WHERE statut = 'en_cours'")
+            repris = [ligne[0] for ligne in con.execute(
+                "SELECT id FROM travaux WHERE statut = 'en_attente' ORDER BY id")]
+        con.close()
+        for id_travail in repris:
+            _FILE_TRAVAUX.put((chemin_db, id_travail))
+
+        thread = threading.Thread(target=_boucle_travaux, name='travaux-factures', daemon=True)
+        thread.start()
+        _THREADS_TRAVAUX[chemin_db] = thread
+
+def soumettre_travail(chemin_db, type_travail, libelle, parametres):
+    """Enregistre un travail ('import' ou 'generation') et le place dans la file. Retourne son id."""
+    demarrer_travaux(chemin_db)
+    with _connexion_travaux(chemin_db) as con:
+        curseur = con.execute(
+            "INSERT INTO travaux (type, libelle, parametres, statut, cree_le) VALUES (?, ?, ?, 'en_attente', ?)",
+            (type_travail, libelle, json.dumps(parametres, ensure_ascii=False), _maintenant())
+        )
+        id_travail = curseur.lastrowid
+    con.close()
+    _FILE_TRAVAUX.put((chemin_db, id_travail))
+    return id_travail
+
+def _boucle_travaux():
+    while True:
+        chemin_db, id_travail = _FILE_TRAVAUX.get()
+        try:
+            _executer_travail(chemin_db, id_travail)
+        finally:
+            _FILE_TRAVAUX.task_done()
+
+def _executer_travail(chemin_db, id_travail):
+    with _connexion_travaux(chemin_db) as con:
+        ligne = con.execute('SELECT type, parametres, statut FROM travaux WHERE id = ?', (id_travail,)).fetchone()
+    con.close()
+    if ligne is None or ligne[2] != 'en_attente':
+        return
+    type_travail, parametres = ligne[0], json.loads(ligne[1])
+    _maj_travail(chemin_db, id_travail, statut='en_cours', debut=_maintenant())
+
+    def avancer(lignes, lignes_total=None, etape=None, progression=None):
+        champs = {'lignes': int(lignes)}
+        if lignes_total:
+            champs.update(lignes_total=int(lignes_total), progression=min(lignes / lignes_total, 1.0))
+        if progression is not None:
+            champs['progression'] = progression
+        if etape is not None:
+            champs['etape'] = etape
+        _maj_travail(chemin_db, id_travail, **champs)
+
+    try:
+        bilan = TYPES_TRAVAUX[type_travail](parametres, avancer)
+    except Exception as e:
+        _maj_travail(chemin_db, id_travail, statut='erreur', fin=_maintenant(), message=f"{type(e).__name__}: {e}")
+        return
+    _maj_travail(
+        chemin_db, id_travail, statut='termine', fin=_maintenant(), progression=1.0, etape='Terminé',
+        message=bilan.get('message'), resultat=bilan.get('resultat'),
+        modifie_base=int(bool(bilan.get('modifie_base')))
+    )
+
+def lire_travail(chemin_db, id_travail):
+    """État d'un travail (dict) ou None"""
+    travaux = lister_travaux(chemin_db, ids=[id_travail])
+    return travaux.iloc[0].to_dict() if len(travaux) else None
+
+def lister_travaux(chemin_db, limite=50, ids=None):
+    """Derniers travaux, avec durée (s) et débit (lignes/s)"""
+    requete = 'SELECT * FROM travaux'
+    params = []
+    if ids is not None:
+        requete += f' WHERE id IN ({", ".join("?" * len(ids))})'
+        params = list(ids)
+    with _connexion_travaux(chemin_db) as con:
+        df = pd.read_sql_query(requete + ' ORDER BY id DESC LIMIT ?', con, params=params + [limite])
+    con.close()
+
+    debut = pd.to_datetime(df['debut'])
+    fin = pd.to_datetime(df['fin']).fillna(pd.Timestamp(datetime.now()))
+    df['duree'] = (fin - debut).dt.total_seconds()
+    df['debit'] = (df['lignes'] / df['duree'].where(df['duree'] > 0)).round(0)
+    return df
+
+def _travail_import(parametres, avancer):
+    """Import d'un ou plusieurs fichiers de factures déposés sur le disque, toutes périodes
+    confondues : une jointure, un upsert et une seule transaction d'écriture. Les fichiers
+    déposés sont supprimés après l'import, sauf avec parametres['conserver_fichiers']."""
+    type_tension = parametres['tension']
+    config = CONFIG_FACTURES[type_tension]
+    fichiers = parametres['fichiers']
+
+    lectures = []
+    for num, fichier in enumerate(fichiers, start=1):
+        avancer(sum(len(df) for df in lectures), etape=f"Lecture {num}/{len(fichiers)} - {fichier['nom']}")
+        df = lire_factures(fichier['fichier'], type_tension, nom=fichier['nom'])
+        manquantes = [col for col in (config['cle'], config['montant'], config['caract']) if col not in df.columns]
+        if manquantes:
+            raise ValueError(f"{fichier['nom']} : colonnes manquantes : {', '.join(manquantes)}")
+        lectures.append(df)
+    df_factures = pd.concat(lectures, ignore_index=True)
+    fichier_par_ligne = np.repeat(np.arange(len(lectures)), [len(df) for df in lectures])
+
+    total = len(df_factures)
+    illisibles = sum(df.attrs.get('montants_illisibles', 0) for df in lectures)
+    avancer(0, total, 'Jointure avec les sites')
+
+    def calculer(df_sites, df_faits):
+        df_nouvelles = importer_factures(df_sites, df_factures, type_tension)
+        ecritures = upserter_faits(df_faits, df_nouvelles, fichier_par_ligne[df_nouvelles.index])[1]
+        avancer(total, total, 'Écriture dans la base')
+        return ecritures, (df_nouvelles, df_sites)
+
+    # Jointure, upsert et écriture sur la dernière version de la base partagée
+    _, ecritures, (df_nouvelles, df_sites) = modifier_base(parametres['stockage'], calculer)
+    modifie = bool(len(ecritures['faits']) or len(ecritures['supprimes']))
+    for fichier, df in zip(fichiers, lectures):
+        periodes = sorted(periodes_factures(df, type_tension).dropna().unique())
+        enregistrer_import(parametres['registre'], fichier['empreinte'], {
+            'tension': type_tension, 'periode': ', '.join(map(str, periodes)), 'nom': fichier['nom'], 'lignes': len(df)
+        })
+        if not parametres.get('conserver_fichiers') and os.path.exists(fichier['fichier']):
+            os.remove(fichier['fichier'])
+
+    resume = ecritures['resume']
+    periodes = [str(p) for p in sorted(df_nouvelles['DATE'].dropna().unique())]
+    non_rapproches = rapport_non_rapproches(df_factures, df_sites, type_tension)
+    return {
+        'modifie_base': modifie,
+        'lignes': total,
+        'rapprochees': len(df_nouvelles),
+        'montants_illisibles': illisibles,
+        'non_rapproches': non_rapproches,
+        'resume': resume,
+        'message': (
+            f"{len(periodes)} période(s) ({', '.join(periodes[:3])}{'...' if len(periodes) > 3 else ''}) : "
+            f"{len(df_nouvelles)}/{total} facture(s) rapprochée(s), "
+            f"{resume['ajouts']} ajout(s), {resume['remplacements']} remplacement(s), "
+            f"{resume['inchanges']} inchangée(s)"
+            + (f", {resume['recouvrements']} clé(s) présente(s) dans plusieurs fichiers (dernier fichier retenu)"
+               if resume['recouvrements'] else '')
+            + (f", {len(non_rapproches)} clé(s) sans site" if len(non_rapproches) else '')
+            + (f", {illisibles} montant(s) illisible(s) (valeurs existantes conservées)" if illisibles else '')
+        ),
+    }
+
+def _travail_generation(parametres, avancer):
+    """Génération par lot des FACTURAT, archive ZIP écrite sur le disque"""
+    avancer(0, etape='Chargement de la base')
+    templates = {
+        type_tension: lire_excel_cache(chemin, parametres.get('dossier_cache'))
+        for type_tension, chemin in parametres['templates'].items()
+    }
+    base = base_partagee(parametres['stockage'])
+    periodes = [normaliser_periode(periode) for periode in parametres['periodes']]
+    df_sites, df_faits = base['sites'], faits_periodes(base['faits'], base['index'], periodes)
+    df_periodes = joindre_base(df_sites, df_faits, ['SITES', 'IDENTIFIANT', 'MONTANT', 'DATE'])
+
+    lignes_ecrites = [0]
+
+    def progression(termine, total, ligne):
+        lignes_ecrites[0] += ligne['LIGNES_TEMPLATE']
+        avancer(lignes_ecrites[0], etape=f"{termine}/{total} fichier(s) - {ligne['FICHIER']}",
+                progression=termine / total)
+
+    avancer(0, etape='Génération des fichiers')
+    contenu, manifeste = generer_lot_zip(templates, df_periodes, periodes, progression=progression)
+
+    def ecrire(tmp):
+        with open(tmp, 'wb') as f:
+            f.write(contenu)
+
+    _ecrire_atomique(parametres['sortie'], ecrire)
+    return {
+        'resultat': parametres['sortie'],
+        'manifeste': manifeste,
+        'message': f"{len(manifeste)} fichier(s) - Total {manifeste['TOTAL_MONTANT'].sum():,.0f} FCFA",
+    }
+
+TYPES_TRAVAUX = {
+    'import': _travail_import,
+    'generation': _travail_generation,
+}
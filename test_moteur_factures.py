@@ -0,0 +1,623 @@
+"""Tests de moteur_factures : stockage, import, éditeur, journal, base partagée, génération et exports.
+
+    python -m pytest -q
+"""
+import io
+import json
+import sqlite3
+import threading
+import time
+import zipfile
+from datetime import datetime
+
+import numpy as np
+import openpyxl
+import pandas as pd
+import pytest
+
+import moteur_factures
+from moteur_factures import (
+    separer_base, joindre_base, typer_periodes, normaliser_periode,
+    sauvegarder_base_sqlite, charger_base_sqlite, enregistrer_changements_sqlite, version_sqlite,
+    sauvegarder_base_parquet, charger_base_parquet, journaliser_changements, lire_journal,
+    nb_changements_journal, compacter_journal, chemin_journal,
+    periodes_stockage, charger_periodes,
+    upserter_faits, appliquer_changements_editeur, lire_factures, importer_factures,
+    empreinte_fichier, lire_registre_imports, enregistrer_import,
+    remplir_template, generer_lot_zip, export_factures_cie, export_base_centrale, LARGEURS_BASE_CENTRALE,
+    construire_cube, mettre_a_jour_cube, interroger_cube, construire_index, mettre_a_jour_index, faits_periodes,
+    cle_canonique, rapprocher_cles, rapport_non_rapproches,
+    base_partagee, modifier_base,
+    empreinte_dataframe, soumettre_export, avancement_export, duree_export, TAILLE_CACHE_EXPORTS,
+    demarrer_travaux, lire_travail,
+)
+
+
+# === DONNÉES ===
+def base_test(identifiants=('100', '200', '300'), periodes=(202401, 202402)):
+    """(sites, faits) : une ligne par site et par période, MONTANT = 1000 x rang du site"""
+    lignes = [
+        {'UC': 'UC NORD', 'CODE AGCE': '101', 'SITES': f"SITE {identifiant}", 'CORRESPONDANCE': '',
+         'IDENTIFIANT': identifiant, 'REFERENCE': f"R{identifiant}", 'TENSION': 'BASSE' if rang < 2 else 'HAUTE',
+         'MONTANT': 1000.0 * (rang + 1), 'CONSO': 10.0 * (rang + 1), 'DATE': periode}
+        for periode in periodes for rang, identifiant in enumerate(identifiants)
+    ]
+    return separer_base(pd.DataFrame(lignes))
+
+def faits(lignes):
+    """Nouveaux faits [(IDENTIFIANT, DATE, MONTANT, CONSO)]"""
+    return pd.DataFrame(lignes, columns=['IDENTIFIANT', 'DATE', 'MONTANT', 'CONSO'])
+
+def montant(df_faits, identifiant, periode):
+    return df_faits.loc[(df_faits['IDENTIFIANT'] == identifiant) & (df_faits['DATE'] == periode), 'MONTANT'].tolist()
+
+
+# === TYPES ===
+def test_periodes_valides():
+    periodes = typer_periodes(pd.Series([202409, 202409.0, '202409', ' 09/2024 ', '9-2024', 190001, 210012], dtype=object))
+    assert periodes.tolist() == [202409, 202409, 202409, 202409, 202409, 190001, 210012]
+    assert str(periodes.dtype) == 'Int32'
+
+@pytest.mark.parametrize('valeur', [45383, 202413, 202400, 19000101, 189912, 210101, 202409.5, '13/2024', 'x', '', None])
+def test_periodes_rejetees(valeur):
+    assert typer_periodes(pd.Series([valeur], dtype=object)).isna().all()
+    assert normaliser_periode(valeur) is None
+
+
+# === IMPORT (upserter_faits) ===
+def test_reimport_idempotent():
+    df_sites, df_faits = base_test()
+    nouveaux = faits([('100', 202403, 5.0, 1.0), ('200', 202403, 6.0, 2.0), ('100', 202402, 7.0, 3.0)])
+
+    une_fois, ecritures = upserter_faits(df_faits, nouveaux)
+    deux_fois, ecritures_bis = upserter_faits(une_fois, nouveaux)
+
+    assert ecritures['resume']['ajouts'] == 2 and ecritures['resume']['remplacements'] == 1
+    assert ecritures_bis['resume'] == dict(ecritures_bis['resume'], ajouts=0, remplacements=0, inchanges=3)
+    assert len(ecritures_bis['faits']) == 0 and len(ecritures_bis['supprimes']) == 0
+    pd.testing.assert_frame_equal(une_fois, deux_fois)
+    assert len(deux_fois) == len(df_faits) + 2
+
+def test_fichiers_recouvrants_le_dernier_l_emporte():
+    df_sites, df_faits = base_test()
+    # Fichier 0 : deux lignes pour la même clé (additionnées) ; fichier 1 : la clé à nouveau
+    nouveaux = faits([('100', 202403, 10.0, 1.0), ('100', 202403, 15.0, 1.0), ('200', 202403, 20.0, 2.0),
+                      ('100', 202403, 999.0, 9.0)])
+    df_faits, ecritures = upserter_faits(df_faits, nouveaux, fichiers=[0, 0, 0, 1])
+
+    assert montant(df_faits, '100', 202403) == [999.0]
+    assert montant(df_faits, '200', 202403) == [20.0]
+    assert ecritures['resume']['recouvrements'] == 1
+
+def test_lignes_d_un_meme_fichier_additionnees():
+    df_sites, df_faits = base_test()
+    df_faits, _ = upserter_faits(df_faits, faits([('300', 202403, 10.0, 1.0), ('300', 202403, 15.5, 2.0)]))
+    assert montant(df_faits, '300', 202403) == [25.5]
+
+def test_registre_des_imports(tmp_path):
+    chemin = tmp_path / 'factures_BT.csv'
+    chemin.write_bytes(b'reference contrat;Montant facture TTC\n100;5\n')
+    registre = str(tmp_path / 'imports.json')
+    assert lire_registre_imports(registre) == {}
+
+    empreinte = empreinte_fichier(str(chemin))
+    assert empreinte == empreinte_fichier(io.BytesIO(chemin.read_bytes()))
+    enregistrer_import(registre, empreinte, {'tension': 'BT', 'periode': 202403, 'nom': chemin.name, 'lignes': 1})
+    assert lire_registre_imports(registre)[empreinte]['periode'] == 202403
+
+    chemin.write_bytes(b'reference contrat;Montant facture TTC\n100;6\n')
+    assert empreinte_fichier(str(chemin)) not in lire_registre_imports(registre)
+
+
+# === CLÉS CANONIQUES ===
+def test_cle_canonique():
+    cles = cle_canonique(pd.Series([' 00123.0 ', '123', 'ab c', '', None, '0', 'A-01'], dtype=object))
+    assert cles.iloc[:3].tolist() == ['123', '123', 'ABC']
+    assert cles.iloc[3:5].isna().all()
+    assert cles.iloc[5:].tolist() == ['0', 'A-01']
+
+def test_cles_canoniques_en_collision():
+    # '0123' et '123' ont la même forme canonique : exactes, elles restent rapprochées ;
+    # les autres écritures sont ambiguës et signalées
+    df_sites, _ = base_test(identifiants=('0123', '123', '456'))
+    identifiants = rapprocher_cles(pd.Series(['0123', '123', '00123', '123.0', '456.0', '789']), df_sites)
+    assert identifiants.iloc[:2].tolist() == ['0123', '123']
+    assert identifiants.iloc[2:4].isna().all()
+    assert identifiants.iloc[4] == '456'
+    assert pd.isna(identifiants.iloc[5])
+
+    df_factures = pd.DataFrame({'reference contrat': ['00123', '789'], 'Montant facture TTC': [5.0, 7.0]})
+    rapport = rapport_non_rapproches(df_factures, df_sites, 'BT').set_index('CLE_NORMALISEE')
+    assert rapport.loc['123', 'MOTIF'] == 'ambiguë'
+    assert sorted(rapport.loc['123', 'CANDIDATS'].split(', ')) == ['0123', '123']
+    assert rapport.loc['789', 'MOTIF'] == 'inconnue'
+
+
+# === ÉDITEUR ===
+def test_changements_editeur():
+    df_sites, df_faits = base_test()
+    df_vue = joindre_base(df_sites, df_faits)
+    changements = {
+        'edited_rows': {0: {'MONTANT': 1234.5}},
+        'deleted_rows': [1],
+        'added_rows': [{'IDENTIFIANT': '900', 'DATE': 202403, 'MONTANT': 9.0, 'SITES': 'NOUVEAU'}],
+    }
+    sites_apres, faits_apres, ecritures = appliquer_changements_editeur(df_sites, df_faits, df_vue, changements)
+
+    assert faits_apres.loc[df_vue.index[0], 'MONTANT'] == 1234.5
+    assert df_vue.index[1] not in faits_apres.index
+    assert montant(faits_apres, '900', 202403) == [9.0]
+    assert '900' in sites_apres.index and sites_apres.loc['900', 'SITES'] == 'NOUVEAU'
+    assert list(ecritures['supprimes']) == [df_vue.index[1]]
+    assert ecritures['resume'] == dict(ecritures['resume'], cellules=1, ajouts=1, suppressions=1)
+    # Les DataFrames reçus ne sont pas modifiés
+    assert df_faits.loc[df_vue.index[0], 'MONTANT'] == 1000.0
+
+def test_changements_editeur_sur_vue_perimee():
+    df_sites, df_faits = base_test()
+    df_vue = joindre_base(df_sites, df_faits)
+    # La ligne affichée a été supprimée de la base depuis l'affichage
+    df_faits = df_faits.drop(df_vue.index[0])
+    with pytest.raises(ValueError):
+        appliquer_changements_editeur(df_sites, df_faits, df_vue, {'edited_rows': {0: {'MONTANT': 1.0}}})
+
+
+# === STOCKAGE SQLITE ===
+def test_sqlite_aller_retour(tmp_path):
+    chemin = str(tmp_path / 'base.db')
+    df_sites, df_faits = base_test()
+    sauvegarder_base_sqlite(chemin, df_sites, df_faits)
+
+    sites_lus, faits_lus = charger_base_sqlite(chemin)
+    pd.testing.assert_frame_equal(faits_lus, df_faits)
+    assert sites_lus.index.tolist() == df_sites.index.tolist()
+    assert sites_lus['SITES'].astype(str).tolist() == df_sites['SITES'].astype(str).tolist()
+
+def test_sqlite_une_ligne_par_cle(tmp_path):
+    chemin = str(tmp_path / 'base.db')
+    df_sites, df_faits = base_test()
+    sauvegarder_base_sqlite(chemin, df_sites, df_faits)
+
+    con = sqlite3.connect(chemin)
+    with pytest.raises(sqlite3.IntegrityError):
+        con.execute('INSERT INTO faits (id, "IDENTIFIANT", "DATE") VALUES (999, \'100\', \'202401\')')
+    con.close()
+
+    # Une écriture sous un nouvel id remplace la ligne de même (IDENTIFIANT, DATE)
+    nouveau = faits([('100', 202401, 5.0, 1.0)]).set_axis([999])
+    enregistrer_changements_sqlite(chemin, pd.DataFrame(), nouveau, [])
+    faits_lus = charger_base_sqlite(chemin)[1]
+    assert montant(faits_lus, '100', 202401) == [5.0]
+    assert len(faits_lus) == len(df_faits)
+
+def test_sqlite_compteur_d_ecritures(tmp_path):
+    chemin = str(tmp_path / 'base.db')
+    assert version_sqlite(chemin) is None
+    df_sites, df_faits = base_test()
+    sauvegarder_base_sqlite(chemin, df_sites, df_faits)
+    version = version_sqlite(chemin)
+
+    charger_base_sqlite(chemin)
+    assert version_sqlite(chemin) == version
+    enregistrer_changements_sqlite(chemin, pd.DataFrame(), df_faits.iloc[:1].assign(MONTANT=1.0), [])
+    assert version_sqlite(chemin) == version + 1
+
+def test_sqlite_lecture_par_periode(tmp_path):
+    stockage = {'format': 'sqlite', 'chemin': str(tmp_path / 'base.db')}
+    assert periodes_stockage(stockage) == []
+    df_sites, df_faits = base_test(periodes=(202401, 202402, 202403))
+    sauvegarder_base_sqlite(stockage['chemin'], df_sites, df_faits)
+
+    assert periodes_stockage(stockage) == [202401, 202402, 202403]
+    colonnes = ['SITES', 'IDENTIFIANT', 'MONTANT', 'DATE']
+    vue = charger_periodes(stockage, [202402], colonnes)
+    attendu = joindre_base(df_sites, df_faits[df_faits['DATE'] == 202402], colonnes)
+    assert vue.index.tolist() == attendu.index.tolist()
+    assert vue['MONTANT'].tolist() == attendu['MONTANT'].tolist()
+    assert vue['SITES'].tolist() == attendu['SITES'].astype(str).tolist()
+
+
+# === STOCKAGE PARQUET ===
+def test_parquet_lecture_par_partition(tmp_path):
+    stockage = {'format': 'parquet', 'chemin': str(tmp_path / 'parquet')}
+    assert periodes_stockage(stockage) == []
+    df_sites, df_faits = base_test(periodes=(202401, 202402, 202403))
+    sauvegarder_base_parquet(stockage['chemin'], df_sites, df_faits)
+    assert sorted(p.name for p in (tmp_path / 'parquet' / 'faits').iterdir()) == [
+        'DATE=202401.parquet', 'DATE=202402.parquet', 'DATE=202403.parquet']
+
+    # Les partitions des autres périodes ne sont pas ouvertes
+    (tmp_path / 'parquet' / 'faits' / 'DATE=202401.parquet').unlink()
+    faits_lus = charger_base_parquet(stockage['chemin'], periodes=[202402])[1]
+    pd.testing.assert_frame_equal(faits_lus, df_faits[df_faits['DATE'] == 202402])
+
+    # Une période présente seulement dans le journal est listée et lue
+    _, ecritures = upserter_faits(df_faits, faits([('100', 202404, 4.0, 1.0)]))
+    journaliser_changements(stockage['chemin'], ecritures)
+    assert periodes_stockage(stockage) == [202401, 202402, 202403, 202404]
+    vue = charger_periodes(stockage, [202404], ['IDENTIFIANT', 'SITES', 'MONTANT'])
+    assert vue[['IDENTIFIANT', 'MONTANT']].values.tolist() == [['100', 4.0]]
+    assert vue['SITES'].astype(str).tolist() == ['SITE 100']
+
+
+# === JOURNAL PARQUET ===
+def test_rejeu_et_compactage_du_journal(tmp_path):
+    dossier = str(tmp_path / 'parquet')
+    df_sites, df_faits = base_test()
+    sauvegarder_base_parquet(dossier, df_sites, df_faits)
+
+    attendu = df_faits
+    for nouveaux in ([('100', 202401, 1.0, 1.0), ('200', 202403, 2.0, 2.0)], [('300', 202402, 3.0, 3.0)]):
+        attendu, ecritures = upserter_faits(attendu, faits(nouveaux))
+        journaliser_changements(dossier, ecritures)
+
+    assert nb_changements_journal(dossier) == 2
+    pd.testing.assert_frame_equal(charger_base_parquet(dossier)[1], attendu, check_dtype=False)
+
+    assert compacter_journal(dossier) == 2
+    assert nb_changements_journal(dossier) == 0 and lire_journal(dossier) == []
+    pd.testing.assert_frame_equal(charger_base_parquet(dossier)[1], attendu, check_dtype=False)
+    assert set(charger_base_parquet(dossier, periodes=[202403])[1]['DATE']) == {202403}
+
+def test_ligne_de_journal_tronquee(tmp_path):
+    dossier = str(tmp_path / 'parquet')
+    df_sites, df_faits = base_test()
+    sauvegarder_base_parquet(dossier, df_sites, df_faits)
+
+    df_faits, ecritures = upserter_faits(df_faits, faits([('100', 202401, 1.0, 1.0)]))
+    journaliser_changements(dossier, ecritures)
+    # Écriture interrompue : dernière ligne incomplète, sans fin de ligne
+    with open(chemin_journal(dossier), 'a', encoding='utf-8') as f:
+        f.write('{"horodatage": "2024-01-01T00:00:00", "sites": {"col')
+
+    assert len(lire_journal(dossier)) == 1
+    pd.testing.assert_frame_equal(charger_base_parquet(dossier)[1], df_faits, check_dtype=False)
+
+    # L'ajout suivant supprime la ligne tronquée au lieu de la prolonger
+    df_faits, ecritures = upserter_faits(df_faits, faits([('200', 202401, 2.0, 2.0)]))
+    journaliser_changements(dossier, ecritures)
+    assert len(lire_journal(dossier)) == 2
+    pd.testing.assert_frame_equal(charger_base_parquet(dossier)[1], df_faits, check_dtype=False)
+
+
+# === CUBE DES STATISTIQUES ===
+def cube_trie(cube):
+    return cube.astype({col: object for col in ['TENSION', 'UC', 'SITES']}).sort_values(
+        ['DATE', 'SITES'], key=lambda col: col.astype(str), ignore_index=True)
+
+def test_cube_incremental_egal_au_recalcul():
+    df_sites, df_faits = base_test()
+    cube = construire_cube(df_sites, df_faits)
+    df_faits, ecritures = upserter_faits(df_faits, faits([('100', 202403, 5.0, 1.0), ('300', 202403, np.nan, 2.0)]))
+
+    pd.testing.assert_frame_equal(
+        cube_trie(mettre_a_jour_cube(cube, df_sites, ecritures['faits'])),
+        cube_trie(construire_cube(df_sites, df_faits)), check_dtype=False
+    )
+
+def test_cube_filtre_par_valeur_du_site():
+    # Un site au nom numérique : le filtre reçoit la valeur de l'index, sans conversion en texte
+    df_sites, df_faits = base_test()
+    df_sites = df_sites.astype({'SITES': object})
+    df_sites.loc['300', 'SITES'] = 123
+    cube = construire_cube(df_sites, df_faits)
+    sites = construire_index(df_sites, df_faits)['valeurs']['SITES']
+    assert sites == [123, 'SITE 100', 'SITE 200']
+
+    totaux = interroger_cube(cube, {'SITES': sites[0]})
+    assert totaux['MONTANT'].tolist() == [3000.0, 3000.0] and totaux['NB_LIGNES'].tolist() == [1, 1]
+    totaux = interroger_cube(cube, {'TENSION': 'BASSE'})
+    assert totaux['DATE'].tolist() == [202401, 202402] and totaux['MONTANT'].tolist() == [3000.0, 3000.0]
+    assert totaux['DATE_DISPLAY'].tolist() == ['01/2024', '02/2024']
+
+
+# === INDEX PAR PÉRIODE ===
+def meme_index(index, attendu):
+    assert index['lignes'] == attendu['lignes'] and index['valeurs'] == attendu['valeurs']
+    assert list(index['periodes']) == list(attendu['periodes'])
+    for periode, positions in attendu['periodes'].items():
+        assert index['periodes'][periode].tolist() == positions.tolist()
+
+def import_en_fin(df_sites, df_faits):
+    return (df_sites,) + upserter_faits(df_faits, faits([('100', 202403, 5.0, 1.0), ('200', 202401, 6.0, 2.0)]))
+
+def import_remplacant(df_sites, df_faits):
+    return (df_sites,) + upserter_faits(df_faits, faits([('100', 202401, 5.0, 1.0), ('200', 202403, 6.0, 2.0)]))
+
+def ajout_d_un_site(df_sites, df_faits):
+    changements = {'added_rows': [{'IDENTIFIANT': '900', 'DATE': 202402, 'MONTANT': 9.0, 'SITES': 'NOUVEAU'}]}
+    return appliquer_changements_editeur(df_sites, df_faits, joindre_base(df_sites, df_faits), changements)
+
+@pytest.mark.parametrize('ecrire', [import_en_fin, import_remplacant, ajout_d_un_site])
+def test_index_incremental_egal_a_la_reconstruction(ecrire):
+    df_sites, df_faits = base_test()
+    index = construire_index(df_sites, df_faits)
+    avant = {periode: positions.tolist() for periode, positions in index['periodes'].items()}
+
+    df_sites, df_faits, ecritures = ecrire(df_sites, df_faits)
+    index_suivant = mettre_a_jour_index(index, df_sites, df_faits, ecritures)
+
+    meme_index(index_suivant, construire_index(df_sites, df_faits))
+    # L'index de la version publiée n'est pas modifié
+    assert {periode: positions.tolist() for periode, positions in index['periodes'].items()} == avant
+    pd.testing.assert_frame_equal(
+        faits_periodes(df_faits, index_suivant, [202401, 202403]),
+        df_faits[df_faits['DATE'].isin([202401, 202403])].sort_values('DATE', kind='stable')
+    )
+
+
+# === BASE PARTAGÉE ===
+def test_ecritures_concurrentes_sur_la_base_partagee(tmp_path):
+    stockage = {'format': 'sqlite', 'chemin': str(tmp_path / 'base.db')}
+    df_sites, df_faits = base_test()
+    sauvegarder_base_sqlite(stockage['chemin'], df_sites, df_faits)
+    initiale = base_partagee(stockage)
+    faits_initiaux = initiale['faits'].copy()
+
+    def importer(identifiant):
+        def calculer(sites, faits_base):
+            time.sleep(0.01)  # laisse les autres threads tenter d'écrire entre la lecture et la publication
+            return upserter_faits(faits_base, faits([(identifiant, 202403, 1.0, 1.0)]))[1], None
+        modifier_base(stockage, calculer)
+
+    def editer():
+        def calculer(sites, faits_base):
+            vue = joindre_base(sites, faits_base)
+            return appliquer_changements_editeur(sites, faits_base, vue, {'edited_rows': {0: {'MONTANT': 5.0}}})[2], None
+        modifier_base(stockage, calculer)
+
+    threads = [threading.Thread(target=importer, args=(identifiant,)) for identifiant in ('100', '200', '300')]
+    threads.append(threading.Thread(target=editer))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Aucune écriture perdue, et la version publiée au départ n'a pas été modifiée
+    base = base_partagee(stockage)
+    assert base['version'] == initiale['version'] + 4
+    assert sorted(base['faits'].loc[base['faits']['DATE'] == 202403, 'IDENTIFIANT']) == ['100', '200', '300']
+    assert montant(base['faits'], '100', 202401) == [5.0]
+    pd.testing.assert_frame_equal(initiale['faits'], faits_initiaux)
+    pd.testing.assert_frame_equal(charger_base_sqlite(stockage['chemin'])[1], base['faits'], check_dtype=False)
+
+
+# === LECTURE DES FACTURES ===
+def classeur_factures(chemin, lignes, iso_dates=False):
+    """Fichier de factures BT ; une valeur datetime de caract est écrite au format date"""
+    classeur = openpyxl.Workbook()
+    classeur.iso_dates = iso_dates
+    feuille = classeur.active
+    feuille.append(['reference contrat', 'Montant facture TTC', 'conso', 'caract'])
+    for ligne in lignes:
+        feuille.append(list(ligne))
+        if isinstance(ligne[3], datetime):
+            feuille.cell(feuille.max_row, 4).number_format = 'dd/mm/yyyy'
+    classeur.save(chemin)
+    return str(chemin)
+
+@pytest.mark.parametrize('iso_dates', [False, True])
+def test_xlsx_periode_au_format_date(tmp_path, iso_dates):
+    # Numéro de série sous un format de date, ou date ISO (t="d") : pas une période AAAAMM
+    chemin = classeur_factures(tmp_path / 'factures.xlsx', [
+        ('100', 1500.5, 3, 202404), ('200', 2000, 4, datetime(2024, 4, 1)), ('300', 10, 5, '04/2024'),
+    ], iso_dates=iso_dates)
+    df = lire_factures(chemin, 'BT')
+    assert df['caract'].iloc[0] == 202404 and df['caract'].iloc[2] == 202404
+    assert pd.isna(df['caract'].iloc[1])
+    assert df['Montant facture TTC'].tolist() == [1500.5, 2000.0, 10.0]
+
+def test_csv_virgule_decimale(tmp_path):
+    chemin = tmp_path / 'factures_BT.csv'
+    chemin.write_text(
+        'reference contrat;Montant facture TTC;conso;caract\n'
+        '100;1 500,5;12,25;202403\n'
+        '200;2000,25;3;202403\n'
+        '300;abc;4;202403\n',
+        encoding='utf-8'
+    )
+    df = lire_factures(str(chemin), 'BT')
+
+    assert df['Montant facture TTC'].tolist()[:2] == [1500.5, 2000.25]
+    assert np.isnan(df['Montant facture TTC'].iloc[2])
+    assert df['conso'].tolist() == [12.25, 3.0, 4.0]
+    assert df.attrs['montants_illisibles'] == 1 and df.attrs['exemples_illisibles'] == ['abc']
+
+    # Le montant illisible ne remplace pas le montant déjà en base
+    df_sites, df_faits = base_test(periodes=(202403,))
+    df_faits, _ = upserter_faits(df_faits, importer_factures(df_sites, df, 'BT'))
+    assert montant(df_faits, '100', 202403) == [1500.5]
+    assert montant(df_faits, '300', 202403) == [3000.0]
+
+@pytest.mark.parametrize('encodage', ['cp1252', 'utf-8-sig', 'utf-8'])
+def test_csv_accents_selon_l_encodage(tmp_path, encodage):
+    # Export « CSV ; » d'Excel sous Windows : cp1252, accents dans l'en-tête et les données
+    chemin = tmp_path / 'factures_BT.csv'
+    chemin.write_bytes(
+        'reference contrat;Désignation du site;Montant facture TTC;conso;caract\n'
+        '100;Agence Côte Est;1 500,5;12;202403\n'
+        '200;Siège Cocody;2000;3;202403\n'.encode(encodage)
+    )
+    df = lire_factures(str(chemin), 'BT')
+    assert df['Montant facture TTC'].tolist() == [1500.5, 2000.0]
+    assert df['reference contrat'].tolist() == ['100', '200']
+    assert 'Désignation du site' in df.attrs['colonnes_source']
+    assert df.attrs['colonnes_source'][0] == 'reference contrat'
+
+def test_montant_illisible_ne_remplace_pas():
+    df_sites, df_faits = base_test()
+    df_faits, ecritures = upserter_faits(df_faits, faits([('100', 202401, np.nan, 42.0)]))
+
+    assert montant(df_faits, '100', 202401) == [1000.0]
+    assert df_faits.loc[df_faits['IDENTIFIANT'] == '100', 'CONSO'].tolist()[0] == 42.0
+    assert ecritures['resume']['remplacements'] == 1
+
+
+# === GÉNÉRATION ===
+def test_remplir_template():
+    df_periode = pd.DataFrame({
+        'IDENTIFIANT': ['0123', '456', '456', '789'],
+        'SITES': ['SITE A', 'SITE B', 'SITE B BIS', 'SITE C'],
+        'MONTANT': [10.0, 20.0, 99.0, 30.0],
+        'DATE': 202403,
+    })
+    df_template = pd.DataFrame({
+        'IDENTIFIANT': ['0123', '456.0', ' 789 ', '999', None],
+        'MONTANT': [None] * 5,
+        'LIBELLE COMPLEMENTAIRE': ['ancien'] * 5,
+    })
+    df_export, rapport = remplir_template(df_template, df_periode, 'BT', 202403)
+
+    assert df_export['MONTANT'].tolist()[:3] == [10.0, 20.0, 30.0]
+    assert df_export['MONTANT'].iloc[3:].isna().all()
+    assert df_export['LIBELLE COMPLEMENTAIRE'].tolist() == [
+        'CIE BT 202403 SITE A', 'CIE BT 202403 SITE B', 'CIE BT 202403 SITE C', 'ancien', 'ancien']
+    assert rapport['trouves'] == 3 and rapport['total'] == 60.0
+    assert rapport['non_trouves'] == ['', '999']
+    assert rapport['doublons_periode'] == ['456']
+
+def test_lot_zip_et_manifeste():
+    df_sites, df_faits = base_test(periodes=(202401, 202402, 202403))
+    df_periodes = joindre_base(df_sites, df_faits)
+    df_template = pd.DataFrame({'IDENTIFIANT': ['100', '200', '999'], 'MONTANT': [None] * 3})
+    avancement = []
+    contenu, manifeste = generer_lot_zip(
+        {'BT': df_template, 'HT': df_template}, df_periodes, [202403, 202401, 202412], max_workers=2,
+        progression=lambda fait, total, ligne: avancement.append((fait, total))
+    )
+
+    # Période absente de la base ignorée ; manifeste trié par période puis tension
+    assert manifeste['FICHIER'].tolist() == [
+        'FACTURAT_ELECTRICITE_BT_202401.xlsx', 'FACTURAT_ELECTRICITE_HT_202401.xlsx',
+        'FACTURAT_ELECTRICITE_BT_202403.xlsx', 'FACTURAT_ELECTRICITE_HT_202403.xlsx']
+    assert manifeste['LIGNES_TEMPLATE'].tolist() == [3] * 4
+    assert manifeste['LIGNES_MISES_A_JOUR'].tolist() == [2] * 4
+    assert manifeste['NON_TROUVES'].tolist() == [1] * 4
+    assert manifeste['TOTAL_MONTANT'].tolist() == [3000.0] * 4
+    assert sorted(avancement) == [(1, 4), (2, 4), (3, 4), (4, 4)]
+
+    with zipfile.ZipFile(io.BytesIO(contenu)) as archive:
+        assert sorted(archive.namelist()) == sorted(manifeste['FICHIER'].tolist() + ['manifeste.csv'])
+        lu = pd.read_csv(archive.open('manifeste.csv'), sep=';')
+        assert lu['FICHIER'].tolist() == manifeste['FICHIER'].tolist()
+        classeur = openpyxl.load_workbook(archive.open('FACTURAT_ELECTRICITE_BT_202401.xlsx'))
+        assert classeur.active.max_row > 1
+
+
+
+# === EXPORTS EXCEL ===
+def test_mise_en_page_export_cie():
+    df = pd.DataFrame({'REFERENCE': ['R1', 'R2'], 'SITES': ['A', None], 'MONTANT': [10.5, 20.0], 'LIBELLE': ['x', 'y']})
+    feuille = openpyxl.load_workbook(export_factures_cie(df, 'HT')).active
+    lignes = list(feuille.values)
+
+    assert lignes[0][0] == "⚡ COMPAGNIE IVOIRIENNE D'ÉLECTRICITÉ (CIE)"
+    assert lignes[2][0] == 'FACTURES HAUTE TENSION (HT) - RAPPORT MENSUEL'
+    assert lignes[3][3:5] == ('Montant', '30 FCFA') and lignes[4][:2] == ('Nombre de factures:', 2)
+    assert lignes[6][:4] == ('REFERENCE', 'SITES', 'MONTANT', 'LIBELLE')
+    assert lignes[7][:4] == ('R1', 'A', 10.5, 'x') and lignes[8][:4] == ('R2', None, 20, 'y')
+    assert feuille['A7'].style == 'entete_colonne' and feuille['A8'].style == 'donnee'
+    assert feuille['C8'].style == 'donnee_montant' and feuille['C8'].number_format == '#,##0'
+    assert feuille.column_dimensions['D'].width == 15
+
+    # Signatures : titre 3 lignes après les données, cadres fusionnés, Nom / Date
+    assert lignes[11][0] == 'SIGNATURES ET APPROBATIONS'
+    assert [v for v in lignes[13] if v] == ['Préparé par:', 'Vérifié par:', 'Validé par:', 'Approuvé par:']
+    assert [v for v in lignes[18] if v] == ['Nom:'] * 4 and [v for v in lignes[19] if v] == ['Date:'] * 4
+    assert {str(plage) for plage in feuille.merged_cells.ranges} == {
+        'A1:D2', 'A3:D3', 'A12:D12', 'A15:C18', 'D15:F18', 'G15:I18', 'J15:L18'}
+
+def test_mise_en_page_export_base_centrale():
+    df_sites, df_faits = base_test()
+    df = joindre_base(df_sites, df_faits)
+    feuille = openpyxl.load_workbook(export_base_centrale(df)).active
+    lignes = list(feuille.values)
+
+    assert lignes[0][0] == '📊 BASE CENTRALE - COCODY'
+    assert lignes[4][:5] == ('Nombre de lignes:', 6, None, 'Sites uniques:', 3)
+    assert lignes[6] == tuple(df.columns)
+    assert len(lignes) == 7 + len(df) and lignes[-1][df.columns.get_loc('MONTANT')] == 3000
+    assert feuille.column_dimensions['C'].width == LARGEURS_BASE_CENTRALE['SITES']
+
+
+# === EXPORTS DANS LE POOL DE PROCESSUS ===
+def attendre_duree(type_export, empreinte):
+    """La durée est enregistrée par le rappel de fin du Future, juste après son résultat"""
+    for _ in range(500):
+        duree = duree_export(type_export, empreinte)
+        if duree is not None:
+            return duree
+        time.sleep(0.01)
+
+def test_export_dans_le_pool():
+    df_sites, df_faits = base_test(identifiants=[str(i) for i in range(3000)], periodes=(202401, 202402))
+    df = joindre_base(df_sites, df_faits)
+    empreinte = empreinte_dataframe(df)
+    future = soumettre_export(df, 'CENTRALE', empreinte)
+
+    avancements = []
+    while not future.done():
+        avancements.append(avancement_export('CENTRALE', empreinte))
+        time.sleep(0.01)
+    assert avancements == sorted(avancements) and all(0 <= a <= 1 for a in avancements)
+    assert avancement_export('CENTRALE', empreinte) == 1.0
+
+    lignes = list(openpyxl.load_workbook(io.BytesIO(future.result()), read_only=True).active.values)
+    entete = lignes.index(tuple(df.columns))
+    assert len(lignes) - entete - 1 == len(df)
+    assert lignes[-1][df.columns.get_loc('IDENTIFIANT')] == df['IDENTIFIANT'].iloc[-1]
+    assert attendre_duree('CENTRALE', empreinte) > 0
+    assert duree_export('CENTRALE', empreinte) is None
+
+    # Classeur déjà construit : servi par le cache, sans passer par le pool
+    cache = soumettre_export(df, 'CENTRALE', empreinte)
+    assert cache.done() and cache.result() == future.result()
+
+def test_durees_d_exports_bornees():
+    futures = [soumettre_export(faits([(str(i), 202401, float(i), 1.0)]), 'CENTRALE') for i in range(TAILLE_CACHE_EXPORTS + 3)]
+    for future in futures:
+        future.result()
+    time.sleep(0.2)
+    assert len(moteur_factures._DUREES_EXPORTS) <= TAILLE_CACHE_EXPORTS
+
+
+# === FILE DE TRAVAUX ===
+def attendre_travail(chemin_db, id_travail):
+    for _ in range(1000):
+        travail = lire_travail(chemin_db, id_travail)
+        if travail['statut'] not in ('en_attente', 'en_cours'):
+            return travail
+        time.sleep(0.01)
+    raise AssertionError(f"travail {id_travail} toujours {travail['statut']}")
+
+def test_travaux_relances_apres_redemarrage(tmp_path):
+    stockage = {'format': 'sqlite', 'chemin': str(tmp_path / 'base.db')}
+    df_sites, df_faits = base_test()
+    # L'import n°1 avait écrit dans la base quand le serveur s'est arrêté, avant d'être marqué terminé
+    df_faits, _ = upserter_faits(df_faits, faits([('100', 202403, 5.0, 1.0)]))
+    sauvegarder_base_sqlite(stockage['chemin'], df_sites, df_faits)
+
+    chemin_db = str(tmp_path / 'travaux.db')
+    registre = str(tmp_path / 'imports.json')
+    travaux = []
+    for num, (statut, contenu) in enumerate([('en_cours', '100;5;1;202403'), ('en_attente', '200;6;2;202403')], start=1):
+        fichier = tmp_path / f'factures_{num}.csv'
+        fichier.write_text('reference contrat;Montant facture TTC;conso;caract\n' + contenu + '\n', encoding='utf-8')
+        parametres = {'tension': 'BT', 'stockage': stockage, 'registre': registre,
+                      'fichiers': [{'fichier': str(fichier), 'nom': fichier.name, 'empreinte': f'e{num}'}]}
+        with moteur_factures._connexion_travaux(chemin_db) as con:
+            travaux.append(con.execute(
+                "INSERT INTO travaux (type, libelle, parametres, statut, cree_le) VALUES ('import', ?, ?, ?, '')",
+                (f'Import {num}', json.dumps(parametres), statut)
+            ).lastrowid)
+        con.close()
+
+    demarrer_travaux(chemin_db)
+    premier, second = (attendre_travail(chemin_db, id_travail) for id_travail in travaux)
+
+    assert premier['statut'] == 'termine' and second['statut'] == 'termine'
+    assert not premier['modifie_base'] and second['modifie_base']
+    base = charger_base_sqlite(stockage['chemin'])[1]
+    assert montant(base, '100', 202403) == [5.0] and montant(base, '200', 202403) == [6.0]
+    assert set(lire_registre_imports(registre)) == {'e1', 'e2'}
+    assert not any(tmp_path.glob('factures_*.csv'))